@@ -0,0 +1,40 @@
+import argparse
+import json
+
+
+def load(path):
+    with open(path) as results_file:
+        results = json.load(results_file)['results']
+    return {(result['benchmark'], result['sites']): result['metrics'] for result in results}
+
+
+def compare(old, new):
+    # rows of (benchmark, sites, metric, old value, new value, change in percent)
+    rows = []
+    for key in sorted(set(old) & set(new)):
+        for metric in sorted(set(old[key]) & set(new[key])):
+            before, after = old[key][metric], new[key][metric]
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else None
+            rows.append(key + (metric, before, after, change))
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Compares two results of benchmarks/run.py.')
+    parser.add_argument('old', help='results before the change')
+    parser.add_argument('new', help='results after the change')
+    return parser.parse_args(argv)
+
+
+def main(args):
+    line = '{:<12} {:>7} {:<26} {:>14} {:>14} {:>9}'
+    print(line.format('benchmark', 'sites', 'metric', 'old', 'new', 'change'))
+    for benchmark, sites, metric, before, after, change in compare(load(args.old), load(args.new)):
+        print(line.format(benchmark, sites, metric, before, after,
+                          '-' if change is None else '{:+.1f}%'.format(change)))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,287 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+if __name__ == '__main__':
+    # the checks run on the gevent engine, which needs the standard library patched first
+    from gevent import monkey
+    monkey.patch_all()
+
+import gevent
+import gevent.event
+import yaml
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'monitor'))
+
+from green import Monitor  # noqa: E402
+from resource import MonitoredResource, ResourceResponse, ResourceStatus  # noqa: E402
+from session import SessionPool  # noqa: E402
+from workqueue import Job  # noqa: E402
+
+# the mix of schedules and conditions of the synthetic sites
+SCHEDULES = ('* * * * *', '*/5 * * * *', '*/15 * * * *', '0 * * * *', '*/2 8-18 * * 1-5')
+CONDITIONS = (
+    {'status': 200},
+    {'status': 200, 'content': 'benchmark page'},
+    {'status': 200, 'regex': r'<p>\w+ page</p>'},
+    {'status': 200, 'content': ['<html>', 'benchmark', '</body>']},
+)
+
+
+def synthetic_config(count, base_url, log_file):
+    sites = {}
+    for number in range(count):
+        sites['site-{:06d}'.format(number)] = {
+            'url': '{}/site/{}'.format(base_url, number),
+            'schedule': SCHEDULES[number % len(SCHEDULES)],
+            'conditions': CONDITIONS[number % len(CONDITIONS)],
+        }
+    return {'log_file': log_file, 'sites': sites}
+
+
+class BenchMonitor(Monitor):
+    # counts the recorded results so the throughput benchmark knows when all the checks are done
+
+    def __init__(self):
+        super().__init__()
+        self.expected = 0
+        self.recorded = 0
+        self.all_recorded = gevent.event.Event()
+
+    def _record(self, resource, response):
+        super()._record(resource, response)
+        self.recorded += 1
+        if self.recorded >= self.expected:
+            self.all_recorded.set()
+
+
+def rss_bytes():
+    # the resident set size from /proc, None where it isn't available
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def bench_config_load(path):
+    monitor = BenchMonitor()
+    start = time.perf_counter()
+    monitor.load_config(path)
+    metrics = {'load_ms': milliseconds(time.perf_counter() - start)}
+
+    # the first load with a cache writes it, the second one reads it
+    for _ in range(2):
+        cached = BenchMonitor()
+        cached.config_cache = path + '.cache'
+        start = time.perf_counter()
+        cached.load_config(path)
+    metrics['cached_load_ms'] = milliseconds(time.perf_counter() - start)
+    return monitor, metrics
+
+
+def bench_memory(sites):
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    resources = [MonitoredResource(section, name=name) for name, section in sites.items()]
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    rss_after = rss_bytes()
+    metrics = {'traced_bytes_per_resource': round(traced / len(resources), 1)}
+    if rss_before is not None:
+        metrics['rss_bytes_per_resource'] = round((rss_after - rss_before) / len(resources), 1)
+    del resources
+    return metrics
+
+
+def bench_scheduler(monitor, ticks):
+    start = time.perf_counter()
+    monitor._start_timetable()
+    build = time.perf_counter() - start
+
+    durations, due = [], []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        jobs = monitor._due_jobs()
+        durations.append(time.perf_counter() - start)
+        due.append(sum(len(job.resources) for job in jobs))
+    return {
+        'timetable_build_ms': milliseconds(build),
+        'tick_mean_ms': milliseconds(statistics.mean(durations)),
+        'tick_max_ms': milliseconds(max(durations)),
+        'due_per_tick_mean': round(statistics.mean(due), 1),
+    }
+
+
+def fill_results(monitor):
+    # one result for every resource with a few checks in its history, one in ten failed
+    now = time.time()
+    for number, resource in enumerate(monitor.resources):
+        failed = number % 10 == 0
+        for age in range(5):
+            resource.history.append(now - age * 60, 0.05 + (number % 7) / 100, 500 if failed else 200, not failed)
+        response = ResourceResponse(resource, ResourceStatus.FAIL if failed else ResourceStatus.SUCCESS,
+                                    duration=0.1, message='Invalid response code: 500 (expected 200)'
+                                    if failed else None)
+        response.code = 500 if failed else 200
+        monitor.recent_responses[resource] = response
+
+
+def request(monitor, path, query='', **headers):
+    environ = dict(PATH_INFO=path, QUERY_STRING=query, REQUEST_METHOD='GET', **headers)
+    result = {}
+
+    def start_response(status, response_headers):
+        result.update(status=status, headers=dict(response_headers))
+
+    start = time.perf_counter()
+    body = b''.join(monitor._report_application(environ, start_response))
+    return time.perf_counter() - start, result, body
+
+
+def bench_render(monitor, repeat):
+    fill_results(monitor)
+    cold = []
+    for _ in range(repeat):
+        monitor.report_cache = (None, None)
+        duration, result, body = request(monitor, '/')
+        cold.append(duration)
+    cached = [request(monitor, '/')[0] for _ in range(repeat)]
+    not_modified = [request(monitor, '/', HTTP_IF_NONE_MATCH=result['headers']['ETag'])[0] for _ in range(repeat)]
+    api = [request(monitor, '/api/results', 'limit=100')[0] for _ in range(repeat)]
+    return {
+        'page_ms': milliseconds(statistics.median(cold)),
+        'page_bytes': len(body),
+        'cached_page_ms': milliseconds(statistics.median(cached)),
+        'not_modified_ms': milliseconds(statistics.median(not_modified)),
+        'api_page_ms': milliseconds(statistics.median(api)),
+    }
+
+
+def start_stub_server(args):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_server.py'),
+               '--port', str(port), '--latency', str(args.latency), '--body-size', str(args.body_size),
+               '--statuses', args.statuses]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, 'http://127.0.0.1:{}'.format(port)
+        except OSError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise
+            gevent.sleep(0.05)
+
+
+def bench_checks(base_url, count, args, log_file):
+    config = synthetic_config(count, base_url, log_file)
+    monitor = BenchMonitor()
+    monitor.resources = [MonitoredResource(section, name=name) for name, section in config['sites'].items()]
+    monitor.sessions = SessionPool(pool_size=args.pool_size)
+    monitor.concurrency = {'initial': args.concurrency, 'maximum': args.concurrency, 'per_host': args.concurrency}
+    monitor.limiter = monitor._build_limiter(gevent.event.Event)
+    monitor.queue_size = count
+    monitor.workq = monitor._build_work_queue(gevent.event.Event)
+    monitor.expected = count
+
+    supervisor = gevent.spawn(monitor._supervisor_job)
+    start = time.perf_counter()
+    now = datetime.datetime.now()
+    for resource in monitor.resources:
+        monitor.workq.put(Job([resource], now), now=now)
+    monitor.all_recorded.wait()
+    elapsed = time.perf_counter() - start
+    supervisor.kill()
+    monitor.sessions.close()
+
+    durations = sorted(response.duration for response in monitor.recent_responses.values() if response.duration)
+    return {
+        'checks_per_second': round(count / elapsed, 1),
+        'duration_p50_ms': milliseconds(durations[len(durations) // 2]) if durations else None,
+        'duration_p99_ms': milliseconds(durations[int(len(durations) * 0.99)]) if durations else None,
+        'failed': sum(response.status == ResourceStatus.FAIL for response in monitor.recent_responses.values()),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the monitor against a local stub server.')
+    parser.add_argument('--sites', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='sizes of the synthetic configs')
+    parser.add_argument('--checks', type=int, default=2000, help='checks sent through the pool')
+    parser.add_argument('--concurrency', type=int, default=100, help='checks in flight')
+    parser.add_argument('--pool-size', type=int, default=100, help='connections kept per host')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every stub response')
+    parser.add_argument('--body-size', type=int, default=16 * 1024, help='bytes of every stub body')
+    parser.add_argument('--statuses', default='200:0.95,500:0.05', help='shares of the stub status codes')
+    parser.add_argument('--ticks', type=int, default=10, help='scheduler ticks measured')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions of the render measurements')
+    parser.add_argument('--output', help='file the JSON results are written to, standard output by default')
+    return parser.parse_args(argv)
+
+
+def main(args):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        log_file = os.path.join(directory, 'monitor.log')
+        process, base_url = start_stub_server(args)
+        try:
+            for count in args.sites:
+                config = synthetic_config(count, base_url, log_file)
+                path = os.path.join(directory, 'sites-{}.yaml'.format(count))
+                with open(path, 'w') as config_file:
+                    yaml.safe_dump(config, config_file)
+
+                monitor, metrics = bench_config_load(path)
+                results.append({'benchmark': 'config_load', 'sites': count, 'metrics': metrics})
+                results.append({'benchmark': 'memory', 'sites': count, 'metrics': bench_memory(config['sites'])})
+                results.append({'benchmark': 'scheduler', 'sites': count,
+                                'metrics': bench_scheduler(monitor, args.ticks)})
+                results.append({'benchmark': 'render', 'sites': count, 'metrics': bench_render(monitor, args.repeat)})
+                del monitor
+                gc.collect()
+
+            results.append({'benchmark': 'checks', 'sites': args.checks,
+                            'metrics': bench_checks(base_url, args.checks, args, log_file)})
+        finally:
+            process.terminate()
+            process.wait()
+
+    output = {
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {name: value for name, value in vars(args).items() if name != 'output'},
+        'results': results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,72 @@
+import argparse
+import hashlib
+from http import HTTPStatus
+
+if __name__ == '__main__':
+    from gevent import monkey
+    monkey.patch_all()
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+
+def parse_statuses(value):
+    # "200:0.9,500:0.1" -> [(200, 0.9), (500, 0.1)]
+    statuses = []
+    for item in value.split(','):
+        code, _, share = item.partition(':')
+        statuses.append((int(code), float(share or 1)))
+    return statuses
+
+
+class StubApplication:
+    # Answers every request after `latency` seconds with a body of `body_size` bytes. The status codes are
+    # mixed in the given shares by the hash of the path, so the same site always gets the same status.
+
+    def __init__(self, latency=0.0, body_size=16 * 1024, statuses=((200, 1.0), )):
+        self.latency = latency
+        total = sum(share for _, share in statuses)
+        self.statuses = []
+        threshold = 0.0
+        for code, share in statuses:
+            threshold += share / total
+            self.statuses.append((threshold, '{} {}'.format(code, HTTPStatus(code).phrase)))
+        text = '<html><body><p>benchmark page</p>'
+        self.body = (text + 'x' * max(body_size - len(text) - len('</body></html>'), 0) + '</body></html>').encode()
+
+    def status(self, path):
+        digest = hashlib.blake2b(path.encode('utf-8'), digest_size=8).digest()
+        point = int.from_bytes(digest, 'little') / 2 ** 64
+        for threshold, status in self.statuses:
+            if point < threshold:
+                return status
+        return self.statuses[-1][1]
+
+    def __call__(self, environ, start_response):
+        if self.latency:
+            gevent.sleep(self.latency)
+        headers = [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(self.body))),
+        ]
+        start_response(self.status(environ.get('PATH_INFO', '/')), headers)
+        return [self.body]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Stub HTTP server for the benchmarks.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every response')
+    parser.add_argument('--body-size', type=int, default=16 * 1024, help='bytes of every body')
+    parser.add_argument('--statuses', type=parse_statuses, default=[(200, 1.0)],
+                        help='shares of the status codes, e.g. 200:0.9,500:0.1')
+    return parser.parse_args(argv)
+
+
+def main(args):
+    application = StubApplication(latency=args.latency, body_size=args.body_size, statuses=args.statuses)
+    WSGIServer(('127.0.0.1', args.port), application, log=None).serve_forever()
+
+
+if __name__ == '__main__':
+    main(parse_args())
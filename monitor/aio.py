@@ -0,0 +1,326 @@
+import asyncio
+import datetime
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+from requests.utils import get_encoding_from_headers
+
+from base import BaseMonitor, logger, no_check
+from crawler import Crawler, GroupCheck
+from resource import ResourceResponse, ResourceStatus
+from session import SessionPool
+
+
+class ResponseHead:
+    # the part of an aiohttp response read by the conditions and ResourceResponse, named like in requests
+
+    def __init__(self, response):
+        self.status_code = response.status
+        self.headers = response.headers
+        self.encoding = get_encoding_from_headers(response.headers)
+
+
+class ConnectionStats:
+    # counts requests and new connections per host from aiohttp tracing signals, like SessionPool.stats()
+
+    def __init__(self):
+        self.hosts = {}
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        return trace_config
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'host': host, 'requests': 0, 'connections': 0}
+        return self.hosts[host]
+
+    async def _on_request_start(self, session, context, params):
+        context.host = SessionPool.host(str(params.url))
+        self._host(context.host)['requests'] += 1
+
+    async def _on_connection_create_end(self, session, context, params):
+        self._host(context.host)['connections'] += 1
+
+    def stats(self):
+        hosts = [dict(host, reused=host['requests'] - host['connections'])
+                 for _, host in sorted(self.hosts.items())]
+        requests_count = sum(host['requests'] for host in hosts)
+        connections = sum(host['connections'] for host in hosts)
+        return {
+            'hosts': hosts,
+            'requests': requests_count,
+            'connections': connections,
+            'reused': requests_count - connections,
+        }
+
+
+class PhaseTimer:
+    # Times the phases of a request from aiohttp tracing signals into the dict passed as `trace_request_ctx`.
+    # aiohttp doesn't signal the TLS handshake apart from the connect, so `connect` includes it and `tls`
+    # stays None; `dns` is None when the address came from the DNS cache.
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_dns_resolvehost_start.append(self._on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(self._on_dns_resolvehost_end)
+        trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_request_end.append(self._on_request_end)
+        return trace_config
+
+    @staticmethod
+    def _phases(context):
+        return context.trace_request_ctx if isinstance(context.trace_request_ctx, dict) else None
+
+    async def _on_request_start(self, session, context, params):
+        context.request_start = time.perf_counter()
+        context.connecting = 0.0
+
+    async def _on_dns_resolvehost_start(self, session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def _on_dns_resolvehost_end(self, session, context, params):
+        phases = self._phases(context)
+        if phases is not None:
+            phases['dns'] = time.perf_counter() - context.dns_start
+
+    async def _on_connection_create_start(self, session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def _on_connection_create_end(self, session, context, params):
+        context.connecting = time.perf_counter() - context.connect_start
+        phases = self._phases(context)
+        if phases is not None:
+            phases['connect'] = context.connecting - (phases['dns'] or 0.0)
+
+    async def _on_request_end(self, session, context, params):
+        phases = self._phases(context)
+        if phases is not None:
+            phases['ttfb'] = time.perf_counter() - context.request_start - context.connecting
+
+
+class AsyncCrawler:
+    headers = Crawler.headers
+    chunk_size = Crawler.chunk_size
+    drain_size = Crawler.drain_size
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10)
+    request_headers = Crawler.request_headers
+
+    def __init__(self, resource, session, group=None):
+        self.resource = resource
+        self.session = session
+        self.group = group or [resource]
+        self.timed_out = False
+
+    async def check(self):
+        return (await self.check_group())[0]
+
+    async def check_group(self):
+        phases = dict.fromkeys(ResourceResponse.phase_names)
+        try:
+            start = time.perf_counter()
+            async with self.session.get(self.resource.url, headers=self.request_headers(), timeout=self.timeout,
+                                        trace_request_ctx=phases) as response:
+                head = ResponseHead(response)
+                received = time.perf_counter()
+                try:
+                    verdicts = await self._check_conditions(head, response)
+                finally:
+                    phases['download'] = time.perf_counter() - received
+                    duration = time.perf_counter() - start
+                    await self._release(response)
+                return [ResourceResponse(resource=resource, status=status, response=head, duration=duration,
+                                         message=message, phases=dict(phases))
+                        for resource, (status, message) in zip(self.group, verdicts)]
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.timed_out = isinstance(e, asyncio.TimeoutError)
+            return [ResourceResponse(resource=resource, status=ResourceStatus.FAIL,
+                                     message='Connection error. Unable to check the website.')
+                    for resource in self.group]
+
+    async def _check_conditions(self, head, response):
+        if len(self.group) == 1 and self.resource.verdicts.not_modified(head):
+            return [self.resource.verdicts.last]
+        check = GroupCheck(self.group, head)
+        if not check.done:
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                if check.feed(chunk):
+                    break
+        return check.finish()
+
+    async def _release(self, response):
+        # an unread body closes the connection, so read a short remainder to return it to the pool
+        drained = 0
+        try:
+            while drained <= self.drain_size and not response.content.at_eof():
+                chunk = await response.content.read(self.chunk_size)
+                if not chunk:
+                    break
+                drained += len(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+
+class AsyncMonitor(BaseMonitor):
+    # The asyncio engine, with the same checks, results and report as the gevent one.
+
+    def __init__(self):
+        super().__init__()
+        # tasks
+        self.workq = None
+        self.wakeup = None
+        self.session = None
+        self.connections = ConnectionStats()
+        self.phase_timer = PhaseTimer()
+        self.semaphore_recent_responses = threading.Lock()
+        self.tasks = set()
+
+    def run(self, config_file):
+        self.load_config(config_file)
+        asyncio.get_event_loop().run_until_complete(self.serve(self.port))
+
+    async def serve(self, port=8000):
+        self.workq = self._build_work_queue(asyncio.Event)
+        self.wakeup = asyncio.Event()
+        self.limiter = self._build_limiter(asyncio.Event)
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size, keepalive_timeout=self.idle_timeout)
+        async with aiohttp.ClientSession(connector=connector,
+                                         trace_configs=[self.connections.trace_config(),
+                                                        self.phase_timer.trace_config()]) as session:
+            self.session = session
+            runner = web.AppRunner(self._report_server())
+            await runner.setup()
+            await web.TCPSite(runner, port=port).start()
+            self._install_reload_signal()
+            try:
+                await asyncio.gather(self._scheduler_job(), self._supervisor_job(), self._reload_job())
+            finally:
+                await runner.cleanup()
+
+    async def _worker(self, job):
+        host = job.host
+        waiter = self.limiter.acquire(host)
+        if waiter is not None:
+            await waiter.wait()
+            if job.expired(datetime.datetime.now()):
+                self.limiter.cancel(host)
+                self.workq.done(job, dropped=True)
+                return
+        responses = [None]
+        crawler = AsyncCrawler(job.resources[0], self.session, group=job.resources)
+        try:
+            responses = await crawler.check_group()
+        finally:
+            self._release_slot(host, responses[0], crawler.timed_out)
+            self.workq.done(job)
+        for resource, response in zip(job.resources, responses):
+            self._record(resource, response)
+
+    async def _supervisor_job(self):
+        while True:
+            await self.workq.ready.wait()
+            job = self.workq.get()
+            if job is not None:
+                # the number of running checks is bounded by the work queue and the limiter
+                task = asyncio.ensure_future(self._worker(job))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def _scheduler_job(self):
+        self._start_timetable()
+
+        while True:
+            delay = self._next_delay() if self.timetable else None
+            if delay is None or delay > 0:
+                # a config reload wakes the scheduler up when it adds resources
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            for job in self._due_jobs():
+                # a full queue holds the scheduler back until the workers catch up
+                await self.workq.not_full.wait()
+                self.workq.put(job)
+
+    async def _reload_job(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if self._config_changed():
+                try:
+                    self.reload_config()
+                except Exception:
+                    # the running config is kept and the next change is picked up
+                    logger.exception('The config has not been reloaded.', extra=no_check)
+
+    def _wake_scheduler(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def _compact_store(self, snapshot):
+        asyncio.ensure_future(self._compaction_job(snapshot))
+
+    async def _compaction_job(self, snapshot):
+        compaction = await asyncio.get_event_loop().run_in_executor(None, self.store.prepare_compaction, snapshot)
+        self.store.finish_compaction(compaction)
+
+    def _report_server(self):
+        app = web.Application()
+        app.router.add_get('/events', self._events_handler)
+        app.router.add_route('*', '/{path:.*}', self._report_handler)
+        return app
+
+    async def _events_handler(self, request):
+        subscriber = self._subscribe(asyncio.Event)
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        try:
+            await response.prepare(request)
+            await response.write(b'retry: 5000\n\n')
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.event.wait(), self.events_keepalive)
+                except asyncio.TimeoutError:
+                    await response.write(b': keep-alive\n\n')
+                    continue
+                if subscriber.overflowed:
+                    await response.write(b'event: reload\ndata: {}\n\n')
+                    return response
+                for message in subscriber.pop():
+                    await response.write(message)
+        finally:
+            self.subscribers.discard(subscriber)
+
+    async def _report_handler(self, request):
+        # serves the WSGI report application of the base class
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'PATH_INFO': request.path,
+            'QUERY_STRING': request.query_string,
+            'SERVER_PROTOCOL': 'HTTP/{}.{}'.format(*request.version),
+        }
+        for name, value in request.headers.items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started.update(status=status, headers=headers)
+
+        body = b''.join(self._report_application(environ, start_response))
+        return web.Response(status=int(started['status'].split()[0]), headers=started['headers'], body=body)
+
+    def _connection_stats(self):
+        return self.connections.stats()
+
+    def _gauges(self):
+        return super()._gauges() + [
+            ('monitor_active_tasks', 'Tasks running checks.', len(self.tasks)),
+        ]
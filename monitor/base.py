@@ -0,0 +1,547 @@
+import bisect
+import datetime
+import hashlib
+import json
+import logging
+import os
+import signal
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+
+import yaml
+
+from concurrency import ConcurrencyLimiter
+from configcache import ConfigCache
+from errors import InvalidConfigError
+from logwriter import BatchingHandler, JsonFormatter, TextFormatter
+from metrics import Metrics
+from resource import MonitoredResource, ResourceStatus
+from session import SessionPool
+from store import ResultStore
+from timerwheel import TimerWheel
+from workqueue import Job, WorkQueue
+
+logger = logging.getLogger('monitor')
+logger.setLevel(logging.INFO)
+# the fields of the log lines that aren't about a check
+no_check = dict.fromkeys(('url', 'status', 'response_code', 'response_time'))
+# the loader of libyaml is many times faster, the pure Python one is used when PyYAML is built without it
+yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+formatter = TextFormatter('%(asctime)s %(url)s %(status)s %(response_code)s %(response_time)s %(phases_text)s '
+                          '%(message)s')
+
+
+class RecentResponses(OrderedDict):
+    # the latest response of every resource, the version changes with every change of the content
+
+    def __init__(self):
+        self.version = 0
+        super().__init__()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+
+class Subscriber:
+    # queue of the server-sent events for one client of the report, `event` is set when there is a message;
+    # a client that falls too far behind gets told to reload instead of getting every missed row
+    size = 1000
+
+    def __init__(self, event_factory):
+        self.messages = deque()
+        self.event = event_factory()
+        self.overflowed = False
+
+    def push(self, message):
+        if len(self.messages) >= self.size:
+            self.overflowed = True
+            self.messages.clear()
+        elif not self.overflowed:
+            self.messages.append(message)
+        self.event.set()
+
+    def pop(self):
+        messages = list(self.messages)
+        self.messages.clear()
+        self.event.clear()
+        return messages
+
+
+class BaseMonitor:
+    # Config loading, scheduling, result bookkeeping and the report shared by the execution engines.
+    # Engines provide the lock guarding `recent_responses` and run the jobs.
+
+    # windows of the latency percentiles and the uptime ratio shown on the report
+    latency_window = 60 * 60
+    uptime_window = 24 * 60 * 60
+    # the latency and uptime windows slide, so a cached report expires after this many seconds anyway
+    report_ttl = 60
+    api_page_size = 100
+    api_max_page_size = 1000
+    # seconds between comments keeping idle event streams open
+    events_keepalive = 15
+    # seconds between checks of the modification time of the config file
+    reload_interval = 2
+
+    def __init__(self):
+        # tasks
+        self.timetable = TimerWheel()
+        self.semaphore_recent_responses = None
+        self.store = None
+        self.port = 8000
+        self.pool_size = 10
+        self.idle_timeout = 60
+        self.concurrency = {}
+        self.limiter = None
+        self.queue_size = 10000
+        self.workq = None
+        self.jitter = False
+        self.log_handler = None
+        # the file the compiled config is cached in, None when it isn't
+        self.config_cache = None
+        self.config_file = None
+        self.config_mtime = None
+        self.reload_requested = False
+
+        # resources
+        self.resources = []
+        self.site_configs = {}
+        self.recent_responses = RecentResponses()
+        self.report_cache = (None, None)
+        self.subscribers = set()
+        self.metrics = Metrics()
+
+        # environment, created with the first page rendered
+        self.env = None
+
+    def _set_log_handler(self, log_file, options):
+        for name in ('max_bytes', 'rotate_interval', 'backup_count', 'buffer_size'):
+            value = options.get(name)
+            if value is not None and (not isinstance(value, int) or value < 0):
+                raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                         'the "{}" of the "log" section'.format(value, name))
+        log_format = options.get('format', 'text')
+        if log_format not in ('text', 'json'):
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                     'the "format" of the "log" section'.format(log_format))
+
+        handler = BatchingHandler(log_file, max_bytes=options.get('max_bytes'),
+                                  rotate_interval=options.get('rotate_interval'),
+                                  backup_count=options.get('backup_count', 5),
+                                  buffer_size=options.get('buffer_size', 10000))
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(JsonFormatter() if log_format == 'json' else formatter)
+        if self.log_handler is not None:
+            logger.removeHandler(self.log_handler)
+            self.log_handler.close()
+        logger.addHandler(handler)
+        self.log_handler = handler
+
+    @classmethod
+    def _read_config(cls, config_file):
+        with open(config_file, 'rb') as yml_config:
+            return cls._parse_config(yml_config.read())
+
+    @staticmethod
+    def _parse_config(data):
+        cfg = yaml.load(data, Loader=yaml_loader)
+
+        if not cfg:
+            raise InvalidConfigError('Config file is empty.')
+        if not isinstance(cfg, dict):
+            raise InvalidConfigError('Invalid config file. The config is not a mapping of sections.')
+        return cfg
+
+    @staticmethod
+    def _sites(cfg):
+        sites = cfg.get('sites')
+        if not sites:
+            raise InvalidConfigError('Invalid config file. The "sites" section is missing.')
+        if not isinstance(sites, dict):
+            raise InvalidConfigError('Invalid config file. The "sites" section is invalid.')
+        return sites
+
+    def load_config(self, config_file):
+        self.config_file = config_file
+        self.config_mtime = self._config_mtime()
+        # the config is read once, the cache is keyed by the same bytes that are parsed
+        with open(config_file, 'rb') as yml_config:
+            data = yml_config.read()
+        cache = ConfigCache(self.config_cache, data) if self.config_cache else None
+        cached = cache.load() if cache else None
+        cfg = cached['cfg'] if cached else self._parse_config(data)
+        log_file = cfg.get('log_file')
+        if not log_file:
+            raise InvalidConfigError('Invalid config file. The "log_file" section is missing.')
+        self._set_log_handler(log_file, cfg.get('log') or {})
+
+        connection_pool = cfg.get('connection_pool') or {}
+        for name in ('size', 'idle_timeout'):
+            value = connection_pool.get(name)
+            if value is not None and (not isinstance(value, int) or value <= 0):
+                raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                         'the "{}" of the "connection_pool" section'.format(value, name))
+        self.pool_size = connection_pool.get('size', 10)
+        self.idle_timeout = connection_pool.get('idle_timeout', 60)
+
+        self.concurrency = cfg.get('concurrency') or {}
+        for name in ('per_host', 'initial', 'minimum', 'maximum'):
+            value = self.concurrency.get(name)
+            if value is not None and (not isinstance(value, int) or value <= 0):
+                raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                         'the "{}" of the "concurrency" section'.format(value, name))
+
+        self.queue_size = (cfg.get('queue') or {}).get('size', 10000)
+        if not isinstance(self.queue_size, int) or self.queue_size <= 0:
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                     'the "size" of the "queue" section'.format(self.queue_size))
+
+        self.jitter = (cfg.get('scheduler') or {}).get('jitter', False)
+        if not isinstance(self.jitter, bool):
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                     'the "jitter" of the "scheduler" section'.format(self.jitter))
+
+        if cached:
+            self.resources = cached['resources']
+            self.site_configs = dict(cfg['sites'])
+        else:
+            for name, section in self._sites(cfg).items():
+                self.resources.append(MonitoredResource(section, name=name, jitter=self.jitter))
+                self.site_configs[name] = section
+            if cache:
+                cache.save({'cfg': cfg, 'resources': self.resources})
+        for resource in self.resources:
+            self.metrics.register(resource)
+
+        store = cfg.get('store')
+        if store:
+            self._open_store(store)
+        return cfg
+
+    def _config_mtime(self):
+        try:
+            return os.stat(self.config_file).st_mtime
+        except OSError:
+            return None
+
+    def _config_changed(self):
+        return self.reload_requested or self._config_mtime() != self.config_mtime
+
+    def _install_reload_signal(self):
+        try:
+            signal.signal(signal.SIGHUP, self._request_reload)
+        except ValueError:
+            # signal handlers can be set only from the main thread
+            pass
+
+    def _request_reload(self, signum, frame):
+        # only sets a flag, the reload job reloads the config at its next turn
+        self.reload_requested = True
+
+    def reload_config(self):
+        # Rebuilds only the sites added, removed or changed since the last load. The other sections of the
+        # config are read at start-up only. An invalid config is logged and the running one is kept.
+        self.reload_requested = False
+        self.config_mtime = self._config_mtime()
+        try:
+            sites = self._sites(self._read_config(self.config_file))
+            built = {name: MonitoredResource(section, name=name, jitter=self.jitter)
+                     for name, section in sites.items() if self.site_configs.get(name) != section}
+        except (InvalidConfigError, OSError, yaml.YAMLError) as e:
+            logger.error('The config has not been reloaded: %s', e, extra=no_check)
+            return
+
+        current = {resource.name: resource for resource in self.resources}
+        retired = [resource for name, resource in current.items() if name not in sites or name in built]
+        for resource in retired:
+            self._retire(resource)
+        self.resources = [built.get(name) or current[name] for name in sites]
+        self.site_configs = dict(sites)
+
+        start = self._timetable_start()
+        for resource in built.values():
+            self.metrics.register(resource)
+            self._schedule(resource, start)
+        if built:
+            self._wake_scheduler()
+        if retired:
+            # the rows of the removed sites are on the pages already open
+            for subscriber in self.subscribers:
+                subscriber.push(b'event: reload\ndata: {}\n\n')
+        logger.info('The config has been reloaded: %s sites added, %s removed, %s changed.',
+                    len([name for name in built if name not in current]),
+                    len([name for name in current if name not in sites]),
+                    len([name for name in built if name in current]), extra=no_check)
+
+    def _retire(self, resource):
+        # the timetable entries of a retired resource are dropped when they come up, and the results
+        # of its checks still in flight are ignored
+        resource.retired = True
+        with self.semaphore_recent_responses:
+            if resource in self.recent_responses:
+                del self.recent_responses[resource]
+        self.metrics.unregister(resource)
+
+    def _wake_scheduler(self):
+        raise NotImplementedError
+
+    def _open_store(self, store):
+        if not store.get('path'):
+            raise InvalidConfigError('Invalid config file. The "path" of the "store" section is missing.')
+        for name in ('max_records', 'retention'):
+            value = store.get(name)
+            if value is not None and (not isinstance(value, int) or value <= 0):
+                raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                         'the "{}" of the "store" section'.format(value, name))
+        self.store = ResultStore(store['path'], max_records=store.get('max_records', 1000000),
+                                 retention=store.get('retention', 7 * 24 * 60 * 60),
+                                 keep_per_resource=max(resource.history.capacity for resource in self.resources))
+        restored = self.store.restore(self.resources)
+        with self.semaphore_recent_responses:
+            for resource in self.resources:
+                if resource in restored:
+                    self.recent_responses[resource] = restored[resource]
+
+    def _record(self, resource, response):
+        if resource.retired:
+            return
+        with self.semaphore_recent_responses:
+            self.recent_responses[resource] = response
+        resource.history.add(response, success=response.status == ResourceStatus.SUCCESS)
+        self.metrics.observe(response)
+        if self.store:
+            self.store.append(response)
+            if self.store.needs_compaction:
+                self._compact_store(self.store.start_compaction())
+        logger.info(response.message, extra=response.logger_info)
+        self._publish(response)
+
+    def _compact_store(self, snapshot):
+        # the engines write the compacted file off their event loop
+        self.store.finish_compaction(self.store.prepare_compaction(snapshot))
+
+    def _publish(self, response):
+        if not self.subscribers:
+            return
+        html = self._template('row.html').render(response=response, latency_window=self.latency_window,
+                                                   uptime_window=self.uptime_window)
+        message = 'event: row\ndata: {}\n\n'.format(json.dumps({'key': str(response.resource.key), 'html': html}))
+        message = message.encode('utf-8')
+        for subscriber in self.subscribers:
+            subscriber.push(message)
+
+    def _subscribe(self, event_factory):
+        subscriber = Subscriber(event_factory)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def _schedule(self, resource, after):
+        next_run = resource.next_run(after)
+        resource.next_due = next_run
+        if next_run is not None:
+            self.timetable.add(next_run, resource)
+
+    @staticmethod
+    def _timetable_start():
+        # start one minute back so resources matching the current minute are checked right away
+        return datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(minutes=1)
+
+    def _start_timetable(self):
+        self.timetable = TimerWheel()
+        start = self._timetable_start()
+        for resource in self.resources:
+            self._schedule(resource, start)
+
+    def _next_delay(self):
+        return (self.timetable.peek() - datetime.datetime.now()).total_seconds()
+
+    def _pop_due(self):
+        run_at, entries = self.timetable.pop()
+        self.metrics.scheduler_lag = (datetime.datetime.now() - run_at).total_seconds()
+        due = []
+        for moment, resource in entries:
+            if resource.retired:
+                continue
+            if self._owns(resource):
+                due.append(resource)
+            # the runs missed while the resource waited are skipped
+            self._schedule(resource, max(moment, run_at))
+        return due
+
+    def _owns(self, resource):
+        # every resource is checked here, a cluster node checks only its share
+        return True
+
+    @staticmethod
+    def _coalesce(resources):
+        # groups the due resources fetching the same URL, every group is fetched once
+        groups = OrderedDict()
+        for resource in resources:
+            groups.setdefault(resource.fetch_key, []).append(resource)
+        return list(groups.values())
+
+    def _due_jobs(self):
+        # the jobs of the next due resources, a job goes stale when one of its resources is due again
+        run_at = self.timetable.peek()
+        jobs = []
+        for group in self._coalesce(self._pop_due()):
+            deadlines = [resource.next_due for resource in group if resource.next_due is not None]
+            jobs.append(Job(group, run_at, min(deadlines) if deadlines else None, SessionPool.host(group[0].url)))
+        return jobs
+
+    def _per_host(self):
+        return self.concurrency.get('per_host', self.pool_size)
+
+    def _build_work_queue(self, event_factory):
+        # the jobs of a host at its limit stay queued, so they don't hold the workers the other hosts need
+        return WorkQueue(event_factory, size=self.queue_size, workers=self.concurrency.get('maximum', 100),
+                         per_host=self._per_host())
+
+    def _build_limiter(self, event_factory):
+        return ConcurrencyLimiter(event_factory, per_host=self._per_host(),
+                                  initial=self.concurrency.get('initial', 10),
+                                  minimum=self.concurrency.get('minimum', 1),
+                                  maximum=self.concurrency.get('maximum', 100))
+
+    def _release_slot(self, host, response, timed_out):
+        # only timeouts shrink the limit, a site that refuses connections or doesn't resolve is just down
+        if response is None:
+            self.limiter.release(host, timed_out=True)
+        else:
+            self.limiter.release(host, response.duration, timed_out=timed_out)
+
+    def _connection_stats(self):
+        raise NotImplementedError
+
+    def _concurrency_stats(self):
+        return self.limiter.stats()
+
+    def _gauges(self):
+        concurrency = self._concurrency_stats()
+        return [
+            ('monitor_concurrency_limit', 'Current global limit of checks in flight.', concurrency['limit']),
+            ('monitor_checks_in_flight', 'Checks in flight.', concurrency['inflight']),
+            ('monitor_checks_waiting', 'Checks waiting for a free slot.', concurrency['queued']),
+            ('monitor_timetable_size', 'Resources waiting in the scheduler timetable.', len(self.timetable)),
+            ('monitor_work_queue_depth', 'Jobs waiting in the work queue.', len(self.workq) if self.workq else 0),
+            ('monitor_event_subscribers', 'Clients listening to the report events.', len(self.subscribers)),
+        ]
+
+    def _counters(self):
+        connections = self._connection_stats()
+        return [
+            ('monitor_checks_skipped_total',
+             'Due checks skipped because the previous check was still waiting or running.',
+             self.workq.skipped if self.workq else 0),
+            ('monitor_checks_dropped_total',
+             'Checks dropped because they had not started before the next one was due.',
+             self.workq.dropped if self.workq else 0),
+            ('monitor_requests_total', 'Requests sent through the connection pools.', connections['requests']),
+            ('monitor_connections_total', 'Connections opened by the connection pools.', connections['connections']),
+            ('monitor_log_records_dropped_total', 'Log records dropped because the log buffer was full.',
+             self.log_handler.dropped if self.log_handler else 0),
+        ]
+
+    def _template(self, name):
+        if self.env is None:
+            # the report needs jinja2 only once a page is served, so it isn't imported at start-up
+            from jinja2 import Environment, PackageLoader
+            self.env = Environment(loader=PackageLoader('monitor', 'templates'))
+        return self.env.get_template(name)
+
+    def _snapshot(self):
+        with self.semaphore_recent_responses:
+            return self.recent_responses.version, list(self.recent_responses.values())
+
+    def _report_application(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        if path == '/':
+            return self._report_page(environ, start_response)
+        if path == '/api/results':
+            return self._report_results(environ, start_response)
+        if path == '/events':
+            return self._report_events(environ, start_response)
+        if path == '/metrics':
+            start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4')])
+            return [self.metrics.render(self._gauges(), self._counters()).encode('utf-8')]
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not Found']
+
+    @staticmethod
+    def _not_modified(environ, start_response, etag):
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', [('ETag', etag)])
+            return True
+        return False
+
+    def _report_events(self, environ, start_response):
+        raise NotImplementedError
+
+    def _report_page(self, environ, start_response):
+        connections, concurrency = self._connection_stats(), self._concurrency_stats()
+        version, responses = self._snapshot()
+        stats = json.dumps([connections, concurrency], sort_keys=True).encode('utf-8')
+        etag = '"{}-{}-{}"'.format(version, int(time.time() // self.report_ttl),
+                                   hashlib.blake2b(stats, digest_size=8).hexdigest())
+        if self._not_modified(environ, start_response, etag):
+            return []
+
+        cached_etag, body = self.report_cache
+        if cached_etag != etag:
+            template = self._template('report.html')
+            body = template.render(responses=responses, connections=connections, concurrency=concurrency,
+                                   latency_window=self.latency_window,
+                                   uptime_window=self.uptime_window).encode('utf-8')
+            self.report_cache = (etag, body)
+
+        headers = [
+            ('Content-Type', 'text/html'),
+            ('ETag', etag),
+        ]
+        start_response('200 OK', headers)
+        return [body]
+
+    def _report_results(self, environ, start_response):
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        status = query.get('status', [None])[0]
+        try:
+            limit = min(int(query.get('limit', [self.api_page_size])[0]), self.api_max_page_size)
+            cursor = int(query['cursor'][0]) if 'cursor' in query else None
+            if limit <= 0:
+                raise ValueError
+        except ValueError:
+            start_response('400 Bad Request', [('Content-Type', 'application/json')])
+            return [json.dumps({'error': 'Invalid "limit" or "cursor" parameter.'}).encode('utf-8')]
+
+        version, responses = self._snapshot()
+        etag = '"{}-{}"'.format(version, hashlib.blake2b(environ.get('QUERY_STRING', '').encode('utf-8'),
+                                                          digest_size=8).hexdigest())
+        if self._not_modified(environ, start_response, etag):
+            return []
+
+        # the results are ordered by the resource keys, the cursor is the key of the last returned result
+        if status:
+            responses = [response for response in responses if response.status.lower() == status.lower()]
+        responses.sort(key=lambda response: response.resource.key)
+        start = 0 if cursor is None else bisect.bisect_right([response.resource.key for response in responses],
+                                                             cursor)
+        page = responses[start:start + limit]
+        next_cursor = str(page[-1].resource.key) if start + limit < len(responses) else None
+
+        body = json.dumps({
+            'version': version,
+            'results': [response.as_dict() for response in page],
+            'next_cursor': next_cursor,
+        }).encode('utf-8')
+        headers = [
+            ('Content-Type', 'application/json'),
+            ('ETag', etag),
+        ]
+        start_response('200 OK', headers)
+        return [body]
@@ -0,0 +1,202 @@
+import bisect
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+import gevent
+from gevent import event
+
+from base import logger, no_check
+from green import Monitor
+from resource import ResourceResponse, ResourceStatus
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HashRing:
+    # Consistent hashing: every node has `replicas` points on a ring and owns the keys hashed between
+    # the previous point and each of its own, so a node joining or leaving moves only its share of the keys.
+    replicas = 64
+
+    def __init__(self, nodes):
+        self.nodes = sorted(nodes)
+        self.points = sorted((ring_hash('{}#{}'.format(node, replica)), node)
+                             for node in self.nodes for replica in range(self.replicas))
+        self.hashes = [point for point, _ in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        return self.points[bisect.bisect(self.hashes, ring_hash(key)) % len(self.points)][1]
+
+
+def encode_response(response):
+    values = dict(zip(ResourceResponse.__slots__[1:], response.dump()))
+    values['last_check'] = values['last_check'].timestamp()
+    return json.dumps(values)
+
+
+def decode_response(resource, text):
+    values = json.loads(text)
+    values['last_check'] = datetime.datetime.fromtimestamp(values['last_check'])
+    return ResourceResponse.load(resource, [values.get(name) for name in ResourceResponse.__slots__[1:]])
+
+
+class Coordinator:
+    # The SQLite file shared by the nodes of a cluster. Every node keeps a lease that it renews while
+    # it runs, the nodes with a lease that hasn't expired split the resources. The latest result of every
+    # resource is kept too, with an increasing id, so every node can read the results checked elsewhere.
+
+    def __init__(self, path, node):
+        self.node = node
+        self.connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS leases (node TEXT PRIMARY KEY, expires REAL NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                'key TEXT NOT NULL UNIQUE, node TEXT NOT NULL, response TEXT NOT NULL)')
+
+    def renew(self, expires):
+        self.connection.execute('INSERT OR REPLACE INTO leases (node, expires) VALUES (?, ?)', (self.node, expires))
+
+    def nodes(self, now):
+        rows = self.connection.execute('SELECT node FROM leases WHERE expires > ? ORDER BY node', (now, ))
+        return [node for node, in rows]
+
+    def leave(self):
+        self.connection.execute('DELETE FROM leases WHERE node = ?', (self.node, ))
+
+    def publish(self, results):
+        # (key, encoded response) pairs; a key written again gets a new id, so readers see it as new
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany('INSERT OR REPLACE INTO results (key, node, response) VALUES (?, ?, ?)',
+                                        [(key, self.node, response) for key, response in results])
+
+    def results(self, after):
+        # (id, key, encoded response) of the results of the other nodes written after the id `after`
+        return self.connection.execute('SELECT id, key, response FROM results WHERE id > ? AND node != ? '
+                                       'ORDER BY id', (after, self.node)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+class ClusterMonitor(Monitor):
+    # One node of a cluster of monitors sharing a config and a coordination file. The nodes holding a lease
+    # split the resources by consistent hashing of their URLs and every node checks only its own. A node
+    # renews its lease every third of `lease` seconds, and the lease expires two renewals later, so the
+    # resources of a node that has died are taken over within `lease` seconds. The results are exchanged
+    # through the coordination file with every renewal, and the report of every node shows the whole fleet.
+    # The clocks of the nodes have to be in sync. Every node writes its own log and results store, named after
+    # the node, so the nodes can run on one host with the same config.
+
+    def __init__(self, coordination, node, lease=30):
+        super().__init__()
+        self.coordination = coordination
+        self.node = node
+        self.lease = lease
+        self.coordinator = None
+        self.ring = HashRing([node])
+        # the results of this node waiting to be published, by the resource key
+        self.outbox = {}
+        self.last_result_id = 0
+        # set once the first sync has settled the share of this node
+        self.synced = event.Event()
+
+    def run(self, config_file):
+        self.coordinator = self._in_thread(Coordinator, self.coordination, self.node)
+        # the scheduler waits for the first sync, so this node starts with its own share
+        gevent.spawn(self._cluster_job)
+        try:
+            super().run(config_file)
+        finally:
+            self._in_thread(self.coordinator.leave)
+
+    def _node_path(self, path):
+        root, extension = os.path.splitext(path)
+        return '{}.{}{}'.format(root, re.sub(r'[^\w.-]', '_', self.node), extension)
+
+    def _set_log_handler(self, log_file, options):
+        super()._set_log_handler(self._node_path(log_file), options)
+
+    def _open_store(self, store):
+        if store.get('path'):
+            store = dict(store, path=self._node_path(store['path']))
+        super()._open_store(store)
+
+    @staticmethod
+    def _in_thread(function, *args):
+        # SQLite waits while another node holds the lock of the coordination file, the checks and
+        # the report go on meanwhile
+        return gevent.get_hub().threadpool.apply(function, args)
+
+    def _owns(self, resource):
+        return self.ring.owner(resource.fetch_key) == self.node
+
+    def _record(self, resource, response):
+        super()._record(resource, response)
+        if not resource.retired:
+            self.outbox[str(resource.key)] = encode_response(response)
+
+    def _cluster_job(self):
+        while True:
+            try:
+                self._sync()
+            except sqlite3.Error as e:
+                # the lease runs out if the coordination file stays unavailable
+                logger.error('The cluster state has not been synced: %s', e, extra=no_check)
+            self.synced.set()
+            gevent.sleep(self.lease / 3.0)
+
+    def _scheduler_job(self):
+        self.synced.wait()
+        super()._scheduler_job()
+
+    def _sync(self, now=None):
+        now = now or time.time()
+        results, self.outbox = self.outbox, {}
+        try:
+            nodes, rows = self._in_thread(self._exchange, now, results, self.last_result_id)
+        except sqlite3.Error:
+            # the results are published with the next sync, unless newer ones replace them
+            results.update(self.outbox)
+            self.outbox = results
+            raise
+
+        if self.node not in nodes:
+            nodes = sorted(nodes + [self.node])
+        if nodes != self.ring.nodes:
+            logger.info('The cluster has changed: %s.', ', '.join(nodes), extra=no_check)
+            self.ring = HashRing(nodes)
+
+        resources = {str(resource.key): resource for resource in self.resources}
+        for result_id, key, text in rows:
+            self.last_result_id = result_id
+            resource = resources.get(key)
+            if resource is not None:
+                self._merge(resource, decode_response(resource, text))
+
+    def _exchange(self, now, results, after):
+        # renews the lease, publishes the results of this node and reads the nodes and the results of the others
+        self.coordinator.renew(now + self.lease * 2 / 3.0)
+        if results:
+            self.coordinator.publish(list(results.items()))
+        return self.coordinator.nodes(now), self.coordinator.results(after)
+
+    def _merge(self, resource, response):
+        # a result checked by another node is shown on the report, but it isn't logged or stored here
+        if resource.retired:
+            return
+        with self.semaphore_recent_responses:
+            current = self.recent_responses.get(resource)
+            if current is not None and current.last_check >= response.last_check:
+                return
+            self.recent_responses[resource] = response
+        resource.history.add(response, success=response.status == ResourceStatus.SUCCESS)
+        self._publish(response)
@@ -0,0 +1,120 @@
+from collections import OrderedDict, deque
+
+
+class AdaptiveLimit:
+    # Additive increase, multiplicative decrease: the limit grows by one after `limit` consecutive results
+    # while the recent latency stays close to the long-term one, and halves when a check times out
+    # (at most once per `limit` results, so one burst of timeouts doesn't collapse it).
+
+    def __init__(self, initial=10, minimum=1, maximum=100, tolerance=1.5, decrease=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.short_latency = None
+        self.long_latency = None
+        self.since_decrease = 0
+
+    @staticmethod
+    def _average(average, value, weight):
+        return value if average is None else average + weight * (value - average)
+
+    @property
+    def latency_is_flat(self):
+        return self.short_latency is None or self.short_latency <= self.long_latency * self.tolerance
+
+    def on_result(self, duration, timed_out):
+        self.since_decrease += 1
+        if timed_out:
+            if self.since_decrease >= self.limit:
+                self.limit = max(self.limit * self.decrease, self.minimum)
+                self.since_decrease = 0
+            return
+        if duration is not None:
+            self.short_latency = self._average(self.short_latency, duration, 0.3)
+            self.long_latency = self._average(self.long_latency, duration, 0.02)
+        if self.latency_is_flat:
+            self.limit = min(self.limit + 1.0 / self.limit, self.maximum)
+
+    def __int__(self):
+        return int(self.limit)
+
+
+class ConcurrencyLimiter:
+    # Admits checks within the adaptive global limit and the per-host limit. Checks over a limit wait in a
+    # per-host FIFO and the hosts that can start one more check take turns, so a slow host cannot hold
+    # every slot while the others starve. Waiting is done on events created by `event_factory`, so the
+    # limiter works with gevent and asyncio alike.
+
+    def __init__(self, event_factory, per_host=10, initial=10, minimum=1, maximum=100):
+        self.event_factory = event_factory
+        self.per_host = per_host
+        self.limit = AdaptiveLimit(initial=initial, minimum=minimum, maximum=maximum)
+        self.inflight = 0
+        self.host_inflight = {}
+        self.queues = {}
+        # hosts with waiting checks that are under the per-host limit, in the order they take turns
+        self.ready = OrderedDict()
+
+    def _start(self, host):
+        self.inflight += 1
+        self.host_inflight[host] = self.host_inflight.get(host, 0) + 1
+
+    def acquire(self, host):
+        # returns None when the check may start right away, otherwise an event set once it may start
+        if not self.ready and self.inflight < int(self.limit) and self.host_inflight.get(host, 0) < self.per_host:
+            self._start(host)
+            return None
+
+        waiter = self.event_factory()
+        queue = self.queues.setdefault(host, deque())
+        queue.append(waiter)
+        if self.host_inflight.get(host, 0) < self.per_host:
+            self.ready[host] = queue
+        self._dispatch()
+        return waiter
+
+    def release(self, host, duration=None, timed_out=False):
+        self.limit.on_result(duration, timed_out)
+        self.cancel(host)
+
+    def cancel(self, host):
+        # frees the slot of a check that hasn't been sent, without changing the limit
+        self.inflight -= 1
+        self.host_inflight[host] -= 1
+        if not self.host_inflight[host]:
+            del self.host_inflight[host]
+        queue = self.queues.get(host)
+        if queue and host not in self.ready:
+            self.ready[host] = queue
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.ready and self.inflight < int(self.limit):
+            host, queue = next(iter(self.ready.items()))
+            waiter = queue.popleft()
+            self._start(host)
+            if not queue:
+                del self.queues[host]
+                del self.ready[host]
+            elif self.host_inflight[host] >= self.per_host:
+                del self.ready[host]
+            else:
+                self.ready.move_to_end(host)
+            waiter.set()
+
+    def stats(self):
+        hosts = set(self.host_inflight) | set(self.queues)
+        limit = int(self.limit)
+        return {
+            'limit': limit,
+            'inflight': self.inflight,
+            'queued': sum(len(queue) for queue in self.queues.values()),
+            'saturation': self.inflight / float(limit),
+            'hosts': [{
+                'host': host,
+                'inflight': self.host_inflight.get(host, 0),
+                'queued': len(self.queues.get(host, ())),
+            } for host in sorted(hosts)],
+        }
@@ -1,6 +1,7 @@
 import re
+from collections import OrderedDict
 
-from errors import ConditionError
+from errors import ConditionError, InvalidConfigError
 
 
 class ConditionType(object):
@@ -17,19 +18,35 @@ class ConditionFactory:
             return ContentCondition(con_value)
         elif con_type == ConditionType.REGEX:
             return RegexCondition(con_value)
-        raise NotImplementedError('{} is not supported condition'.format(con_type))
+        raise InvalidConfigError('Invalid config file. "{}" is not a supported condition'.format(con_type))
 
 
 class Condition:
+    # streaming conditions check the body and can be evaluated chunk by chunk by the BodyScanner
+    streaming = False
+    # how many trailing characters of the previous chunk a match may span
+    overlap = 0
+    # indices of the patterns of a streaming condition, search() and fail() take subsets of them
+    indices = frozenset()
 
     def validate(self, response):
         raise NotImplementedError
 
+    def search(self, text, pending):
+        raise NotImplementedError
+
+    def fail(self, missing):
+        raise NotImplementedError
+
 
 class StatusCondition(Condition):
 
     def __init__(self, status_code):
-        self.status_code = int(status_code)
+        try:
+            self.status_code = int(status_code)
+        except (TypeError, ValueError):
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                     'the "status" condition'.format(status_code))
 
     def validate(self, response):
         if response.status_code != self.status_code:
@@ -37,22 +54,228 @@ class StatusCondition(Condition):
                                  "(expected {})".format(response.status_code, self.status_code))
 
 
-class ContentCondition(Condition):
+class PatternCondition(Condition):
+    # A list of patterns that all have to be found in the body. Subclasses can search for the patterns
+    # together with one combined regex; `_search_alone` checks the patterns the combined search may miss.
+    streaming = True
+    single_message = None
+    message = None
+    # the attributes holding compiled regexes
+    regex_attributes = ('combined', )
 
-    def __init__(self, content):
-        self.content = content
+    def __init__(self, patterns):
+        if not isinstance(patterns, list):
+            patterns = [patterns]
+        if not patterns or not all(isinstance(pattern, (str, int, float)) and str(pattern) for pattern in patterns):
+            raise InvalidConfigError('Invalid config file. The "conditions" section is invalid.')
+        self.patterns = [str(pattern) for pattern in patterns]
+        self.indices = frozenset(range(len(self.patterns)))
+        self.combined = None
+        self.combined_indices = {}
+        self.compiled = False
+
+    def __getstate__(self):
+        # the regexes aren't pickled, an unpickled condition compiles them again on its first search
+        state = dict(self.__dict__, compiled=False)
+        for name in self.regex_attributes:
+            state[name] = None
+        return state
+
+    def _compile(self):
+        if self.combined_indices:
+            self.combined = re.compile('(?=({}))'.format(trie_regex(self.combined_indices)))
+        self.compiled = True
 
     def validate(self, response):
-        if self.content not in response.text:
-            raise ConditionError("The string hasn't been found.".format(self.content))
+        missing = self.indices - self.search(response.text, self.indices)
+        if missing:
+            self.fail(missing)
+
+    def search(self, text, pending):
+        if not self.compiled:
+            self._compile()
+        found = set()
+        if self.combined is not None:
+            for match in self.combined.finditer(text):
+                found.add(self._matched(match))
+                if pending <= found:
+                    return set(pending)
+        for index in pending:
+            if index not in found and self._search_alone(index, text):
+                found.add(index)
+        return found & pending
+
+    def _matched(self, match):
+        raise NotImplementedError
+
+    def _search_alone(self, index, text):
+        raise NotImplementedError
+
+    def fail(self, missing):
+        if len(self.patterns) == 1:
+            raise ConditionError(self.single_message)
+        raise ConditionError(self.message.format(len(missing), len(self.patterns),
+                                                 ', '.join("'{}'".format(self.patterns[index])
+                                                           for index in sorted(missing))))
+
+
+def trie_regex(strings):
+    # the strings as a regex branching on one character at a time, like a trie, so the cost of trying
+    # them at a position depends on the length of the strings rather than on their number
+    trie = {}
+    for string in strings:
+        node = trie
+        for character in string:
+            node = node.setdefault(character, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(character) + build(child) for character, child in sorted(node.items()) if character]
+        if not branches:
+            return ''
+        regex = branches[0] if len(branches) == 1 else '(?:{})'.format('|'.join(branches))
+        return '(?:{})?'.format(regex) if '' in node else regex
+
+    return build(trie)
+
+
+class ContentCondition(PatternCondition):
+    single_message = "The string hasn't been found."
+    message = "{} of {} strings haven't been found: {}."
+    # below this many strings separate substring searches are faster than one pass of the combined regex
+    combined_minimum = 128
+
+    def __init__(self, content):
+        super().__init__(content)
+        self.content = self.patterns[0]
+        self.overlap = max(len(pattern) for pattern in self.patterns) - 1
+        self.alone = set(self.indices)
+        if len(self.patterns) >= self.combined_minimum:
+            # the lookahead finds the longest string starting at every position, so only the strings
+            # that are prefixes of longer ones have to be searched for on their own
+            for index, pattern in enumerate(self.patterns):
+                self.combined_indices.setdefault(pattern, index)
+            self._compile()
+            self.alone = {index for index, pattern in enumerate(self.patterns)
+                          if any(other != pattern and other.startswith(pattern) for other in self.patterns)}
 
+    def search(self, text, pending):
+        found = super().search(text, pending)
+        # duplicated strings share one entry of the combined regex
+        for index in pending - found:
+            if self.combined_indices.get(self.patterns[index]) in found:
+                found.add(index)
+        return found
 
-class RegexCondition(Condition):
+    def _matched(self, match):
+        return self.combined_indices[match.group(1)]
+
+    def _search_alone(self, index, text):
+        return index in self.alone and self.patterns[index] in text
+
+
+class RegexCondition(PatternCondition):
+    # The regexes are searched for one by one: an alternation of them can't use the literal prefix scan
+    # of the re module and is many times slower than the separate searches.
+    single_message = "The regex hasn't been matched."
+    message = "{} of {} regexes haven't been matched: {}."
+    # matches longer than this may be missed when they cross a chunk boundary
+    overlap = 1024
+    regex_attributes = ('combined', 'regexes', 'pattern')
 
     def __init__(self, pattern):
-        self.pattern = re.compile(pattern)
+        super().__init__(pattern)
+        self.regexes = []
+        self.pattern = None
+        try:
+            self._compile()
+        except re.error as e:
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid regex: {}'.format(e.pattern, e))
 
-    def validate(self, response):
-        match = self.pattern.search(response.text)
-        if not match:
-            raise ConditionError("The regex hasn't been matched.".format(self.pattern))
+    def _compile(self):
+        super()._compile()
+        self.regexes = [re.compile(pattern) for pattern in self.patterns]
+        self.pattern = self.regexes[0]
+
+    def _search_alone(self, index, text):
+        return self.regexes[index].search(text) is not None
+
+
+class BodyScanner:
+    # the streaming conditions with the indices of their patterns that haven't been found yet
+
+    def __init__(self, conditions):
+        streaming = [condition for condition in conditions if condition.streaming]
+        self.pending = [(condition, condition.indices) for condition in streaming]
+        self.overlap = max([condition.overlap for condition in streaming] or [0])
+        self.tail = ''
+
+    @property
+    def done(self):
+        return not self.pending
+
+    def feed(self, chunk):
+        text = self.tail + chunk
+        pending = []
+        for condition, indices in self.pending:
+            indices = indices - condition.search(text, indices)
+            if indices:
+                pending.append((condition, indices))
+        self.pending = pending
+        self.tail = text[-self.overlap:] if self.overlap else ''
+        return self.done
+
+    def finish(self):
+        if self.pending:
+            condition, indices = self.pending[0]
+            condition.fail(indices)
+
+
+class VerdictCache:
+    # Verdicts of the conditions of a resource for content checked before. The verdict of the last full
+    # check is reused when the server answers the conditional request with 304 Not Modified. The bodies of
+    # servers that send no validators are hashed instead and the verdicts of the last few ones are kept.
+    # A verdict is the message of the failed condition, or None when they all passed.
+    size = 8
+    # longer bodies are checked as they are received, without hashing
+    max_body_bytes = 1024 * 1024
+
+    def __init__(self):
+        self.etag = None
+        self.last_modified = None
+        self.last = None
+        self.bodies = OrderedDict()
+
+    def request_headers(self):
+        headers = {}
+        if self.last is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def not_modified(self, response):
+        return response.status_code == 304 and bool(self.request_headers())
+
+    def remember(self, response, status, message):
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.last = (status, message)
+
+    @staticmethod
+    def hashes_body(response):
+        return not (response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+    def get(self, digest):
+        # returns whether the body has been checked before and its verdict
+        if digest not in self.bodies:
+            return False, None
+        self.bodies.move_to_end(digest)
+        return True, self.bodies[digest]
+
+    def put(self, digest, message):
+        self.bodies[digest] = message
+        self.bodies.move_to_end(digest)
+        if len(self.bodies) > self.size:
+            self.bodies.popitem(last=False)
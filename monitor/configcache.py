@@ -0,0 +1,57 @@
+import hashlib
+import os
+import pickle
+import sys
+
+import condition
+import history
+import resource
+import schedule
+
+# the modules of the pickled objects, a change to any of them makes the cached configs stale
+pickled_modules = (condition, history, resource, schedule)
+
+
+class ConfigCache:
+    # The resources built from a config file pickled to `path`, so an unchanged config starts without
+    # parsing the YAML, the schedules and the regexes again. The cache is keyed by the hash of the config
+    # file and of the code of the pickled objects; a stale or unreadable cache is rebuilt. Only point it at
+    # a file nobody else can write, as unpickling runs the code the file asks for.
+    version = 1
+
+    def __init__(self, path, config):
+        # `config` is the content of the config file
+        self.path = path
+        self.key = self._key(config)
+
+    def _key(self, config):
+        digest = hashlib.sha256('{} {}\n'.format(self.version, sys.version).encode('utf-8'))
+        for module in pickled_modules:
+            stat = os.stat(module.__file__)
+            digest.update('{} {} {}\n'.format(module.__name__, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+        digest.update(config)
+        return digest.hexdigest().encode('ascii')
+
+    def load(self):
+        # the cached state, None when there is none for the current config
+        try:
+            with open(self.path, 'rb') as cache:
+                if cache.readline().rstrip(b'\n') != self.key:
+                    return None
+                return pickle.load(cache)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+    def save(self, state):
+        temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(temporary, 'wb') as cache:
+                cache.write(self.key + b'\n')
+                pickle.dump(state, cache, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path)
+        except OSError:
+            # the monitor runs without the cache
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
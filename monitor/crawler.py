@@ -1,8 +1,174 @@
+import codecs
+import hashlib
 import requests
 import time
+from urllib3.exceptions import HTTPError as UrllibError, TimeoutError as UrllibTimeout
 
+from condition import BodyScanner, VerdictCache
 from errors import ConditionError
 from resource import ResourceResponse, ResourceStatus
+from session import response_timings
+
+
+class BodyReader:
+    # Decodes chunks of the body and feeds them to the streaming conditions until they are all decided
+    # or the size limit is reached.
+
+    def __init__(self, response, conditions, limit=None):
+        self.scanner = BodyScanner(conditions)
+        self.decoder = self._decoder(response)
+        self.limit = limit
+        self.received = 0
+        self.truncated = False
+
+    @staticmethod
+    def _decoder(response):
+        try:
+            return codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    @property
+    def done(self):
+        return self.scanner.done or self.truncated
+
+    def feed(self, chunk):
+        if self.limit is not None and self.received + len(chunk) > self.limit:
+            chunk = chunk[:self.limit - self.received]
+            self.truncated = True
+        self.received += len(chunk)
+        self.scanner.feed(self.decoder.decode(chunk, final=self.truncated))
+        return self.done
+
+    def finish(self):
+        if not self.done:
+            self.scanner.feed(self.decoder.decode(b'', final=True))
+        try:
+            self.scanner.finish()
+        except ConditionError as e:
+            if self.truncated:
+                raise ConditionError('{} Only the first {} bytes of the body have been '
+                                     'checked.'.format(e.message, self.limit))
+            raise
+
+
+class BodyBuffer:
+    # Keeps and hashes the chunks of a body, so the verdict of the same body checked before can be reused.
+    # Only the first `needed` bytes are kept when the readers check no more than that, the rest of the body
+    # isn't read. add() returns False once the body is longer than the limit, the chunks are then checked
+    # as they come.
+
+    def __init__(self, limit, needed=None):
+        self.chunks = []
+        self.hash = hashlib.blake2b(digest_size=16)
+        self.size = 0
+        self.limit = limit
+        self.needed = needed
+
+    @property
+    def complete(self):
+        return self.needed is not None and self.size >= self.needed
+
+    def add(self, chunk):
+        if self.needed is not None:
+            chunk = chunk[:self.needed - self.size]
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.size > self.limit:
+            return False
+        self.hash.update(chunk)
+        return True
+
+    def check(self, reader, verdicts):
+        digest = self.hash.digest()
+        found, message = verdicts.get(digest)
+        if not found:
+            try:
+                for chunk in self.chunks:
+                    if reader.feed(chunk):
+                        break
+                reader.finish()
+            except ConditionError as e:
+                message = e.message
+            verdicts.put(digest, message)
+        if message is not None:
+            raise ConditionError(message)
+
+
+class GroupCheck:
+    # The conditions of the resources sharing one response. Every resource has its own reader of the body
+    # and the body is read once, until all of them are decided. When the server sends no validators the
+    # part of the body the readers would check is kept and hashed first, so each resource can reuse its
+    # verdict of the same body.
+
+    def __init__(self, resources, response):
+        self.resources = resources
+        self.response = response
+        self.messages = {}
+        self.readers = []
+        for resource in resources:
+            try:
+                for condition in resource.conditions:
+                    if not condition.streaming:
+                        condition.validate(response)
+            except ConditionError as e:
+                self.messages[resource] = e.message
+                continue
+            reader = BodyReader(response, resource.conditions, resource.max_body_bytes)
+            if not reader.done:
+                self.readers.append((resource, reader))
+        self.pending = list(self.readers)
+        self.buffer = None
+        if self.readers and VerdictCache.hashes_body(response):
+            # the readers check at most the first `limit` bytes, one byte more tells whether they truncate it
+            limits = [reader.limit for _, reader in self.readers]
+            needed = None
+            if None not in limits and max(limits) < VerdictCache.max_body_bytes:
+                needed = max(limits) + 1
+            self.buffer = BodyBuffer(VerdictCache.max_body_bytes, needed=needed)
+
+    @property
+    def done(self):
+        return not self.pending
+
+    def feed(self, chunk):
+        # returns whether the rest of the body isn't needed
+        if self.buffer is not None:
+            if self.buffer.add(chunk):
+                return self.buffer.complete
+            # too long to be hashed, the kept chunks are checked and the rest as it comes
+            chunks, self.buffer = self.buffer.chunks, None
+        else:
+            chunks = [chunk]
+        for chunk in chunks:
+            self.pending = [(resource, reader) for resource, reader in self.pending if not reader.feed(chunk)]
+            if not self.pending:
+                return True
+        return False
+
+    def finish(self):
+        # returns the status and the message of every resource, and keeps them as the last verdicts
+        for resource, reader in self.readers:
+            try:
+                if self.buffer is not None:
+                    self.buffer.check(reader, resource.verdicts)
+                else:
+                    reader.finish()
+            except ConditionError as e:
+                self.messages[resource] = e.message
+
+        verdicts = []
+        for resource in self.resources:
+            message = self.messages.get(resource)
+            status = ResourceStatus.SUCCESS if message is None else ResourceStatus.FAIL
+            resource.verdicts.remember(self.response, status, message)
+            verdicts.append((status, message))
+        return verdicts
+
+
+def is_timeout(error):
+    # requests raises a read timeout in the middle of the body as a ConnectionError
+    return isinstance(error, requests.exceptions.Timeout) or any(isinstance(arg, UrllibTimeout) for arg in error.args)
 
 
 class Crawler:
@@ -10,26 +176,70 @@ class Crawler:
         'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:40.0) Gecko/20100101 Firefox/40.0'
     }
 
-    def __init__(self, resource):
+    chunk_size = 16 * 1024
+    # the longest remainder of the body read after the conditions have been decided, so the
+    # connection can be returned to the pool instead of being closed
+    drain_size = 64 * 1024
+
+    def __init__(self, resource, sessions=None, group=None):
         self.resource = resource
+        self.sessions = sessions
+        # the resources fetching the same URL as `resource`, all checked against one response
+        self.group = group or [resource]
+        # whether the last check has failed on a timeout rather than on another connection error
+        self.timed_out = False
+
+    def request_headers(self):
+        # the validators are kept per resource, so only a single resource sends a conditional request
+        if len(self.group) == 1:
+            return dict(self.headers, **self.resource.verdicts.request_headers())
+        return self.headers
 
     def check(self):
+        return self.check_group()[0]
+
+    def check_group(self):
+        http = self.sessions.session(self.resource.url) if self.sessions else requests
         try:
-            start = time.time()
-            response = requests.get(self.resource.url, headers=self.headers, timeout=10)
-            elapsed = time.time() - start
+            start = time.perf_counter()
+            response = http.get(self.resource.url, headers=self.request_headers(), timeout=10, stream=True)
+            phases = response_timings(response)
+            received = time.perf_counter()
             try:
-                self._check_conditions(response)
-            except ConditionError as e:
-                return ResourceResponse(resource=self.resource, status=ResourceStatus.FAIL,
-                                        response=response, duration=elapsed, message=e.message)
-            else:
-                return ResourceResponse(resource=self.resource, status=ResourceStatus.SUCCESS,
-                                        response=response, duration=elapsed)
-        except requests.exceptions.RequestException:
-            return ResourceResponse(resource=self.resource, status=ResourceStatus.FAIL,
-                                    message='Connection error. Unable to check the website.')
+                verdicts = self._check_conditions(response)
+            finally:
+                phases['download'] = time.perf_counter() - received
+                duration = time.perf_counter() - start
+                self._release(response)
+            return [ResourceResponse(resource=resource, status=status, response=response, duration=duration,
+                                     message=message, phases=dict(phases))
+                    for resource, (status, message) in zip(self.group, verdicts)]
+        except requests.exceptions.RequestException as e:
+            self.timed_out = is_timeout(e)
+            return [ResourceResponse(resource=resource, status=ResourceStatus.FAIL,
+                                     message='Connection error. Unable to check the website.')
+                    for resource in self.group]
 
     def _check_conditions(self, response):
-        for condition in self.resource.conditions:
-            condition.validate(response)
+        if len(self.group) == 1 and self.resource.verdicts.not_modified(response):
+            return [self.resource.verdicts.last]
+        check = GroupCheck(self.group, response)
+        if not check.done:
+            for chunk in response.iter_content(self.chunk_size):
+                if check.feed(chunk):
+                    break
+        return check.finish()
+
+    def _release(self, response):
+        # the body is drained decoded, as urllib3 can't switch to the raw bytes once it has decoded some
+        drained = 0
+        try:
+            while drained <= self.drain_size:
+                chunk = response.raw.read(self.chunk_size, decode_content=True)
+                if not chunk:
+                    break
+                drained += len(chunk)
+        except (UrllibError, OSError, RuntimeError):
+            # the connection is closed instead of being returned to the pool
+            pass
+        response.close()
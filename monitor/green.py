@@ -0,0 +1,139 @@
+import datetime
+
+import gevent
+from gevent import pool, event, lock
+
+from gevent.pywsgi import WSGIServer
+
+from base import BaseMonitor, logger, no_check
+from crawler import Crawler
+from session import SessionPool
+
+
+class Monitor(BaseMonitor):
+    # The gevent engine. The standard library has to be monkey-patched before the monitor is used.
+
+    def __init__(self):
+        super().__init__()
+        # tasks
+        self.workq = self._build_work_queue(event.Event)
+        # the number of running checks is bounded by the work queue and the limiter
+        self.pool = pool.Group()
+        self.scheduler = None
+        self.supervisor = None
+        self.server = None
+        self.wakeup = event.Event()
+        self.semaphore_recent_responses = lock.BoundedSemaphore()
+        self.sessions = SessionPool()
+        self.limiter = self._build_limiter(event.Event)
+
+    def run(self, config_file):
+        self.load_config(config_file)
+        self.sessions = SessionPool(pool_size=self.pool_size, idle_timeout=self.idle_timeout)
+        self.limiter = self._build_limiter(event.Event)
+        self.workq = self._build_work_queue(event.Event)
+
+        self.scheduler = gevent.spawn(self._scheduler_job)
+        self.supervisor = gevent.spawn(self._supervisor_job)
+        self.server = gevent.spawn(self._server_job)
+        self._install_reload_signal()
+        gevent.spawn(self._reload_job)
+
+        gevent.joinall([self.scheduler, self.server])
+
+    def _worker(self, job):
+        host = job.host
+        waiter = self.limiter.acquire(host)
+        if waiter is not None:
+            waiter.wait()
+            if job.expired(datetime.datetime.now()):
+                self.limiter.cancel(host)
+                self.workq.done(job, dropped=True)
+                return
+        responses = [None]
+        crawler = Crawler(job.resources[0], sessions=self.sessions, group=job.resources)
+        try:
+            responses = crawler.check_group()
+        finally:
+            self._release_slot(host, responses[0], crawler.timed_out)
+            self.workq.done(job)
+        for resource, response in zip(job.resources, responses):
+            self._record(resource, response)
+
+    def _supervisor_job(self):
+        while True:
+            self.workq.ready.wait()
+            job = self.workq.get()
+            if job is not None:
+                self.pool.spawn(self._worker, job)
+
+    def _scheduler_job(self):
+        self._start_timetable()
+
+        while True:
+            delay = self._next_delay() if self.timetable else None
+            if delay is None or delay > 0:
+                # a config reload wakes the scheduler up when it adds resources
+                self.wakeup.wait(timeout=delay)
+                self.wakeup.clear()
+                continue
+
+            for job in self._due_jobs():
+                # a full queue holds the scheduler back until the workers catch up
+                self.workq.not_full.wait()
+                self.workq.put(job)
+
+    def _reload_job(self):
+        while True:
+            gevent.sleep(self.reload_interval)
+            if self._config_changed():
+                try:
+                    self.reload_config()
+                except Exception:
+                    # the running config is kept and the next change is picked up
+                    logger.exception('The config has not been reloaded.', extra=no_check)
+
+    def _wake_scheduler(self):
+        self.wakeup.set()
+
+    def _compact_store(self, snapshot):
+        gevent.spawn(self._compaction_job, snapshot)
+
+    def _compaction_job(self, snapshot):
+        compaction = gevent.get_hub().threadpool.apply(self.store.prepare_compaction, (snapshot, ))
+        self.store.finish_compaction(compaction)
+
+    def _server_job(self):
+        WSGIServer(('', self.port), self._report_application).serve_forever()
+
+    def _report_events(self, environ, start_response):
+        subscriber = self._subscribe(event.Event)
+        headers = [
+            ('Content-Type', 'text/event-stream'),
+            ('Cache-Control', 'no-cache'),
+        ]
+        start_response('200 OK', headers)
+        return self._event_stream(subscriber)
+
+    def _event_stream(self, subscriber):
+        try:
+            yield b'retry: 5000\n\n'
+            while True:
+                if not subscriber.event.wait(timeout=self.events_keepalive):
+                    yield b': keep-alive\n\n'
+                    continue
+                if subscriber.overflowed:
+                    yield b'event: reload\ndata: {}\n\n'
+                    return
+                for message in subscriber.pop():
+                    yield message
+        finally:
+            self.subscribers.discard(subscriber)
+
+    def _connection_stats(self):
+        return self.sessions.stats()
+
+    def _gauges(self):
+        return super()._gauges() + [
+            ('monitor_active_greenlets', 'Greenlets running checks.', len(self.pool)),
+        ]
@@ -0,0 +1,67 @@
+import array
+import math
+import time
+
+
+class ResponseHistory:
+    # Fixed-capacity ring buffer of check results kept in typed arrays, the oldest entries are overwritten.
+
+    def __init__(self, capacity=288):
+        self.capacity = capacity
+        self.timestamps = array.array('d', [0.0]) * capacity
+        self.durations = array.array('d', [math.nan]) * capacity
+        self.codes = array.array('H', [0]) * capacity
+        self.successes = array.array('B', [0]) * capacity
+        self.position = 0
+        self.size = 0
+
+    def __getstate__(self):
+        # an empty history is pickled without its arrays
+        if self.size:
+            return self.__dict__
+        return {'capacity': self.capacity}
+
+    def __setstate__(self, state):
+        if 'timestamps' in state:
+            self.__dict__.update(state)
+        else:
+            self.__init__(state['capacity'])
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, duration, code, success):
+        position = self.position
+        self.timestamps[position] = timestamp
+        self.durations[position] = math.nan if duration is None else duration
+        self.codes[position] = code or 0
+        self.successes[position] = 1 if success else 0
+        self.position = (position + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def add(self, response, success):
+        self.append(response.last_check.timestamp(), response.duration, response.code, success)
+
+    def indices(self, window=None, now=None):
+        # from the oldest to the newest entry, limited to the last `window` seconds
+        start = self.position - self.size
+        indices = [(start + offset) % self.capacity for offset in range(self.size)]
+        if window is not None:
+            since = (now or time.time()) - window
+            indices = [index for index in indices if self.timestamps[index] >= since]
+        return indices
+
+    def percentile(self, percent, window=None, now=None):
+        durations = sorted(self.durations[index] for index in self.indices(window, now)
+                           if not math.isnan(self.durations[index]))
+        if not durations:
+            return None
+        rank = max(int(math.ceil(percent / 100.0 * len(durations))), 1)
+        return durations[rank - 1]
+
+    def uptime(self, window=None, now=None):
+        indices = self.indices(window, now)
+        if not indices:
+            return None
+        return sum(self.successes[index] for index in indices) / float(len(indices))
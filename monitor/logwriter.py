@@ -0,0 +1,140 @@
+import _thread
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+
+# the writer runs in a real thread even when the standard library is monkey-patched, so a slow disk blocks
+# only that thread and not the event loop; gevent isn't imported when nothing has patched the library
+monkey = sys.modules.get('gevent.monkey')
+if monkey is None:
+    start_new_thread, allocate_lock, sleep = _thread.start_new_thread, _thread.allocate_lock, time.sleep
+else:
+    start_new_thread = monkey.get_original('_thread', 'start_new_thread')
+    allocate_lock = monkey.get_original('_thread', 'allocate_lock')
+    sleep = monkey.get_original('time', 'sleep')
+
+
+class TextFormatter(logging.Formatter):
+    # writes the phases of a check as `dns=0.002,connect=0.011,...`, without the ones that didn't happen
+
+    def format(self, record):
+        phases = getattr(record, 'phases', None) or {}
+        record.phases_text = ','.join('{}={:.3f}'.format(name, value)
+                                      for name, value in phases.items() if value is not None) or '-'
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line
+    fields = ('url', 'status', 'response_code', 'response_time', 'phases')
+
+    def format(self, record):
+        line = {'time': self.formatTime(record), 'level': record.levelname}
+        for field in self.fields:
+            line[field] = getattr(record, field, None)
+        line['message'] = None if record.msg is None else record.getMessage()
+        return json.dumps(line)
+
+
+class BatchingHandler(logging.Handler):
+    # Formats the records in the caller and appends them to a bounded buffer. A writer thread writes the
+    # buffer to the file in batches every `flush_interval` seconds. When the buffer is full new records are
+    # dropped and counted, and the number of dropped records is written to the log with the next batch.
+    # The file is rotated to `<path>.1` ... `<path>.<backup_count>` when it would grow over `max_bytes`
+    # or every `rotate_interval` seconds.
+
+    def __init__(self, path, max_bytes=None, rotate_interval=None, backup_count=5, buffer_size=10000,
+                 flush_interval=0.5):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = deque()
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.closed = False
+        self.write_lock = allocate_lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.file_size = self.file.tell()
+        self.next_rotation = time.time() + rotate_interval if rotate_interval else None
+        start_new_thread(self._writer, ())
+
+    def emit(self, record):
+        if len(self.buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+        try:
+            self.buffer.append(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def _writer(self):
+        while not self.closed:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                # the batch is lost, the next one is tried again
+                pass
+
+    def flush(self):
+        with self.write_lock:
+            if self.file is None:
+                return
+            lines = []
+            while self.buffer:
+                lines.append(self.buffer.popleft())
+            dropped = self.dropped - self.reported_dropped
+            if dropped:
+                self.reported_dropped += dropped
+                lines.append(self._dropped_line(dropped))
+            if not lines:
+                return
+            batch = ''.join(lines)
+            if self._should_rotate(len(batch)):
+                self._rotate()
+            self.file.write(batch)
+            self.file.flush()
+            self.file_size += len(batch)
+
+    def _dropped_line(self, dropped):
+        record = logging.LogRecord('monitor', logging.WARNING, __file__, 0,
+                                   '%s log records have been dropped.', (dropped, ), None)
+        for field in JsonFormatter.fields:
+            setattr(record, field, None)
+        return self.format(record) + '\n'
+
+    def _should_rotate(self, size):
+        if self.max_bytes and self.file_size and self.file_size + size > self.max_bytes:
+            return True
+        return self.next_rotation is not None and time.time() >= self.next_rotation
+
+    def _rotate(self):
+        self.file.close()
+        for number in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.path, number)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.path, number + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.file_size = 0
+        if self.rotate_interval:
+            self.next_rotation = time.time() + self.rotate_interval
+
+    def close(self):
+        self.closed = True
+        self.flush()
+        with self.write_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        super().close()
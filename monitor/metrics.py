@@ -0,0 +1,90 @@
+import array
+import bisect
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    # bucket counters are allocated up front, observing a value only increments them
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = array.array('Q', [0]) * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+        cumulative += self.counts[-1]
+        yield '{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, cumulative)
+
+
+class Metrics:
+    # Counters of the checks in the Prometheus text format. The histogram and the labels of a resource are
+    # created when it is registered, so recording a check doesn't build any label strings or objects.
+    buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.durations = {}
+        self.labels = {}
+        self.results = {}
+        self.scheduler_lag = 0.0
+
+    def register(self, resource):
+        if resource.key not in self.durations:
+            self.durations[resource.key] = Histogram(self.buckets)
+            name = '' if resource.name is None else str(resource.name)
+            self.labels[resource.key] = 'name="{}",url="{}"'.format(escape(name), escape(resource.url))
+
+    def unregister(self, resource):
+        self.durations.pop(resource.key, None)
+        self.labels.pop(resource.key, None)
+
+    def observe(self, response):
+        histogram = self.durations.get(response.resource.key)
+        if histogram is None:
+            self.register(response.resource)
+            histogram = self.durations[response.resource.key]
+        if response.duration is not None:
+            histogram.observe(response.duration)
+
+        codes = self.results.get(response.status)
+        if codes is None:
+            codes = self.results[response.status] = {}
+        codes[response.code] = codes.get(response.code, 0) + 1
+
+    def render(self, gauges=(), counters=()):
+        lines = [
+            '# HELP monitor_check_duration_seconds Duration of the checks.',
+            '# TYPE monitor_check_duration_seconds histogram',
+        ]
+        for key, histogram in self.durations.items():
+            lines.extend(histogram.samples('monitor_check_duration_seconds', self.labels[key]))
+
+        lines.append('# HELP monitor_checks_total Checks by the result and the response code.')
+        lines.append('# TYPE monitor_checks_total counter')
+        for status, codes in sorted(self.results.items()):
+            for code, count in sorted(codes.items(), key=lambda item: item[0] or 0):
+                lines.append('monitor_checks_total{{status="{}",code="{}"}} {}'.format(
+                    escape(status).lower(), code or '', count))
+
+        lines.append('# HELP monitor_scheduler_lag_seconds Delay of the last dispatch after its scheduled time.')
+        lines.append('# TYPE monitor_scheduler_lag_seconds gauge')
+        lines.append('monitor_scheduler_lag_seconds {}'.format(self.scheduler_lag))
+
+        for kind, metrics in (('gauge', gauges), ('counter', counters)):
+            for name, description, value in metrics:
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
@@ -1,126 +1,65 @@
-import gevent
-from gevent import queue, pool, event, lock, monkey
-
-monkey.patch_all()
-
-import yaml
 import argparse
-import logging
-from collections import OrderedDict
-
-from gevent.pywsgi import WSGIServer
-
-from jinja2 import Environment, PackageLoader
-
-from crawler import Crawler
-from errors import InvalidConfigError
-from resource import MonitoredResource
-
-logger = logging.getLogger('monitor')
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(url)s %(status)s %(response_code)s %(response_time)s %(message)s')
-
-semaphore_recent_responses = lock.BoundedSemaphore()
-
-
-class Monitor:
-
-    def __init__(self):
-        # tasks
-        self.workq = queue.Queue()
-        self.pool = pool.Pool(10)
-        self.scheduler = None
-        self.supervisor = None
-        self.server = None
-        self.new_work = event.Event()
-
-        # resources
-        self.resources = []
-        self.recent_responses = OrderedDict()
-
-        # environment
-        self.env = Environment(loader=PackageLoader('monitor', 'templates'))
-
-    def _set_log_handler(self, log_file):
-        handler = logging.FileHandler(log_file)
-        handler.setLevel(logging.INFO)
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-
-    def run(self, config_file):
-        with open(config_file, 'r') as yml_config:
-            cfg = yaml.load(yml_config)
-
-        if not cfg:
-            raise InvalidConfigError('Config file is empty.')
-        log_file = cfg.get('log_file')
-        if not log_file:
-            raise InvalidConfigError('Invalid config file. The "log_file" section is missing.')
-        self._set_log_handler(log_file)
-
-        sites = cfg.get('sites')
-        if not sites:
-            raise InvalidConfigError('Invalid config file. The "sites" section is missing.')
-        for section in sites.values():
-            self.resources.append(MonitoredResource(section))
+import socket
 
-        self.scheduler = gevent.spawn(self._scheduler_job)
-        self.supervisor = gevent.spawn(self._supervisor_job)
-        self.server = gevent.spawn(self._server_job)
 
-        gevent.joinall([self.scheduler, self.server])
-
-    def _worker(self, resource):
-        crawler = Crawler(resource)
-        response = crawler.check()
-        with semaphore_recent_responses:
-            self.recent_responses[resource] = response
-        logger.info(response.message, extra=response.logger_info)
-
-    def _supervisor_job(self):
-        while True:
-            for thread in list(self.pool):
-                if thread.dead:
-                    self.pool.discard(thread)
-            try:
-                job = self.workq.get_nowait()
-            except queue.Empty:
-                self.new_work.wait()
-                self.new_work.clear()
-                continue
-
-            self.pool.spawn(self._worker, *job)
-
-    def _scheduler_job(self):
-        while True:
-            for resource in self.resources:
-                if resource.is_ready():
-                    self.workq.put((resource, ))
-                    self.new_work.set()
-
-            gevent.sleep(60)
-
-    def _server_job(self):
-        WSGIServer(('', 8000), self._report_application).serve_forever()
-
-    def _report_application(self, environ, start_response):
-        status = '200 OK'
-        template = self.env.get_template('report.html')
-        body = template.render(responses=self.recent_responses)
-
-        headers = [
-            ('Content-Type', 'text/html')
-        ]
-        start_response(status, headers)
-        return [body.encode('utf-8')]
-
-
-if __name__ == '__main__':
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Simple program that monitors web sites "
                                                  "and reports their availability.")
     parser.add_argument("--config", dest="config_file", action="store", help="config file", required=True)
-    args = parser.parse_args()
+    parser.add_argument("--engine", dest="engine", action="store", choices=('gevent', 'asyncio'),
+                        default='gevent', help="execution engine")
+    parser.add_argument("--workers", dest="workers", action="store", type=int, default=0,
+                        help="number of worker processes the resources are spread over (gevent engine only)")
+    parser.add_argument("--config-cache", dest="config_cache", action="store",
+                        help="file the compiled config is cached in, so an unchanged config starts faster")
+    parser.add_argument("--port", dest="port", action="store", type=int, default=8000,
+                        help="port the report is served on")
+    parser.add_argument("--cluster", dest="cluster", action="store",
+                        help="SQLite file shared by the nodes of a cluster, the nodes split the resources")
+    parser.add_argument("--node", dest="node", action="store",
+                        help="name of this node in the cluster, unique in it (default: host:port)")
+    parser.add_argument("--lease", dest="lease", action="store", type=float, default=30,
+                        help="seconds after which the resources of a stopped node are taken over")
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error('the number of workers cannot be negative')
+    if args.workers and args.engine != 'gevent':
+        parser.error('worker processes are supported by the gevent engine only')
+    if args.cluster and (args.engine != 'gevent' or args.workers):
+        parser.error('a cluster node runs with the gevent engine and without worker processes')
+    if args.lease <= 0:
+        parser.error('the lease has to be positive')
+    if args.cluster and not args.node:
+        args.node = '{}:{}'.format(socket.gethostname(), args.port)
+    return args
+
 
-    monitor = Monitor()
+if __name__ == '__main__':
+    args = parse_args()
+    # the gevent engine needs the standard library patched before requests and ssl are imported
+    if args.engine == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def main(args):
+    # only the modules of the chosen engine are imported
+    if args.engine == 'asyncio':
+        from aio import AsyncMonitor
+        monitor = AsyncMonitor()
+    elif args.workers:
+        from workers import ShardedMonitor
+        monitor = ShardedMonitor(args.workers)
+    elif args.cluster:
+        from cluster import ClusterMonitor
+        monitor = ClusterMonitor(args.cluster, args.node, lease=args.lease)
+    else:
+        from green import Monitor
+        monitor = Monitor()
+    monitor.config_cache = args.config_cache
+    monitor.port = args.port
     monitor.run(args.config_file)
 
+
+if __name__ == '__main__':
+    main(args)
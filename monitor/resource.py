@@ -1,8 +1,23 @@
 import datetime
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
 
-from errors import InvalidConfigError
-from condition import ConditionFactory
-from schedule import Schedule
+from errors import InvalidConfigError, InvalidScheduleException
+from condition import ConditionFactory, VerdictCache
+from history import ResponseHistory
+from schedule import parse_schedule
+
+
+def normalize_url(url):
+    # the same URL written differently: the case of the scheme and the host, the default port, the fragment
+    parts = urlsplit(url)
+    scheme, host = parts.scheme.lower(), (parts.hostname or '')
+    if ':' in host:
+        host = '[{}]'.format(host)
+    netloc = parts.netloc.rpartition('@')[0] + '@' + host if '@' in parts.netloc else host
+    if parts.port and parts.port != {'http': 80, 'https': 443}.get(scheme):
+        netloc = '{}:{}'.format(netloc, parts.port)
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
 
 
 class ResourceStatus:
@@ -10,62 +25,165 @@ class ResourceStatus:
 
 
 class MonitoredResource:
+    default_max_body_bytes = 10 * 1024 * 1024
+    default_history_size = 288
 
-    def __init__(self, config):
+    def __init__(self, config, name=None, jitter=False):
+        self.name = name
         self.url = None
         self.schedule = None
         self.conditions = []
+        self.max_body_bytes = self.default_max_body_bytes
+        self.history = None
+        # set when the resource has been removed or replaced by a config reload
+        self.retired = False
+        # the time of the next check in the timetable of the monitor
+        self.next_due = None
+        self.verdicts = VerdictCache()
 
         self._load_config(config)
+        # resources with the same fetch key are checked against one request when they are due together;
+        # all the request options are global, so the normalized URL is the key
+        self.fetch_key = normalize_url(self.url)
+        # with jitter every check runs this long after its minute, resources fetching the same URL
+        # get the same offset so they can still share the request
+        self.offset = self.jitter_offset(self.fetch_key) if jitter else None
+        # stable identifier of the resource used by the result store
+        identifier = self.url if name is None else str(name)
+        self.key = int.from_bytes(hashlib.blake2b(identifier.encode('utf-8'), digest_size=8).digest(), 'little')
 
     def _load_config(self, config):
         if not config:
             raise InvalidConfigError('Missing config file.')
+        if not isinstance(config, dict):
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid site section'.format(config))
 
         url = config.get('url')
         if not url:
             raise InvalidConfigError('Invalid config file. The "url" section is missing.')
+        try:
+            urlsplit(url).port
+        except (TypeError, ValueError, AttributeError):
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                     'the "url" section'.format(url))
         self.url = url
 
         schedule = config.get('schedule')
         if not schedule:
             raise InvalidConfigError('Invalid config file. The "schedule" section is missing.')
-        schedule = schedule.strip()
-        if len(schedule.split()) != 5:
-            raise InvalidConfigError('Invalid config file. "{}" is an invalid expression for '
+        schedule = str(schedule).strip()
+        invalid = InvalidConfigError('Invalid config file. "{}" is an invalid expression for '
                                      'the "schedule" section'.format(schedule))
-        self.schedule = Schedule(schedule)
+        if len(schedule.split()) not in (5, 6):
+            raise invalid
+        try:
+            self.schedule = parse_schedule(schedule)
+        except (InvalidScheduleException, ValueError):
+            raise invalid
 
         conditions = config.get('conditions', [])
-        if not len(conditions):
+        if not isinstance(conditions, dict) or not conditions:
             raise InvalidConfigError('Invalid config file. The "conditions" section is missing.')
         for con_type, con_value in conditions.items():
             if not con_type or not con_value:
                 raise InvalidConfigError('Invalid config file. The "conditions" section is invalid.')
             self.conditions.append(ConditionFactory.factory(con_type, con_value))
 
+        max_body_bytes = config.get('max_body_bytes', self.default_max_body_bytes)
+        try:
+            self.max_body_bytes = int(max_body_bytes)
+        except (TypeError, ValueError):
+            self.max_body_bytes = 0
+        if self.max_body_bytes <= 0:
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                     'the "max_body_bytes" section'.format(max_body_bytes))
+
+        history_size = config.get('history_size', self.default_history_size)
+        if not isinstance(history_size, int) or history_size <= 0:
+            raise InvalidConfigError('Invalid config file. "{}" is an invalid value for '
+                                     'the "history_size" section'.format(history_size))
+        self.history = ResponseHistory(history_size)
+
     def is_ready(self):
         if self.schedule:
             return self.schedule.is_ready()
         return False
 
+    @staticmethod
+    def jitter_offset(key):
+        # a stable offset inside the minute, spread evenly by the hash of the key
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        return datetime.timedelta(seconds=int.from_bytes(digest, 'little') % 60)
+
+    def next_run(self, after):
+        if not self.schedule:
+            return None
+        if not self.offset:
+            return self.schedule.next_run(after)
+        next_run = self.schedule.next_run(after - self.offset)
+        return next_run + self.offset if next_run is not None else None
 
-class ResourceResponse:
 
-    def __init__(self, resource, status, response=None, duration=None, message=None):
+class ResourceResponse:
+    # `resource` has to stay the first slot, dump() and load() transfer the others
+    __slots__ = ('resource', 'status', 'code', 'duration', 'message', 'headers', 'last_check', 'phases')
+    # the parts of the duration in seconds, None when unknown or when a reused connection skipped them
+    phase_names = ('dns', 'connect', 'tls', 'ttfb', 'download')
+    # the only response headers kept after the check
+    kept_headers = ('Content-Type', 'Content-Length', 'Server', 'ETag', 'Last-Modified')
+
+    def __init__(self, resource, status, response=None, duration=None, message=None, phases=None):
         self.resource = resource
         self.status = status
-        self.response = response
+        self.code = None
+        self.headers = None
         self.duration = duration
         self.message = message
         self.last_check = datetime.datetime.now()
+        self.phases = phases
+
+        if response is not None:
+            self.code = response.status_code
+            headers = {name: response.headers[name] for name in self.kept_headers if name in response.headers}
+            self.headers = headers or None
+
+    @classmethod
+    def restore(cls, resource, status, code, duration, message, last_check):
+        response = cls(resource, status, duration=duration, message=message)
+        response.code = code
+        response.last_check = last_check
+        return response
+
+    def dump(self):
+        return tuple(getattr(self, name) for name in self.__slots__[1:])
+
+    @classmethod
+    def load(cls, resource, values):
+        response = cls.__new__(cls)
+        response.resource = resource
+        for name, value in zip(cls.__slots__[1:], values):
+            setattr(response, name, value)
+        return response
+
+    def as_dict(self):
+        return {
+            'key': str(self.resource.key),
+            'name': self.resource.name,
+            'url': self.resource.url,
+            'status': self.status,
+            'code': self.code,
+            'duration': self.duration,
+            'last_check': self.last_check.isoformat(),
+            'message': self.message,
+            'phases': self.phases,
+        }
 
     @property
     def logger_info(self):
         return {
             'status': self.status,
             'response_time': self.duration if self.duration else None,
-            'response_code': self.response.status_code if self.response else None,
+            'response_code': self.code,
             'url': self.resource.url,
+            'phases': self.phases,
         }
-
@@ -1,4 +1,5 @@
 import datetime
+import functools
 import re
 
 from errors import InvalidScheduleException
@@ -36,12 +37,29 @@ class Matcher:
         self.operator_stack = Stack()
         self.operand_stack = Stack()
         self.valid_range = []
+        self.mask = 0
         self.expression = expression
         self.parse_expression()
+        # bit `n` is set when `n` is a valid value
+        for value in self.valid_range:
+            self.mask |= 1 << value
 
-    def is_valid(self):
+    @staticmethod
+    def value(moment):
         raise NotImplementedError()
 
+    def matches(self, moment):
+        return bool(self.mask >> self.value(moment) & 1)
+
+    def is_valid(self, now=None):
+        return self.matches(now or datetime.datetime.now())
+
+    def next_valid(self, value):
+        rest = self.mask >> value
+        if not rest:
+            return None
+        return value + (rest & -rest).bit_length() - 1
+
     def parse_expression(self):
         for char in re.split(r'([{}])'.format(''.join(self.operators)), self.expression):
             if char in self.operators:
@@ -112,57 +130,169 @@ class Matcher:
         self.operand_stack.insert(0, sorted(set(result)))
 
 
+class SecondMatcher(Matcher):
+    range = range(0, 60)
+
+    @staticmethod
+    def value(moment):
+        return moment.second
+
+
 class MinuteMatcher(Matcher):
     range = range(0, 60)
 
-    def is_valid(self):
-        return datetime.datetime.now().minute in self.valid_range
+    @staticmethod
+    def value(moment):
+        return moment.minute
 
 
 class HourMatcher(Matcher):
     range = range(0, 24)
 
-    def is_valid(self):
-        return datetime.datetime.now().hour in self.valid_range
+    @staticmethod
+    def value(moment):
+        return moment.hour
 
 
 class DayMatcher(Matcher):
     range = range(1, 32)
 
-    def is_valid(self):
-        return datetime.datetime.now().day in self.valid_range
+    @staticmethod
+    def value(moment):
+        return moment.day
 
 
 class DayOfWeekMatcher(Matcher):
     range = range(1, 8)
 
-    def is_valid(self):
-        return datetime.datetime.now().isoweekday() in self.valid_range
+    @staticmethod
+    def value(moment):
+        return moment.isoweekday()
 
 
 class MonthMatcher(Matcher):
     range = range(1, 13)
 
-    def is_valid(self):
-        return datetime.datetime.now().month in self.valid_range
+    @staticmethod
+    def value(moment):
+        return moment.month
 
 
 class Schedule:
+    # the longest period after which every valid schedule fires again (Feb 29 on a given weekday)
+    horizon = datetime.timedelta(days=366 * 28)
 
     def __init__(self, rules):
         self.rules = rules.strip().split()
-        minute, hour, day, month, day_of_week = self.rules
+        # an optional sixth field in front of the others gives the seconds, without it checks run at :00
+        self.second = SecondMatcher(self.rules[0]) if len(self.rules) == 6 else None
+        minute, hour, day, month, day_of_week = self.rules[-5:]
+        self.minute = MinuteMatcher(minute)
+        self.hour = HourMatcher(hour)
+        self.day = DayMatcher(day)
+        self.day_of_week = DayOfWeekMatcher(day_of_week)
+        self.month = MonthMatcher(month)
         self.matchers = [
-            MinuteMatcher(minute),
-            HourMatcher(hour),
-            DayMatcher(day),
-            DayOfWeekMatcher(day_of_week),
-            MonthMatcher(month)
+            self.minute,
+            self.hour,
+            self.day,
+            self.day_of_week,
+            self.month
         ]
 
-    def is_ready(self):
+    def is_ready(self, now=None):
+        now = now or datetime.datetime.now()
+        if self.second is not None and not self.second.matches(now):
+            return False
         for matcher in self.matchers:
-            if not matcher.is_valid():
+            if not matcher.matches(now):
                 return False
         return True
 
+    def next_run(self, after):
+        # the first moment strictly after `after` matched by all the rules, None if there is no such moment
+        if self.second is None:
+            return self._next_minute(after)
+        if all(matcher.matches(after) for matcher in self.matchers):
+            second = self.second.next_valid(after.second + 1)
+            if second is not None:
+                return after.replace(second=second, microsecond=0)
+        first_second = self.second.next_valid(0)
+        moment = self._next_minute(after)
+        if moment is None or first_second is None:
+            return None
+        return moment.replace(second=first_second)
+
+    def _next_minute(self, after):
+        # the first minute strictly after the minute of `after` matched by the rules of the minute and above
+        moment = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        deadline = moment + self.horizon
+        while moment < deadline:
+            if not self.month.matches(moment):
+                moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+                continue
+            if not self.day.matches(moment) or not self.day_of_week.matches(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                continue
+            hour = self.hour.next_valid(moment.hour)
+            if hour is None:
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                continue
+            if hour != moment.hour:
+                moment = moment.replace(hour=hour, minute=0)
+            minute = self.minute.next_valid(moment.minute)
+            if minute is None:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            return moment.replace(minute=minute)
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_schedule(rules):
+    # schedules don't change once parsed, so the resources with the same rules share one
+    return Schedule(rules)
+
+
+class ScheduleIndex:
+    # Transposed bitmasks of many schedules: for every value of every field there is one integer with
+    # bit `i` set when the i-th schedule accepts that value, so the due set is the AND of six integers.
+    # A schedule without the seconds field accepts every second, as in Schedule.is_ready().
+
+    def __init__(self, schedules=()):
+        self.size = 0
+        self.bitsets = [(matcher_cls, [0] * len(matcher_cls.range)) for matcher_cls in
+                        (SecondMatcher, MinuteMatcher, HourMatcher, DayMatcher, DayOfWeekMatcher, MonthMatcher)]
+        for schedule in schedules:
+            self.add(schedule)
+
+    def add(self, schedule):
+        index = self.size
+        self.size += 1
+        every_second = (1 << len(SecondMatcher.range)) - 1
+        masks = [schedule.second.mask if schedule.second is not None else every_second]
+        masks += [matcher.mask for matcher in schedule.matchers]
+        for mask, (matcher_cls, bitset) in zip(masks, self.bitsets):
+            start = matcher_cls.range.start
+            for position in range(len(bitset)):
+                if mask >> (start + position) & 1:
+                    bitset[position] |= 1 << index
+        return index
+
+    def remove(self, index):
+        for _, bitset in self.bitsets:
+            for position in range(len(bitset)):
+                bitset[position] &= ~(1 << index)
+
+    def due(self, now=None):
+        now = now or datetime.datetime.now()
+        due = -1
+        for matcher_cls, bitset in self.bitsets:
+            due &= bitset[matcher_cls.value(now) - matcher_cls.range.start]
+
+        indices = []
+        while due:
+            lowest = due & -due
+            indices.append(lowest.bit_length() - 1)
+            due ^= lowest
+        return indices
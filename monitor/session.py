@@ -0,0 +1,188 @@
+import socket
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+
+class TimedConnection:
+    # Times the phases of the requests sent over a connection with the monotonic clock. The name is resolved
+    # before connecting to each of its addresses, so the DNS lookup and the TCP connect are timed apart and
+    # the TLS handshake is the rest of `connect()`. The phases of a request are attached to its response
+    # as `timings`; the DNS, connect and TLS phases are None when the connection has been reused.
+    timings = None
+    connected_at = 0.0
+    request_start = 0.0
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            # let urllib3 raise its own error
+            return super()._new_conn()
+        resolved = time.perf_counter()
+
+        dns_host = self._dns_host
+        try:
+            for number, address in enumerate(addresses):
+                self._dns_host = address[4][0]
+                try:
+                    sock = super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError):
+                    if number == len(addresses) - 1:
+                        raise
+                else:
+                    break
+        finally:
+            self._dns_host = dns_host
+        self.timings['dns'] = resolved - start
+        self.timings['connect'] = time.perf_counter() - resolved
+        return sock
+
+    def connect(self):
+        self.timings = dict.fromkeys(('dns', 'connect', 'tls'))
+        start = time.perf_counter()
+        super().connect()
+        self.connected_at = time.perf_counter()
+        if isinstance(self, HTTPSConnection) and self.timings['connect'] is not None:
+            self.timings['tls'] = self.connected_at - start - self.timings['dns'] - self.timings['connect']
+
+    def putrequest(self, *args, **kwargs):
+        self.request_start = time.perf_counter()
+        return super().putrequest(*args, **kwargs)
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        timings = self.timings or dict.fromkeys(('dns', 'connect', 'tls'))
+        timings['ttfb'] = time.perf_counter() - max(self.request_start, self.connected_at)
+        response.timings = timings
+        self.timings = None
+        return response
+
+
+class TimedHTTPConnection(TimedConnection, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def response_timings(response):
+    # urllib3 1.x wraps the response of http.client that the timings are attached to
+    raw = response.raw
+    timings = getattr(raw, 'timings', None) or getattr(getattr(raw, '_original_response', None), 'timings', None)
+    return dict(timings) if timings else dict.fromkeys(('dns', 'connect', 'tls', 'ttfb'))
+
+
+class HostSession:
+
+    def __init__(self, pool_size):
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.adapter.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.last_used = time.monotonic()
+        # keep the counters of the connection pools evicted or cleared by the pool manager
+        self.closed_requests = 0
+        self.closed_connections = 0
+        self.adapter.poolmanager.pools.dispose_func = self._dispose
+
+    def _dispose(self, pool):
+        self.closed_requests += pool.num_requests
+        self.closed_connections += pool.num_connections
+        pool.close()
+
+    def _pools(self):
+        pools = self.adapter.poolmanager.pools
+        return [pools[key] for key in pools.keys()]
+
+    @property
+    def requests(self):
+        return self.closed_requests + sum(pool.num_requests for pool in self._pools())
+
+    @property
+    def connections(self):
+        return self.closed_connections + sum(pool.num_connections for pool in self._pools())
+
+    def close(self):
+        self.session.close()
+
+
+class SessionPool:
+
+    def __init__(self, pool_size=10, idle_timeout=60):
+        self.pool_size = int(pool_size)
+        self.idle_timeout = idle_timeout
+        self.hosts = {}
+        self.expired_requests = 0
+        self.expired_connections = 0
+        self.last_sweep = time.monotonic()
+
+    @staticmethod
+    def host(url):
+        parts = urlsplit(url)
+        return '{}://{}'.format(parts.scheme, parts.netloc.lower())
+
+    def session(self, url):
+        now = time.monotonic()
+        if now - self.last_sweep >= self.idle_timeout:
+            self.expire(now)
+
+        host = self.host(url)
+        host_session = self.hosts.get(host)
+        if host_session is None:
+            host_session = self.hosts[host] = HostSession(self.pool_size)
+        host_session.last_used = now
+        return host_session.session
+
+    def expire(self, now=None):
+        now = now or time.monotonic()
+        self.last_sweep = now
+        for host, host_session in list(self.hosts.items()):
+            if now - host_session.last_used >= self.idle_timeout:
+                host_session.close()
+                self.expired_requests += host_session.requests
+                self.expired_connections += host_session.connections
+                del self.hosts[host]
+
+    def close(self):
+        for host_session in self.hosts.values():
+            host_session.close()
+        self.hosts.clear()
+
+    def stats(self):
+        hosts = []
+        for host, host_session in sorted(self.hosts.items()):
+            requests_count, connections = host_session.requests, host_session.connections
+            hosts.append({
+                'host': host,
+                'requests': requests_count,
+                'connections': connections,
+                'reused': requests_count - connections,
+            })
+        requests_count = self.expired_requests + sum(host['requests'] for host in hosts)
+        connections = self.expired_connections + sum(host['connections'] for host in hosts)
+        return {
+            'hosts': hosts,
+            'requests': requests_count,
+            'connections': connections,
+            'reused': requests_count - connections,
+        }
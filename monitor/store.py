@@ -0,0 +1,283 @@
+import datetime
+import math
+import mmap
+import os
+import struct
+import time
+
+from errors import InvalidConfigError
+from resource import ResourceResponse, ResourceStatus
+
+
+class ResultStore:
+    # Append-only file of fixed-size check records, memory-mapped and grown in blocks. The header keeps
+    # the number of records written so a torn tail from a crash is ignored on the next start. Every record
+    # points to the previous record of its resource, and an index of the last record of every resource is
+    # saved next to the file whenever it grows, so the history of a resource is read without a scan.
+    magic = b'WMRS'
+    version = 2
+    # magic, version, record size, number of records, id of the file, new after every compaction
+    header = struct.Struct('<4sHHQQ')
+    # resource key, number of the previous record of the resource + 1 (0 if none), timestamp,
+    # duration (NaN if unknown), response code (0 if none), success, message
+    record = struct.Struct('<QIddHB101p')
+    message_size = 100
+    grow_records = 4096
+    # the files of the first version have no pointers to the previous records and are upgraded on open
+    legacy_header = struct.Struct('<4sHHQ')
+    legacy_record = struct.Struct('<QddHB101p')
+    index_magic = b'WMRI'
+    # magic, id of the indexed file, number of records indexed; followed by (resource key, last record)
+    index_header = struct.Struct('<4sQQ')
+    index_entry = struct.Struct('<QQ')
+
+    def __init__(self, path, max_records=1000000, retention=7 * 24 * 60 * 60, keep_per_resource=288):
+        self.path = path
+        self.max_records = max_records
+        self.retention = retention
+        self.keep_per_resource = keep_per_resource
+        self.count = 0
+        self.capacity = 0
+        self.file_id = 0
+        # the number of the last record of every resource key
+        self.last = {}
+        self.compacting = False
+        self.file = None
+        self.map = None
+        self._open()
+
+    @property
+    def index_path(self):
+        return self.path + '.index'
+
+    @property
+    def needs_compaction(self):
+        return self.count >= self.max_records and not self.compacting
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.legacy_header.size:
+            with open(self.path, 'wb') as results_file:
+                results_file.write(self.header.pack(self.magic, self.version, self.record.size, 0, new_file_id()))
+
+        self.file = open(self.path, 'r+b')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), size)
+        magic, version, record_size, count = self.legacy_header.unpack_from(self.map, 0)
+        if magic == self.magic and version == 1 and record_size == self.legacy_record.size:
+            self._close()
+            self._upgrade(count)
+            return self._open()
+        if magic != self.magic or version != self.version or record_size != self.record.size:
+            self._close()
+            raise InvalidConfigError('Invalid config file. "{}" is not a results file.'.format(self.path))
+        count, self.file_id = self.header.unpack_from(self.map, 0)[3:]
+        self.capacity = (size - self.header.size) // self.record.size
+        self.count = min(count, self.capacity)
+        self._load_index()
+
+    def _upgrade(self, count):
+        with open(self.path, 'rb') as legacy:
+            data = legacy.read()
+        count = min(count, (len(data) - self.legacy_header.size) // self.legacy_record.size)
+        records = (self.legacy_record.unpack_from(data, self.legacy_header.size + number * self.legacy_record.size)
+                   for number in range(count))
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as results_file:
+            results_file.write(self.header.pack(self.magic, self.version, self.record.size, count, new_file_id()))
+            self._write_records(results_file, records, {}, 0)
+            results_file.flush()
+            os.fsync(results_file.fileno())
+        os.replace(temporary_path, self.path)
+
+    def _load_index(self):
+        # the saved index covers the records up to its count, the ones appended after it are read
+        self.last, indexed = {}, 0
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                data = index_file.read()
+            magic, file_id, count = self.index_header.unpack_from(data, 0)
+            if magic == self.index_magic and file_id == self.file_id and count <= self.count:
+                self.last = dict(self.index_entry.iter_unpack(data[self.index_header.size:]))
+                indexed = count
+        except (OSError, struct.error):
+            pass
+        for number in range(indexed, self.count):
+            self.last[struct.unpack_from('<Q', self.map, self._offset(number))[0]] = number
+
+    def _save_index(self):
+        temporary_path = self.index_path + '.tmp'
+        try:
+            with open(temporary_path, 'wb') as index_file:
+                index_file.write(self.index_header.pack(self.index_magic, self.file_id, self.count))
+                index_file.write(b''.join(self.index_entry.pack(key, number) for key, number in self.last.items()))
+            os.replace(temporary_path, self.index_path)
+        except OSError:
+            # the records missing from the index are read on the next start
+            pass
+
+    def _resize(self, capacity):
+        self.map.close()
+        self.file.truncate(self.header.size + capacity * self.record.size)
+        self.map = mmap.mmap(self.file.fileno(), self.header.size + capacity * self.record.size)
+        self.capacity = capacity
+        self._save_index()
+
+    def _offset(self, number):
+        return self.header.size + number * self.record.size
+
+    def _write_count(self):
+        self.header.pack_into(self.map, 0, self.magic, self.version, self.record.size, self.count, self.file_id)
+
+    def _write_records(self, results_file, records, last, number):
+        # writes the records without the pointers, numbered from `number`, and chains them through `last`
+        for key, *values in records:
+            results_file.write(self.record.pack(key, last.get(key, -1) + 1, *values))
+            last[key] = number
+            number += 1
+        return number
+
+    def _values(self, view, number):
+        key, _, *values = self.record.unpack_from(view, self._offset(number))
+        return (key, *values)
+
+    def append(self, response):
+        if self.count >= self.capacity:
+            self._resize(self.capacity + self.grow_records)
+
+        key = response.resource.key
+        message = (response.message or '').encode('utf-8')[:self.message_size]
+        self.record.pack_into(self.map, self._offset(self.count), key, self.last.get(key, -1) + 1,
+                              response.last_check.timestamp(),
+                              math.nan if response.duration is None else response.duration,
+                              response.code or 0, response.status == ResourceStatus.SUCCESS, message)
+        self.last[key] = self.count
+        self.count += 1
+        self._write_count()
+
+    def records(self, reverse=False):
+        numbers = range(self.count - 1, -1, -1) if reverse else range(self.count)
+        for number in numbers:
+            yield self._values(self.map, number)
+
+    def history(self, key, limit):
+        # the newest `limit` records of a resource, the newest first
+        records, number = [], self.last.get(key, -1)
+        while number >= 0 and len(records) < limit:
+            _, previous, *values = self.record.unpack_from(self.map, self._offset(number))
+            records.append((key, *values))
+            number = previous - 1
+        return records
+
+    def restore(self, resources):
+        # Follows the records of every resource back from its last one, as far as its history goes, so the
+        # cost depends on the number of resources and their histories rather than on the size of the file.
+        responses = {}
+        for resource in resources:
+            records = self.history(resource.key, resource.history.capacity)
+            if not records:
+                continue
+            for _, timestamp, duration, code, success, _ in reversed(records):
+                resource.history.append(timestamp, None if math.isnan(duration) else duration, code, success)
+            _, timestamp, duration, code, success, message = records[0]
+            responses[resource] = ResourceResponse.restore(
+                resource, ResourceStatus.SUCCESS if success else ResourceStatus.FAIL, code=code or None,
+                duration=None if math.isnan(duration) else duration,
+                message=message.decode('utf-8', 'ignore') or None,
+                last_check=datetime.datetime.fromtimestamp(timestamp))
+        return responses
+
+    def compact(self, now=None):
+        self.finish_compaction(self.prepare_compaction(self.start_compaction(), now))
+
+    # A compaction keeps the newest records of every resource within the retention period, at most half of
+    # max_records. It's split so the engines can run the slow part off their event loop: start_compaction()
+    # and finish_compaction() run on the loop, prepare_compaction() may run in a thread meanwhile.
+
+    def start_compaction(self):
+        self.compacting = True
+        return self.count, dict(self.last)
+
+    def prepare_compaction(self, snapshot, now=None):
+        # writes the kept records of the snapshot to a new file; the records written before the snapshot
+        # don't change, and they are read through a mapping of their own
+        count, last = snapshot
+        since = (now or time.time()) - self.retention
+        temporary_path = self.path + '.tmp'
+        try:
+            with open(self.path, 'rb') as results_file, \
+                    mmap.mmap(results_file.fileno(), self._offset(count), access=mmap.ACCESS_READ) as view:
+                kept = []
+                for number in last.values():
+                    kept_records = 0
+                    while number >= 0 and kept_records < self.keep_per_resource:
+                        _, previous, timestamp = struct.unpack_from('<QId', view, self._offset(number))
+                        if timestamp < since:
+                            break
+                        kept.append(number)
+                        kept_records += 1
+                        number = previous - 1
+                kept.sort()
+                del kept[:max(len(kept) - self.max_records // 2, 0)]
+
+                file_id, chained = new_file_id(), {}
+                with open(temporary_path, 'wb') as compacted:
+                    compacted.write(self.header.pack(self.magic, self.version, self.record.size, 0, file_id))
+                    written = self._write_records(compacted, (self._values(view, number) for number in kept),
+                                                  chained, 0)
+                    compacted.flush()
+                    os.fsync(compacted.fileno())
+        except OSError:
+            remove(temporary_path)
+            return None
+        return count, written, chained, file_id
+
+    def finish_compaction(self, compaction):
+        # appends the records written since the snapshot to the new file and replaces the old one with it
+        try:
+            if compaction is None or self.map is None:
+                return
+            count, written, chained, file_id = compaction
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'r+b') as compacted:
+                compacted.seek(0, os.SEEK_END)
+                written = self._write_records(compacted, (self._values(self.map, number)
+                                                          for number in range(count, self.count)), chained, written)
+                compacted.seek(0)
+                compacted.write(self.header.pack(self.magic, self.version, self.record.size, written, file_id))
+                compacted.flush()
+                os.fsync(compacted.fileno())
+            self._close()
+            os.replace(temporary_path, self.path)
+            self.file_id, self.count, self.last = file_id, written, chained
+            self._save_index()
+            self._open()
+        finally:
+            self.compacting = False
+
+    def flush(self):
+        self.map.flush()
+        self._save_index()
+
+    def _close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        if self.map is not None:
+            self._save_index()
+        self._close()
+
+
+def new_file_id():
+    return int.from_bytes(os.urandom(8), 'little')
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,90 @@
+import datetime
+import heapq
+import itertools
+
+EPOCH = datetime.datetime(1970, 1, 1)
+SECOND = datetime.timedelta(seconds=1)
+
+
+def to_tick(moment):
+    return (moment - EPOCH) // SECOND
+
+
+def from_tick(tick):
+    return EPOCH + tick * SECOND
+
+
+class TimerWheel:
+    # Hierarchical timer wheel with one-second ticks: 60 slots of one second, 60 slots of one minute and
+    # 24 slots of one hour, timers further than a day ahead wait in a heap. A timer is put into the slot
+    # of the coarsest wheel that still tells it apart and moves down to the finer wheels as the time
+    # comes closer, so adding and expiring a timer don't depend on the number of timers. Timers that are
+    # already due are put into the current tick.
+    sizes = (60, 60, 24)
+    spans = (1, 60, 60 * 60)
+    day = 24 * 60 * 60
+
+    def __init__(self, now=None):
+        self.current = to_tick(now or datetime.datetime.now())
+        self.wheels = [[[] for _ in range(size)] for size in self.sizes]
+        self.overflow = []
+        self.counter = itertools.count()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, moment, item):
+        self.size += 1
+        self._insert(to_tick(moment), (moment, item))
+
+    def _insert(self, tick, entry):
+        delta = tick - self.current
+        for size, span, wheel in zip(self.sizes, self.spans, self.wheels):
+            if delta < size * span:
+                wheel[max(tick, self.current) // span % size].append(entry)
+                return
+        heapq.heappush(self.overflow, (tick, next(self.counter), entry))
+
+    def peek(self):
+        # the next tick with timers, or the next minute when the timers are further; None when empty
+        if not self.size:
+            return None
+        wheel = self.wheels[0]
+        for tick in range(self.current, self.current + 60 - self.current % 60):
+            if wheel[tick % 60]:
+                return from_tick(tick)
+        return from_tick(self.current + 60 - self.current % 60)
+
+    def pop(self):
+        # the time of the peeked tick and the (moment, item) timers expiring in it, moving past it
+        moment = self.peek()
+        if moment is None:
+            return None, []
+        tick = to_tick(moment)
+        while self.current < tick:
+            self._advance()
+        slot = self.current % 60
+        entries, self.wheels[0][slot] = self.wheels[0][slot], []
+        self.size -= len(entries)
+        self._advance()
+        return moment, entries
+
+    def _advance(self):
+        self.current += 1
+        if self.current % 60:
+            return
+        # at the start of every minute, hour and day the timers of the coarser wheels move down
+        if not self.current % self.day:
+            while self.overflow and self.overflow[0][0] - self.current < self.day:
+                tick, _, entry = heapq.heappop(self.overflow)
+                self._insert(tick, entry)
+        for level in range(len(self.sizes) - 1, 0, -1):
+            span = self.spans[level]
+            if self.current % span:
+                continue
+            wheel = self.wheels[level]
+            slot = self.current // span % self.sizes[level]
+            entries, wheel[slot] = wheel[slot], []
+            for entry in entries:
+                self._insert(to_tick(entry[0]), entry)
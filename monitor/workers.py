@@ -0,0 +1,142 @@
+import hashlib
+import multiprocessing
+
+import gevent
+import gevent.event
+from gevent.socket import wait_read
+
+from base import logger, no_check
+from green import Monitor
+from resource import ResourceResponse
+
+
+def shard_of(url, workers):
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % workers
+
+
+class ShardMonitor(Monitor):
+    # Runs in a child process: checks its shard of the resources and sends the results to the parent.
+    stats_interval = 10
+
+    def __init__(self, parent, resources, connection):
+        super().__init__()
+        self.resources = resources
+        self.pool_size = parent.pool_size
+        self.idle_timeout = parent.idle_timeout
+        self.concurrency = parent.concurrency
+        self.queue_size = parent.queue_size
+        self.connection = connection
+
+    def run(self, config_file=None):
+        self.sessions.pool_size = self.pool_size
+        self.sessions.idle_timeout = self.idle_timeout
+        self.limiter = self._build_limiter(gevent.event.Event)
+        self.workq = self._build_work_queue(gevent.event.Event)
+
+        self.scheduler = gevent.spawn(self._scheduler_job)
+        self.supervisor = gevent.spawn(self._supervisor_job)
+        gevent.spawn(self._stats_job)
+
+        gevent.joinall([self.scheduler, self.supervisor])
+
+    def _send(self, message):
+        try:
+            self.connection.send(message)
+        except OSError:
+            # the parent has gone away
+            raise SystemExit(0)
+
+    def _record(self, resource, response):
+        self._send(('result', resource.key, response.dump()))
+
+    def _stats_job(self):
+        while True:
+            gevent.sleep(self.stats_interval)
+            self._send(('connections', self.sessions.stats()))
+            self._send(('concurrency', self.limiter.stats()))
+
+
+class ShardedMonitor(Monitor):
+    # Spreads the resources over child processes by the hash of their URLs. The parent only collects
+    # the results, keeps the store and the log and serves the report.
+
+    def __init__(self, workers):
+        super().__init__()
+        self.workers = workers
+        self.processes = []
+        self.shard_connections = {}
+        self.shard_concurrency = {}
+
+    def run(self, config_file):
+        self.load_config(config_file)
+
+        # all the children are forked before any greenlet is spawned, so they don't inherit one
+        context = multiprocessing.get_context('fork')
+        connections = []
+        for shard in range(self.workers):
+            # resources fetching the same URL go to one worker, so their checks can share the requests
+            resources = [resource for resource in self.resources
+                         if shard_of(resource.fetch_key, self.workers) == shard]
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(target=self._run_shard, args=(resources, writer), daemon=True)
+            process.start()
+            writer.close()
+            self.processes.append(process)
+            connections.append(reader)
+
+        readers = [gevent.spawn(self._receive, shard, reader) for shard, reader in enumerate(connections)]
+        self.server = gevent.spawn(self._server_job)
+
+        gevent.joinall([self.server] + readers)
+
+    def _run_shard(self, resources, connection):
+        ShardMonitor(self, resources, connection).run()
+
+    def _receive(self, shard, connection):
+        resources = {resource.key: resource for resource in self.resources}
+        while True:
+            wait_read(connection.fileno())
+            try:
+                message = connection.recv()
+            except EOFError:
+                logger.error('Worker %s has stopped.', shard, extra=no_check)
+                return
+            if message[0] == 'result':
+                _, key, values = message
+                resource = resources[key]
+                self._record(resource, ResourceResponse.load(resource, values))
+            elif message[0] == 'connections':
+                self.shard_connections[shard] = message[1]
+            elif message[0] == 'concurrency':
+                self.shard_concurrency[shard] = message[1]
+
+    def _connection_stats(self):
+        hosts = {}
+        for stats in self.shard_connections.values():
+            for host in stats['hosts']:
+                merged = hosts.setdefault(host['host'], dict(host, requests=0, connections=0, reused=0))
+                for name in ('requests', 'connections', 'reused'):
+                    merged[name] += host[name]
+        return {
+            'hosts': [host for _, host in sorted(hosts.items())],
+            'requests': sum(host['requests'] for host in hosts.values()),
+            'connections': sum(host['connections'] for host in hosts.values()),
+            'reused': sum(host['reused'] for host in hosts.values()),
+        }
+
+    def _concurrency_stats(self):
+        # every worker has its own limiter, the limits and the counters add up
+        hosts = {}
+        for stats in self.shard_concurrency.values():
+            for host in stats['hosts']:
+                hosts[host['host']] = host
+        limit = sum(stats['limit'] for stats in self.shard_concurrency.values())
+        inflight = sum(stats['inflight'] for stats in self.shard_concurrency.values())
+        return {
+            'limit': limit,
+            'inflight': inflight,
+            'queued': sum(stats['queued'] for stats in self.shard_concurrency.values()),
+            'saturation': inflight / float(limit) if limit else 0.0,
+            'hosts': [host for _, host in sorted(hosts.items())],
+        }
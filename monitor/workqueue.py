@@ -0,0 +1,139 @@
+import datetime
+import heapq
+import itertools
+
+
+class Job:
+    # resources checked against one request to `host`, due at `run_at` and stale from `deadline` on,
+    # when the next check of one of them is due
+
+    __slots__ = ('resources', 'run_at', 'deadline', 'host')
+
+    def __init__(self, resources, run_at, deadline=None, host=None):
+        self.resources = resources
+        self.run_at = run_at
+        self.deadline = deadline
+        self.host = host
+
+    def expired(self, now=None):
+        return self.deadline is not None and (now or datetime.datetime.now()) >= self.deadline
+
+
+class WorkQueue:
+    # Jobs waiting for a worker, the earliest scheduled first. The scheduler waits for `not_full` before
+    # putting a job, so at most `size` jobs wait, and get() hands out jobs while fewer than `workers` run.
+    # A resource whose check is still waiting or running is skipped when it's due again, and a job that
+    # doesn't start before its deadline is dropped; both are counted per resource. With `per_host` set,
+    # the jobs of a host that has as many jobs running are held back until one of them is done, so a slow
+    # host cannot take every worker while the jobs of the other hosts wait. `ready` is set while get()
+    # may have a job to hand out. The events are created by `event_factory`, so the queue works with
+    # gevent and asyncio alike.
+
+    def __init__(self, event_factory, size=10000, workers=100, per_host=None):
+        self.size = size
+        self.workers = workers
+        self.per_host = per_host
+        self.heap = []
+        # the jobs held back by the host, and the number of running jobs by the host
+        self.deferred = {}
+        self.host_active = {}
+        self.counter = itertools.count()
+        # the job waiting for every queued resource, and the resources being checked
+        self.waiting = {}
+        self.running = set()
+        self.active = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.ready = event_factory()
+        self.not_full = event_factory()
+        self.not_full.set()
+
+    def __len__(self):
+        return len(self.heap) + sum(len(entries) for entries in self.deferred.values())
+
+    def put(self, job, now=None):
+        # returns False when all the resources of the job have been skipped
+        now = now or datetime.datetime.now()
+        resources = []
+        for resource in job.resources:
+            waiting = self.waiting.get(resource)
+            if resource in self.running or (waiting is not None and not waiting.expired(now)):
+                self.skipped += 1
+                continue
+            if waiting is not None:
+                # the waiting job has missed its deadline, the new one takes the resource over
+                waiting.resources.remove(resource)
+                self.dropped += 1
+            resources.append(resource)
+        if not resources:
+            return False
+
+        job.resources = resources
+        for resource in resources:
+            self.waiting[resource] = job
+        heapq.heappush(self.heap, (job.run_at, next(self.counter), job))
+        self._update()
+        return True
+
+    def get(self, now=None):
+        # the earliest job still in time whose host is under its limit, None when there is none or all
+        # the workers are busy
+        job = None
+        if self.active < self.workers:
+            now = now or datetime.datetime.now()
+            while self.heap and job is None:
+                entry = heapq.heappop(self.heap)
+                job = entry[2]
+                expired = job.expired(now)
+                if not expired and job.resources and self._host_busy(job.host):
+                    # the job stays queued until a job of its host is done
+                    heapq.heappush(self.deferred.setdefault(job.host, []), entry)
+                    job = None
+                    continue
+                for resource in job.resources:
+                    del self.waiting[resource]
+                if expired:
+                    self.dropped += len(job.resources)
+                if expired or not job.resources:
+                    # the next held back job of the host is put in turn instead
+                    self._undefer(job.host)
+                    job = None
+            if job is not None:
+                self.running.update(job.resources)
+                self.active += 1
+                self.host_active[job.host] = self.host_active.get(job.host, 0) + 1
+        self._update()
+        return job
+
+    def done(self, job, dropped=False):
+        # `dropped` when the job has run out of time waiting for a free slot after get()
+        self.running.difference_update(job.resources)
+        self.active -= 1
+        self.host_active[job.host] -= 1
+        if not self.host_active[job.host]:
+            del self.host_active[job.host]
+        if dropped:
+            self.dropped += len(job.resources)
+        self._undefer(job.host)
+        self._update()
+
+    def _host_busy(self, host):
+        return self.per_host is not None and self.host_active.get(host, 0) >= self.per_host
+
+    def _undefer(self, host):
+        # puts the earliest held back job of the host back in turn
+        entries = self.deferred.get(host)
+        if entries:
+            heapq.heappush(self.heap, heapq.heappop(entries))
+            if not entries:
+                del self.deferred[host]
+
+    def _update(self):
+        if self.heap and self.active < self.workers:
+            self.ready.set()
+        else:
+            self.ready.clear()
+        if len(self) < self.size:
+            self.not_full.set()
+        else:
+            self.not_full.clear()
@@ -1,6 +1,19 @@
 import os
 import sys
 
+import pytest
+
 root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 sys.path.insert(0, os.path.join(root, 'monitor'))
+
+
+@pytest.fixture()
+def make_resource():
+    from resource import MonitoredResource
+
+    def make_resource(name):
+        return MonitoredResource(dict(url='http://{}/'.format(name), schedule='* * * * *',
+                                      conditions=dict(status=200)), name=name)
+
+    return make_resource
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import aiohttp
+import pytest
+
+from aio import AsyncCrawler, ConnectionStats, PhaseTimer
+from condition import ContentCondition, StatusCondition, VerdictCache
+from resource import ResourceStatus
+
+
+class MockResource:
+
+    def __init__(self, url, conditions, max_body_bytes=1024):
+        self.url = url
+        self.conditions = conditions
+        self.max_body_bytes = max_body_bytes
+        self.verdicts = VerdictCache()
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = 'In the end, there can be only one'.encode('utf-8') * 100
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server_url():
+    server = HTTPServer(('127.0.0.1', 0), PageHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def check(*resources):
+    connections = ConnectionStats()
+    trace_configs = [connections.trace_config(), PhaseTimer().trace_config()]
+
+    async def run():
+        async with aiohttp.ClientSession(trace_configs=trace_configs) as session:
+            return [await AsyncCrawler(resource, session).check() for resource in resources]
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run()), connections.stats()
+    finally:
+        loop.close()
+
+
+def test_valid_conditions(server_url):
+    resource = MockResource(server_url, [StatusCondition(200), ContentCondition('only one')])
+
+    (response, ), _ = check(resource)
+
+    assert response.status == ResourceStatus.SUCCESS
+    assert response.code == 200
+    assert response.headers['Content-Type'] == 'text/html; charset=utf-8'
+
+
+def test_condition_error(server_url):
+    resource = MockResource(server_url, [StatusCondition(200), ContentCondition('two')])
+
+    (response, ), _ = check(resource)
+
+    assert response.status == ResourceStatus.FAIL
+    assert response.message == 'The string hasn\'t been found. Only the first 1024 bytes of the body ' \
+                               'have been checked.'
+
+
+def test_request_error():
+    server = HTTPServer(('127.0.0.1', 0), PageHandler)
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.server_close()
+
+    (response, ), _ = check(MockResource(url, [StatusCondition(200)]))
+
+    assert response.status == ResourceStatus.FAIL
+    assert response.message == 'Connection error. Unable to check the website.'
+    assert response.code is None
+
+
+class SlowHandler(PageHandler):
+
+    def do_GET(self):
+        time.sleep(0.5)
+        super().do_GET()
+
+
+def test_timeout(monkeypatch):
+    monkeypatch.setattr(AsyncCrawler, 'timeout', aiohttp.ClientTimeout(total=None, sock_connect=1, sock_read=0.1))
+    server = HTTPServer(('127.0.0.1', 0), SlowHandler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            crawlers = [AsyncCrawler(MockResource(url, [StatusCondition(200)]), session),
+                        AsyncCrawler(MockResource('http://127.0.0.1:1/', [StatusCondition(200)]), session)]
+            return crawlers, [await crawler.check() for crawler in crawlers]
+
+    loop = asyncio.new_event_loop()
+    try:
+        crawlers, responses = loop.run_until_complete(run())
+    finally:
+        loop.close()
+        thread.join()
+        server.server_close()
+
+    assert [response.status for response in responses] == [ResourceStatus.FAIL, ResourceStatus.FAIL]
+    # only the timeout shrinks the concurrency limit, a refused connection doesn't
+    assert [crawler.timed_out for crawler in crawlers] == [True, False]
+
+
+def test_connections_are_reused(server_url):
+    resource = MockResource(server_url, [ContentCondition('only one')], max_body_bytes=None)
+
+    responses, connections = check(resource, resource, resource)
+
+    assert [response.status for response in responses] == [ResourceStatus.SUCCESS] * 3
+    assert connections['requests'] == 3
+    assert connections['connections'] == 1
+    assert connections['reused'] == 2
+
+
+def test_phase_timings(server_url):
+    resource = MockResource(server_url, [ContentCondition('only one')], max_body_bytes=None)
+
+    (first, second), _ = check(resource, resource)
+
+    assert first.phases['connect'] >= 0
+    assert first.phases['ttfb'] > 0
+    assert first.phases['download'] >= 0
+    assert second.phases['connect'] is None
+    assert second.phases['ttfb'] > 0
+
+
+def test_body_verdicts_are_reused(server_url):
+    resource = MockResource(server_url, [ContentCondition('only one')], max_body_bytes=None)
+
+    responses, _ = check(resource, resource)
+
+    assert [response.status for response in responses] == [ResourceStatus.SUCCESS] * 2
+    assert list(resource.verdicts.bodies.values()) == [None]
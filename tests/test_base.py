@@ -0,0 +1,308 @@
+import datetime
+import json
+import threading
+
+import pytest
+import yaml
+from freezegun import freeze_time
+
+from base import BaseMonitor, Subscriber
+from errors import InvalidConfigError
+from resource import MonitoredResource, ResourceResponse, ResourceStatus
+from store import ResultStore
+
+
+class MockMonitor(BaseMonitor):
+
+    def __init__(self):
+        super().__init__()
+        self.semaphore_recent_responses = threading.Lock()
+
+    def _connection_stats(self):
+        return {'hosts': [], 'requests': 0, 'connections': 0, 'reused': 0}
+
+    def _concurrency_stats(self):
+        return {'limit': 10, 'inflight': 0, 'queued': 0, 'saturation': 0.0, 'hosts': []}
+
+    def _wake_scheduler(self):
+        self.woken = True
+
+
+@pytest.fixture()
+def monitor(make_resource):
+    monitor = MockMonitor()
+    for number in range(5):
+        resource = make_resource('site{}'.format(number))
+        status = ResourceStatus.FAIL if number % 2 else ResourceStatus.SUCCESS
+        monitor.resources.append(resource)
+        monitor._record(resource, ResourceResponse(resource, status, duration=0.1))
+    return monitor
+
+
+def request(monitor, path='/', query='', **headers):
+    environ = dict(PATH_INFO=path, QUERY_STRING=query, REQUEST_METHOD='GET')
+    environ.update(headers)
+    started = {}
+
+    def start_response(status, response_headers):
+        started.update(status=status, headers=dict(response_headers))
+
+    body = b''.join(monitor._report_application(environ, start_response))
+    return started['status'], started['headers'], body
+
+
+@freeze_time('2012-01-14 12:32')
+def test_report_is_cached_per_version(monitor):
+    status, headers, body = request(monitor)
+
+    assert status == '200 OK'
+    assert b'http://site4/' in body
+
+    status, _, body = request(monitor, HTTP_IF_NONE_MATCH=headers['ETag'])
+
+    assert status == '304 Not Modified'
+    assert body == b''
+
+    resource = monitor.resources[0]
+    monitor._record(resource, ResourceResponse(resource, ResourceStatus.FAIL, duration=0.1))
+    status, new_headers, _ = request(monitor, HTTP_IF_NONE_MATCH=headers['ETag'])
+
+    assert status == '200 OK'
+    assert new_headers['ETag'] != headers['ETag']
+
+
+def test_results_api_pagination(monitor):
+    keys, cursor = [], None
+    while True:
+        status, _, body = request(monitor, '/api/results', 'limit=2' + ('&cursor={}'.format(cursor) if cursor else ''))
+        assert status == '200 OK'
+        page = json.loads(body.decode('utf-8'))
+        keys.extend(result['key'] for result in page['results'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    assert keys == sorted((str(resource.key) for resource in monitor.resources), key=int)
+
+
+def test_results_api_filtering(monitor):
+    status, headers, body = request(monitor, '/api/results', 'status=fail')
+
+    assert status == '200 OK'
+    assert sorted(result['name'] for result in json.loads(body.decode('utf-8'))['results']) == ['site1', 'site3']
+
+    status, _, _ = request(monitor, '/api/results', 'status=fail', HTTP_IF_NONE_MATCH=headers['ETag'])
+
+    assert status == '304 Not Modified'
+
+
+@pytest.mark.parametrize("path,query,status", [
+    ('/api/results', 'limit=a', '400 Bad Request'),
+    ('/api/results', 'limit=0', '400 Bad Request'),
+    ('/api/results', 'cursor=a', '400 Bad Request'),
+    ('/missing', '', '404 Not Found'),
+])
+def test_invalid_requests(monitor, path, query, status):
+    assert request(monitor, path, query)[0] == status
+
+
+def test_records_are_published(monitor):
+    subscriber = monitor._subscribe(threading.Event)
+    resource = monitor.resources[0]
+
+    monitor._record(resource, ResourceResponse(resource, ResourceStatus.FAIL, duration=0.1, message='Oops'))
+
+    assert subscriber.event.is_set()
+    (message, ) = subscriber.pop()
+    assert message.startswith(b'event: row\ndata: ')
+    delta = json.loads(message[len(b'event: row\ndata: '):].decode('utf-8'))
+    assert delta['key'] == str(resource.key)
+    assert delta['html'].startswith('<tr id="row-{}">'.format(resource.key))
+    assert 'Oops' in delta['html']
+    assert not subscriber.event.is_set()
+
+
+def test_slow_subscriber_overflows(monitor, monkeypatch):
+    monkeypatch.setattr(Subscriber, 'size', 2)
+    subscriber = monitor._subscribe(threading.Event)
+    resource = monitor.resources[0]
+
+    for _ in range(3):
+        monitor._record(resource, ResourceResponse(resource, ResourceStatus.SUCCESS, duration=0.1))
+
+    assert subscriber.overflowed
+    assert subscriber.pop() == []
+
+
+def test_metrics(monitor):
+    status, headers, body = request(monitor, '/metrics')
+    lines = body.decode('utf-8').splitlines()
+
+    assert status == '200 OK'
+    assert headers['Content-Type'] == 'text/plain; version=0.0.4'
+    assert 'monitor_check_duration_seconds_count{name="site0",url="http://site0/"} 1' in lines
+    assert 'monitor_checks_total{status="fail",code=""} 2' in lines
+    assert 'monitor_concurrency_limit 10' in lines
+    assert '# TYPE monitor_requests_total counter' in lines
+    assert 'monitor_checks_dropped_total 0' in lines
+
+
+def write_config(path, sites):
+    path.write(yaml.safe_dump({'log_file': str(path) + '.log', 'sites': sites}, sort_keys=False))
+
+
+def site(url, schedule='* * * * *'):
+    return {'url': url, 'schedule': schedule, 'conditions': {'status': 200}}
+
+
+def test_reload_config(tmpdir):
+    path = tmpdir.join('config.yaml')
+    write_config(path, {'onet': site('http://www.onet.pl/'), 'wp': site('http://www.wp.pl/'),
+                        'gazeta': site('http://www.gazeta.pl/')})
+    monitor = MockMonitor()
+    monitor.load_config(str(path))
+    monitor._start_timetable()
+    onet, wp, gazeta = monitor.resources
+    for resource in monitor.resources:
+        monitor._record(resource, ResourceResponse(resource, ResourceStatus.SUCCESS, duration=0.1))
+
+    write_config(path, {'onet': site('http://www.onet.pl/'), 'wp': site('https://www.wp.pl/'),
+                        'twitter': site('http://www.twitter.com/')})
+    monitor.reload_config()
+
+    assert [resource.name for resource in monitor.resources] == ['onet', 'wp', 'twitter']
+    assert monitor.resources[0] is onet
+    assert monitor.resources[1] is not wp
+    assert wp.retired and gazeta.retired and not onet.retired
+    assert list(monitor.recent_responses) == [onet]
+    assert monitor.woken
+
+    # the stale timetable entries are dropped, the new resources are scheduled
+    due = []
+    while monitor.timetable and monitor.timetable.peek() <= datetime.datetime.now():
+        due.extend(monitor._pop_due())
+    assert sorted(resource.name for resource in due) == ['onet', 'twitter', 'wp']
+    assert wp not in due and gazeta not in due
+
+    # results of the checks in flight for the retired resources are ignored
+    monitor._record(gazeta, ResourceResponse(gazeta, ResourceStatus.SUCCESS, duration=0.1))
+    assert gazeta not in monitor.recent_responses
+
+
+def test_scheduler_jitter(tmpdir):
+    path = tmpdir.join('config.yaml')
+    path.write(yaml.safe_dump({'log_file': str(path) + '.log', 'scheduler': {'jitter': True},
+                               'sites': {'onet': site('http://www.onet.pl/')}}))
+    monitor = MockMonitor()
+    monitor.load_config(str(path))
+
+    assert monitor.resources[0].offset == MonitoredResource.jitter_offset('http://www.onet.pl/')
+
+    path.write(yaml.safe_dump({'log_file': str(path) + '.log', 'scheduler': {'jitter': 'yes'},
+                               'sites': {'onet': site('http://www.onet.pl/')}}))
+    with pytest.raises(InvalidConfigError) as cm:
+        MockMonitor().load_config(str(path))
+
+    assert str(cm.value) == 'Invalid config file. "yes" is an invalid value for the "jitter" of the "scheduler" section'
+
+
+@pytest.mark.parametrize('section,value,error', [
+    ('store', {'path': 'results.db', 'max_records': 'lots'},
+     '"lots" is an invalid value for the "max_records" of the "store" section'),
+    ('store', {'path': 'results.db', 'retention': -1},
+     '"-1" is an invalid value for the "retention" of the "store" section'),
+    ('connection_pool', {'size': 'ten'}, '"ten" is an invalid value for the "size" of the "connection_pool" section'),
+    ('connection_pool', {'idle_timeout': 0},
+     '"0" is an invalid value for the "idle_timeout" of the "connection_pool" section'),
+])
+def test_invalid_section(tmpdir, section, value, error):
+    path = tmpdir.join('config.yaml')
+    path.write(yaml.safe_dump({'log_file': str(path) + '.log', section: value,
+                               'sites': {'onet': site('http://www.onet.pl/')}}))
+    with pytest.raises(InvalidConfigError) as cm:
+        MockMonitor().load_config(str(path))
+
+    assert str(cm.value) == 'Invalid config file. ' + error
+
+
+def test_invalid_config_is_not_reloaded(tmpdir):
+    path = tmpdir.join('config.yaml')
+    write_config(path, {'onet': site('http://www.onet.pl/')})
+    monitor = MockMonitor()
+    monitor.load_config(str(path))
+    resources = list(monitor.resources)
+
+    write_config(path, {'onet': site('http://www.onet.pl/', 'every minute')})
+    monitor.reload_config()
+
+    assert monitor.resources == resources
+    assert not resources[0].retired
+
+
+@pytest.mark.parametrize('section', [
+    {'url': 'http://www.onet.pl/', 'schedule': '61-x * * * *', 'conditions': {'status': 200}},
+    {'url': 'http://www.onet.pl/', 'schedule': '* * * * *', 'conditions': {'header': 'Server'}},
+    {'url': 'http://www.onet.pl/', 'schedule': '* * * * *', 'conditions': {'status': 'abc'}},
+    'http://www.onet.pl/',
+])
+def test_invalid_site_is_not_reloaded(tmpdir, section):
+    path = tmpdir.join('config.yaml')
+    write_config(path, {'onet': site('http://www.onet.pl/')})
+    monitor = MockMonitor()
+    monitor.load_config(str(path))
+    resources = list(monitor.resources)
+
+    write_config(path, {'onet': section, 'wp': site('http://www.wp.pl/')})
+    monitor.reload_config()
+
+    assert monitor.resources == resources
+    assert not resources[0].retired
+
+
+def test_coalesce_due_resources(make_resource):
+    resources = [make_resource('onet'), make_resource('wp'),
+                 MonitoredResource(dict(url='HTTP://ONET/#top', schedule='*/5 * * * *', conditions=dict(status=201)),
+                                   name='onet-created')]
+
+    assert MockMonitor._coalesce(resources) == [[resources[0], resources[2]], [resources[1]]]
+
+
+@freeze_time('2012-01-14 12:32:30')
+def test_due_jobs(make_resource):
+    monitor = MockMonitor()
+    monitor.resources = [make_resource('onet'), make_resource('wp'),
+                         MonitoredResource(dict(url='http://onet/', schedule='*/5 * * * *', conditions=dict(status=201)),
+                                           name='onet-created')]
+    monitor._start_timetable()
+
+    jobs = monitor._due_jobs()
+
+    assert [job.resources for job in jobs] == [[monitor.resources[0]], [monitor.resources[1]]]
+    assert jobs[0].run_at == datetime.datetime(2012, 1, 14, 12, 32, 30)
+    assert jobs[0].deadline == datetime.datetime(2012, 1, 14, 12, 33)
+    assert not jobs[0].expired()
+
+
+@freeze_time('2012-01-14 12:32:07')
+def test_sub_minute_schedule():
+    monitor = MockMonitor()
+    resource = MonitoredResource(dict(url='http://onet/', schedule='*/15 * * * * *', conditions=dict(status=200)))
+    monitor.resources = [resource]
+    monitor._start_timetable()
+
+    runs = []
+    for _ in range(4):
+        runs.append(monitor.timetable.peek())
+        assert monitor._pop_due() == [resource]
+
+    assert runs == [datetime.datetime(2012, 1, 14, 12, 32, 7)] + [
+        datetime.datetime(2012, 1, 14, 12, 32, 15) + datetime.timedelta(seconds=15 * number) for number in range(3)]
+
+
+def test_store_is_compacted(monitor, tmpdir):
+    monitor.store = ResultStore(str(tmpdir.join('results.db')), max_records=8, keep_per_resource=1)
+    for resource in monitor.resources * 2:
+        monitor._record(resource, ResourceResponse(resource, ResourceStatus.SUCCESS, duration=0.1))
+
+    assert monitor.store.count == 6
+    assert not monitor.store.compacting
@@ -0,0 +1,170 @@
+import datetime
+import sqlite3
+import time
+
+import gevent
+import yaml
+
+from cluster import ClusterMonitor, Coordinator, HashRing, decode_response, encode_response
+from resource import ResourceResponse, ResourceStatus
+
+
+def make_node(path, node, resources):
+    monitor = ClusterMonitor(str(path), node, lease=30)
+    monitor.coordinator = Coordinator(str(path), node)
+    monitor.resources = resources
+    return monitor
+
+
+def test_hash_ring():
+    keys = ['http://www.example{}.com/'.format(number) for number in range(3000)]
+    ring = HashRing(['a', 'b', 'c'])
+    owners = [ring.owner(key) for key in keys]
+
+    assert all(700 < owners.count(node) < 1300 for node in ('a', 'b', 'c'))
+    # only the keys of the node that has left move
+    smaller = HashRing(['a', 'c'])
+    assert all(smaller.owner(key) == owner for key, owner in zip(keys, owners) if owner != 'b')
+    assert HashRing([]).owner(keys[0]) is None
+
+
+def test_leases(tmp_path):
+    first = Coordinator(str(tmp_path / 'cluster.db'), 'a')
+    second = Coordinator(str(tmp_path / 'cluster.db'), 'b')
+    first.renew(120)
+    second.renew(110)
+
+    assert first.nodes(100) == ['a', 'b']
+    assert second.nodes(115) == ['a']
+    second.renew(130)
+    first.leave()
+    assert second.nodes(115) == ['b']
+
+
+def test_results(tmp_path):
+    first = Coordinator(str(tmp_path / 'cluster.db'), 'a')
+    second = Coordinator(str(tmp_path / 'cluster.db'), 'b')
+    first.publish([('one', '1'), ('two', '2')])
+    second.publish([('three', '3')])
+
+    rows = second.results(0)
+    assert [(key, response) for _, key, response in rows] == [('one', '1'), ('two', '2')]
+    first.publish([('one', '4')])
+    assert [(key, response) for _, key, response in second.results(rows[-1][0])] == [('one', '4')]
+    assert [key for _, key, _ in first.results(0)] == ['three']
+
+
+def test_encode_response(make_resource):
+    resource = make_resource('onet')
+    response = ResourceResponse(resource, ResourceStatus.FAIL, duration=0.5, message='Bad status code: 500',
+                                phases=dict(dns=0.1, connect=None))
+    response.code = 500
+
+    decoded = decode_response(resource, encode_response(response))
+
+    assert decoded.resource is resource
+    assert decoded.dump() == response.dump()
+
+
+def test_nodes_split_and_share(tmp_path, make_resource):
+    names = ['site{}'.format(number) for number in range(50)]
+    first = make_node(tmp_path / 'cluster.db', 'a', [make_resource(name) for name in names])
+    second = make_node(tmp_path / 'cluster.db', 'b', [make_resource(name) for name in names])
+    first._sync(1000)
+    second._sync(1000)
+    first._sync(1000)
+
+    owned = [[resource.name for resource in node.resources if node._owns(resource)] for node in (first, second)]
+    assert owned[0] and owned[1]
+    assert sorted(owned[0] + owned[1]) == sorted(names)
+
+    resource = second.resources[names.index(owned[1][0])]
+    response = ResourceResponse(resource, ResourceStatus.SUCCESS, duration=0.25)
+    second._record(resource, response)
+    second._sync(1005)
+    first._sync(1005)
+
+    merged = first.recent_responses[first.resources[names.index(owned[1][0])]]
+    assert merged.duration == 0.25
+    assert merged.status == ResourceStatus.SUCCESS
+    assert len(first.resources[names.index(owned[1][0])].history) == 1
+
+    # an older result doesn't replace a newer one
+    response.last_check -= datetime.timedelta(minutes=5)
+    response.duration = 1.0
+    second._record(resource, response)
+    second._sync(1010)
+    first._sync(1010)
+    assert first.recent_responses[first.resources[names.index(owned[1][0])]].duration == 0.25
+
+
+def test_takeover(tmp_path, make_resource):
+    names = ['site{}'.format(number) for number in range(50)]
+    first = make_node(tmp_path / 'cluster.db', 'a', [make_resource(name) for name in names])
+    second = make_node(tmp_path / 'cluster.db', 'b', [make_resource(name) for name in names])
+    first._sync(1000)
+    second._sync(1000)
+    first._sync(1000)
+    assert not all(first._owns(resource) for resource in first.resources)
+
+    # the second node stops renewing its lease, it runs out within the lease period
+    first._sync(1010)
+    assert not all(first._owns(resource) for resource in first.resources)
+    first._sync(1030)
+    assert all(first._owns(resource) for resource in first.resources)
+
+
+def test_locked_file_doesnt_block_the_checks(tmp_path, make_resource):
+    node = make_node(tmp_path / 'cluster.db', 'a', [make_resource('onet')])
+    node.outbox['1'] = '{}'
+    holder = sqlite3.connect(str(tmp_path / 'cluster.db'), isolation_level=None)
+    holder.execute('BEGIN IMMEDIATE')
+    ticks = []
+
+    def tick():
+        while True:
+            ticks.append(None)
+            gevent.sleep(0.01)
+
+    ticker = gevent.spawn(tick)
+    gevent.spawn_later(0.3, holder.execute, 'COMMIT')
+    node._sync(1000)
+    ticker.kill()
+
+    assert len(ticks) > 10
+    assert node.outbox == {}
+    assert node.coordinator.nodes(1000) == ['a']
+
+
+def test_nodes_write_their_own_log_and_store(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump({
+        'log_file': str(tmp_path / 'monitor.log'),
+        'store': {'path': str(tmp_path / 'results.db')},
+        'sites': {'onet': {'url': 'http://www.onet.pl/', 'schedule': '* * * * *', 'conditions': {'status': 200}}},
+    }))
+    nodes = [ClusterMonitor(str(tmp_path / 'cluster.db'), name) for name in ('host:8001', 'host:8002')]
+    for node in nodes:
+        node.load_config(str(path))
+        node.log_handler.close()
+        node.store.close()
+
+    assert [node.log_handler.path for node in nodes] == [str(tmp_path / 'monitor.host_8001.log'),
+                                                         str(tmp_path / 'monitor.host_8002.log')]
+    assert [node.store.path for node in nodes] == [str(tmp_path / 'results.host_8001.db'),
+                                                   str(tmp_path / 'results.host_8002.db')]
+
+
+def test_first_sync_before_the_checks(tmp_path, make_resource):
+    names = ['site{}'.format(number) for number in range(50)]
+    Coordinator(str(tmp_path / 'cluster.db'), 'b').renew(time.time() + 60)
+    node = make_node(tmp_path / 'cluster.db', 'a', [make_resource(name) for name in names])
+
+    jobs = [gevent.spawn(node._cluster_job), gevent.spawn(node._scheduler_job)]
+    gevent.sleep(0.5)
+    gevent.killall(jobs)
+
+    queued = set(node.workq.waiting)
+    assert queued
+    assert queued == {resource for resource in node.resources if node._owns(resource)}
+    assert len(queued) < len(names)
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from concurrency import AdaptiveLimit, ConcurrencyLimiter
+
+
+def test_limit_grows_while_latency_is_flat():
+    limit = AdaptiveLimit(initial=10, maximum=12)
+
+    for _ in range(11):
+        limit.on_result(0.1, timed_out=False)
+
+    assert int(limit) == 11
+
+    for _ in range(100):
+        limit.on_result(0.1, timed_out=False)
+
+    assert int(limit) == 12
+
+
+def test_limit_does_not_grow_while_latency_rises():
+    limit = AdaptiveLimit(initial=10)
+    for _ in range(50):
+        limit.on_result(0.1, timed_out=False)
+    grown = limit.limit
+
+    for _ in range(5):
+        limit.on_result(1.0, timed_out=False)
+
+    assert not limit.latency_is_flat
+    assert limit.limit == grown
+
+
+def test_limit_halves_on_timeouts():
+    limit = AdaptiveLimit(initial=16, minimum=3)
+    for _ in range(16):
+        limit.on_result(0.1, timed_out=False)
+    limit.limit = 16
+
+    limit.on_result(None, timed_out=True)
+    limit.on_result(None, timed_out=True)
+
+    assert int(limit) == 8
+
+    for _ in range(50):
+        limit.on_result(None, timed_out=True)
+
+    assert int(limit) == 3
+
+
+@pytest.fixture()
+def limiter():
+    return ConcurrencyLimiter(threading.Event, per_host=2, initial=3, maximum=3)
+
+
+def test_per_host_limit(limiter):
+    assert limiter.acquire('http://slow') is None
+    assert limiter.acquire('http://slow') is None
+    waiter = limiter.acquire('http://slow')
+
+    assert not waiter.is_set()
+    assert limiter.acquire('http://fast') is None
+    assert limiter.stats()['hosts'] == [
+        {'host': 'http://fast', 'inflight': 1, 'queued': 0},
+        {'host': 'http://slow', 'inflight': 2, 'queued': 1},
+    ]
+
+    limiter.release('http://slow', 0.1)
+
+    assert waiter.is_set()
+    assert limiter.stats()['hosts'][1] == {'host': 'http://slow', 'inflight': 2, 'queued': 0}
+
+
+def test_hosts_take_turns(limiter):
+    for host in ('http://a', 'http://a', 'http://b'):
+        assert limiter.acquire(host) is None
+    waiters = [(host, limiter.acquire(host)) for host in ('http://c', 'http://c', 'http://d')]
+
+    assert limiter.stats()['saturation'] == 1.0
+    assert limiter.stats()['queued'] == 3
+
+    limiter.release('http://a', 0.1)
+    limiter.release('http://a', 0.1)
+
+    assert [host for host, waiter in waiters if waiter.is_set()] == ['http://c', 'http://d']
+
+    limiter.release('http://b', 0.1)
+
+    assert all(waiter.is_set() for _, waiter in waiters)
+    assert limiter.stats()['inflight'] == 3
+
+
+def test_cancel_frees_slot_without_changing_limit(limiter):
+    for host in ('http://a', 'http://a', 'http://b'):
+        assert limiter.acquire(host) is None
+    waiter = limiter.acquire('http://c')
+    limit = limiter.limit.limit
+
+    limiter.cancel('http://a')
+
+    assert waiter.is_set()
+    assert limiter.limit.limit == limit
+    assert limiter.stats()['inflight'] == 3
@@ -1,7 +1,10 @@
+import pickle
+import re
+
 import pytest
 
-from condition import StatusCondition, ContentCondition, RegexCondition
-from errors import ConditionError
+from condition import StatusCondition, ContentCondition, RegexCondition, BodyScanner, trie_regex
+from errors import ConditionError, InvalidConfigError
 
 
 class MockResponse:
@@ -52,3 +55,112 @@ def test_regex_condition():
         condition.validate(response)
 
     assert cm.value.message == 'The regex hasn\'t been matched.'.format(pattern)
+
+
+def test_body_scanner_matches_across_chunks():
+    scanner = BodyScanner([StatusCondition(200), ContentCondition('can be only one'),
+                           RegexCondition(r"I'm \d+ years old")])
+
+    assert not scanner.feed('In the end, there can be o')
+    assert not scanner.feed('nly one. I')
+    assert scanner.feed("'m 16 years old.")
+
+    scanner.finish()
+
+
+def test_body_scanner_reports_first_pending_condition():
+    scanner = BodyScanner([RegexCondition(r"I'm \d+ years old"), ContentCondition('can be only one')])
+
+    assert not scanner.feed('In the end, there can be only one')
+    assert not scanner.feed('What about two?')
+
+    with pytest.raises(ConditionError) as cm:
+        scanner.finish()
+
+    assert cm.value.message == 'The regex hasn\'t been matched.'
+
+
+def test_content_list():
+    condition = ContentCondition(['there can be', 'only one', 'can be only'])
+
+    condition.validate(MockResponse(status_code=200, text='In the end, there can be only one'))
+
+    with pytest.raises(ConditionError) as cm:
+        condition.validate(MockResponse(status_code=200, text='In the end, there can be two'))
+
+    assert cm.value.message == "2 of 3 strings haven't been found: 'only one', 'can be only'."
+
+
+@pytest.mark.parametrize('combined_minimum', [2, 128])
+@pytest.mark.parametrize('patterns', [
+    ['abc', 'bc', 'xyz'],
+    ['bcd', 'abc', 'xyz'],
+    ['ab', 'abcd', 'xyz'],
+    ['xyz', 'xyz', 'abc'],
+])
+def test_content_list_overlapping_strings(monkeypatch, combined_minimum, patterns):
+    monkeypatch.setattr(ContentCondition, 'combined_minimum', combined_minimum)
+    condition = ContentCondition(patterns)
+
+    assert (condition.combined is not None) == (combined_minimum == 2)
+    assert condition.search('-abcd-xyz-', condition.indices) == {0, 1, 2}
+    assert condition.search('-abcd-', condition.indices) == {index for index, pattern in enumerate(patterns)
+                                                              if pattern != 'xyz'}
+
+
+def test_trie_regex():
+    regex = re.compile(trie_regex(['abc', 'ab', 'abd', 'x.y']))
+
+    assert regex.pattern == r'(?:ab(?:(?:c|d))?|x\.y)'
+    assert [match.group() for match in regex.finditer('abcd abd ab xzy x.y')] == ['abc', 'abd', 'ab', 'x.y']
+
+
+def test_regex_list():
+    condition = RegexCondition([r"I'm \d+ years old", r'(\w+) and \1', r'(?i)JOHN', r'Mary'])
+
+    assert condition.search("John and John, I'm 16 years old", condition.indices) == {0, 1, 2}
+
+    with pytest.raises(ConditionError) as cm:
+        condition.validate(MockResponse(status_code=200, text="I'm 16 years old, said John and Jack"))
+
+    assert cm.value.message == "2 of 4 regexes haven't been matched: '(\\w+) and \\1', 'Mary'."
+
+
+def test_regex_list_overlapping_matches():
+    condition = RegexCondition([r'\d+ years', r'years old'])
+
+    assert condition.search("I'm 16 years old", condition.indices) == {0, 1}
+
+
+def test_invalid_patterns():
+    with pytest.raises(InvalidConfigError):
+        RegexCondition(['Mary', '(unclosed'])
+    with pytest.raises(InvalidConfigError):
+        ContentCondition(['Mary', {'name': 'John'}])
+
+
+def test_body_scanner_with_lists():
+    scanner = BodyScanner([ContentCondition(['can be only one', 'In the end']),
+                           RegexCondition([r"I'm \d+ years old", r'My name is \w+'])])
+
+    assert not scanner.feed('In the end, there can be o')
+    assert not scanner.feed('nly one. I')
+    assert not scanner.feed("'m 16 years old.")
+    assert scanner.pending[0][0].patterns[1] == r'My name is \w+'
+
+    with pytest.raises(ConditionError) as cm:
+        scanner.finish()
+
+    assert cm.value.message == "1 of 2 regexes haven't been matched: 'My name is \\w+'."
+
+
+def test_unpickled_conditions_compile_on_first_search(monkeypatch):
+    monkeypatch.setattr(ContentCondition, 'combined_minimum', 2)
+    content = pickle.loads(pickle.dumps(ContentCondition(['abc', 'ab', 'xyz'])))
+    regex = pickle.loads(pickle.dumps(RegexCondition([r'\d+ years', 'Mary'])))
+
+    assert content.combined is None and regex.regexes is None
+
+    assert content.search('-abc-', content.indices) == {0, 1}
+    assert regex.search("I'm 16 years old", regex.indices) == {0}
+    assert content.combined is not None and regex.pattern.pattern == r'\d+ years'
@@ -0,0 +1,88 @@
+import threading
+
+import yaml
+
+import base
+from base import BaseMonitor
+from configcache import ConfigCache
+
+
+class MockMonitor(BaseMonitor):
+
+    def __init__(self, cache):
+        super().__init__()
+        self.semaphore_recent_responses = threading.Lock()
+        self.config_cache = cache
+
+
+def write_config(path, url):
+    path.write(yaml.safe_dump({'log_file': str(path) + '.log', 'scheduler': {'jitter': True}, 'sites': {
+        'onet': {'url': url, 'schedule': '*/15 * * * * *', 'conditions': {'status': 200, 'regex': r'\d+'}},
+    }}))
+
+
+def test_unchanged_config_is_loaded_from_cache(tmpdir, monkeypatch):
+    config, cache = tmpdir.join('config.yaml'), str(tmpdir.join('config.cache'))
+    write_config(config, 'http://www.onet.pl/')
+    built = MockMonitor(cache)
+    built.load_config(str(config))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the config has been parsed')
+
+    monkeypatch.setattr(base, 'MonitoredResource', fail)
+    monkeypatch.setattr(BaseMonitor, '_parse_config', fail)
+    monitor = MockMonitor(cache)
+    monitor.load_config(str(config))
+
+    resource, = monitor.resources
+    assert resource.name == 'onet' and resource.url == 'http://www.onet.pl/'
+    assert resource.offset == built.resources[0].offset
+    assert resource.schedule.rules == ['*/15', '*', '*', '*', '*', '*']
+    assert monitor.site_configs == built.site_configs
+    assert monitor.jitter
+    assert resource.key in monitor.metrics.durations
+
+
+def test_changed_config_is_parsed_again(tmpdir):
+    config, cache = tmpdir.join('config.yaml'), str(tmpdir.join('config.cache'))
+    write_config(config, 'http://www.onet.pl/')
+    MockMonitor(cache).load_config(str(config))
+
+    write_config(config, 'http://www.wp.pl/')
+    monitor = MockMonitor(cache)
+    monitor.load_config(str(config))
+
+    assert monitor.resources[0].url == 'http://www.wp.pl/'
+    assert ConfigCache(cache, config.read_binary()).load()['resources'][0].url == 'http://www.wp.pl/'
+
+
+def test_config_edited_while_loading(tmpdir, monkeypatch):
+    config, cache = tmpdir.join('config.yaml'), str(tmpdir.join('config.cache'))
+    write_config(config, 'http://www.onet.pl/')
+    parsed = config.read_binary()
+    resource_class = base.MonitoredResource
+
+    def edit(*args, **kwargs):
+        write_config(config, 'http://www.wp.pl/')
+        return resource_class(*args, **kwargs)
+
+    monkeypatch.setattr(base, 'MonitoredResource', edit)
+    MockMonitor(cache).load_config(str(config))
+
+    # the sites are cached under the config they have been built from
+    assert ConfigCache(cache, config.read_binary()).load() is None
+    assert ConfigCache(cache, parsed).load()['resources'][0].url == 'http://www.onet.pl/'
+
+
+def test_broken_cache_is_ignored(tmpdir):
+    config, cache = tmpdir.join('config.yaml'), tmpdir.join('config.cache')
+    write_config(config, 'http://www.onet.pl/')
+    cache.write_binary(ConfigCache(str(cache), config.read_binary()).key + b'\nbroken')
+
+    assert ConfigCache(str(cache), config.read_binary()).load() is None
+
+    monitor = MockMonitor(str(cache))
+    monitor.load_config(str(config))
+
+    assert monitor.resources[0].url == 'http://www.onet.pl/'
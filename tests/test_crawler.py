@@ -1,17 +1,27 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
 import pytest
 import requests
 import responses
+from urllib3.exceptions import ReadTimeoutError
 
-from crawler import Crawler
+from condition import ContentCondition, StatusCondition, VerdictCache
+from crawler import Crawler, GroupCheck
 from errors import ConditionError
 from resource import ResourceStatus
+from session import SessionPool
 
 
 class MockResource:
 
-    def __init__(self, url, conditions):
+    def __init__(self, url, conditions, max_body_bytes=1024):
         self.url = url
         self.conditions = conditions
+        self.max_body_bytes = max_body_bytes
+        self.verdicts = VerdictCache()
 
 
 @pytest.fixture()
@@ -19,41 +29,214 @@ def my_resource():
     return MockResource('https://twitter.com/', [])
 
 
+class GzipHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = gzip.compress(b'There can be only one' + b'abcdefgh' * 500000)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture()
+def gzip_url():
+    server = ThreadingServer(('127.0.0.1', 0), GzipHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
 class MockConditionError:
     def __init__(self, *args, **kwargs):
         raise ConditionError('Invalid condition')
 
 
 @responses.activate
-def test_condition_error(my_resource, monkeypatch):
+def test_condition_error(monkeypatch):
     responses.add(responses.GET, 'https://twitter.com/', status=200)
 
-    monkeypatch.setattr("crawler.Crawler._check_conditions", MockConditionError)
+    monkeypatch.setattr("crawler.BodyReader.finish", MockConditionError)
 
-    response = Crawler(my_resource).check()
+    response = Crawler(MockResource('https://twitter.com/', [ContentCondition('only one')])).check()
 
     assert response.status == ResourceStatus.FAIL
     assert response.message == 'Invalid condition'
-    assert response.response
+    assert response.code == 200
 
 
+@pytest.mark.parametrize('error,timed_out', [
+    (requests.exceptions.RequestException(), False),
+    (requests.exceptions.ConnectionError(), False),
+    (requests.exceptions.ConnectTimeout(), True),
+    (requests.exceptions.ReadTimeout(), True),
+    # a read timeout in the middle of the body
+    (requests.exceptions.ConnectionError(ReadTimeoutError(None, None, 'Read timed out.')), True),
+])
 @responses.activate
-def test_request_error(my_resource):
-    responses.add(responses.GET, 'https://twitter.com/', body=requests.exceptions.RequestException())
+def test_request_error(my_resource, error, timed_out):
+    responses.add(responses.GET, 'https://twitter.com/', body=error)
 
-    response = Crawler(my_resource).check()
+    crawler = Crawler(my_resource)
+    response = crawler.check()
 
     assert response.status == ResourceStatus.FAIL
     assert response.message == 'Connection error. Unable to check the website.'
-    assert response.response is None
+    assert response.code is None
+    assert crawler.timed_out == timed_out
 
 
 @responses.activate
 def test_valid_condition(my_resource):
-    responses.add(responses.GET, 'https://twitter.com/', status=200)
+    responses.add(responses.GET, 'https://twitter.com/', status=200, content_type='text/html')
 
     response = Crawler(my_resource).check()
 
     assert response.status == ResourceStatus.SUCCESS
     assert response.message is None
-    assert response.response
+    assert response.code == 200
+    assert response.headers['Content-Type'] == 'text/html'
+    assert not hasattr(response, '__dict__')
+
+
+@responses.activate
+def test_check_with_session_pool(my_resource):
+    responses.add(responses.GET, 'https://twitter.com/', status=200)
+    sessions = SessionPool()
+
+    response = Crawler(my_resource, sessions=sessions).check()
+
+    assert response.status == ResourceStatus.SUCCESS
+    assert list(sessions.hosts) == ['https://twitter.com']
+
+
+@responses.activate
+def test_content_condition_streaming(monkeypatch):
+    responses.add(responses.GET, 'https://twitter.com/', status=200, body='Zażółć gęślą jaźń' * 10,
+                  content_type='text/html; charset=utf-8')
+    monkeypatch.setattr('crawler.Crawler.chunk_size', 3)
+
+    response = Crawler(MockResource('https://twitter.com/', [ContentCondition('gęślą jaźń')])).check()
+
+    assert response.status == ResourceStatus.SUCCESS
+
+
+@responses.activate
+def test_max_body_bytes():
+    responses.add(responses.GET, 'https://twitter.com/', status=200, body='x' * 2048 + 'needle')
+
+    response = Crawler(MockResource('https://twitter.com/', [ContentCondition('needle')])).check()
+
+    assert response.status == ResourceStatus.FAIL
+    assert response.message == 'The string hasn\'t been found. Only the first 1024 bytes of the body ' \
+                               'have been checked.'
+
+
+@responses.activate
+def test_not_modified_reuses_verdict():
+    requests_headers = []
+
+    def page(request):
+        requests_headers.append(dict(request.headers))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, ''
+        return 200, {'ETag': '"v1"', 'Last-Modified': 'Sat, 14 Jan 2012 12:00:00 GMT'}, 'There can be two'
+
+    responses.add_callback(responses.GET, 'https://twitter.com/', callback=page)
+    resource = MockResource('https://twitter.com/', [StatusCondition(200), ContentCondition('only one')])
+
+    first = Crawler(resource).check()
+    second = Crawler(resource).check()
+
+    assert 'If-None-Match' not in requests_headers[0]
+    assert requests_headers[1]['If-None-Match'] == '"v1"'
+    assert requests_headers[1]['If-Modified-Since'] == 'Sat, 14 Jan 2012 12:00:00 GMT'
+    assert (first.status, first.code) == (ResourceStatus.FAIL, 200)
+    assert (second.status, second.code) == (ResourceStatus.FAIL, 304)
+    assert second.message == first.message == 'The string hasn\'t been found.'
+
+
+@responses.activate
+def test_verdicts_of_identical_bodies_are_reused(monkeypatch):
+    bodies = iter(['There can be only one', 'There can be two'] * 3)
+    responses.add_callback(responses.GET, 'https://twitter.com/', callback=lambda request: (200, {}, next(bodies)))
+    searched = []
+    monkeypatch.setattr(ContentCondition, '_search_alone', lambda self, index, text: searched.append(text) or
+                        self.patterns[index] in text)
+    resource = MockResource('https://twitter.com/', [ContentCondition('only one')])
+
+    results = [Crawler(resource).check() for _ in range(2)]
+    searches = len(searched)
+    results += [Crawler(resource).check() for _ in range(4)]
+
+    assert [response.status for response in results] == [ResourceStatus.SUCCESS, ResourceStatus.FAIL] * 3
+    assert results[3].message == 'The string hasn\'t been found.'
+    assert len(searched) == searches
+
+
+@responses.activate
+def test_only_the_checked_part_of_the_body_is_read(monkeypatch):
+    body = 'There can be only one' + 'x' * 100000
+    responses.add(responses.GET, 'https://twitter.com/', status=200, body=body)
+    monkeypatch.setattr('crawler.Crawler.chunk_size', 64)
+    fed = []
+    feed = GroupCheck.feed
+    monkeypatch.setattr(GroupCheck, 'feed', lambda self, chunk: fed.append(len(chunk)) or feed(self, chunk))
+    resource = MockResource('https://twitter.com/', [ContentCondition('only one')])
+
+    results = [Crawler(resource).check() for _ in range(2)]
+
+    assert [response.status for response in results] == [ResourceStatus.SUCCESS] * 2
+    assert sum(fed) == 2 * 1088
+    assert len(resource.verdicts.bodies) == 1
+
+
+@responses.activate
+def test_long_bodies_are_not_hashed(monkeypatch):
+    responses.add(responses.GET, 'https://twitter.com/', status=200, body='x' * 2048 + 'needle')
+    monkeypatch.setattr(VerdictCache, 'max_body_bytes', 100)
+    monkeypatch.setattr('crawler.Crawler.chunk_size', 64)
+    resource = MockResource('https://twitter.com/', [ContentCondition('needle')], max_body_bytes=None)
+
+    assert Crawler(resource).check().status == ResourceStatus.SUCCESS
+    assert resource.verdicts.bodies == {}
+
+
+@responses.activate
+def test_group_shares_one_request():
+    responses.add(responses.GET, 'https://twitter.com/', status=200, body='There can be only one')
+    group = [
+        MockResource('https://twitter.com/', [StatusCondition(200), ContentCondition('only one')]),
+        MockResource('https://twitter.com/', [StatusCondition(201)]),
+        MockResource('https://twitter.com/', [ContentCondition(['only', 'two'])]),
+    ]
+
+    results = Crawler(group[0], group=group).check_group()
+
+    assert len(responses.calls) == 1
+    assert 'If-None-Match' not in responses.calls[0].request.headers
+    assert [response.resource for response in results] == group
+    assert [response.status for response in results] == [ResourceStatus.SUCCESS, ResourceStatus.FAIL,
+                                                          ResourceStatus.FAIL]
+    assert results[1].message == 'Invalid response code: 200 (expected 201)'
+    assert results[2].message == "1 of 2 strings haven't been found: 'two'."
+    assert all(response.code == 200 for response in results)
+
+
+def test_gzip_body_decided_early(gzip_url):
+    # the body is decoded while it's checked and the rest is drained after the needle has been found
+    response = Crawler(MockResource(gzip_url, [ContentCondition('only one')])).check()
+
+    assert response.status == ResourceStatus.SUCCESS
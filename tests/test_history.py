@@ -0,0 +1,56 @@
+import pickle
+
+import pytest
+
+from history import ResponseHistory
+
+
+@pytest.fixture()
+def history():
+    history = ResponseHistory(capacity=10)
+    for second in range(100):
+        history.append(timestamp=second, duration=second / 100.0, code=200, success=second % 4)
+    return history
+
+
+def test_capacity_is_bounded(history):
+    assert len(history) == 10
+    assert list(history.timestamps) == [90, 91, 92, 93, 94, 95, 96, 97, 98, 99]
+    assert [history.timestamps[index] for index in history.indices()] == list(range(90, 100))
+
+
+@pytest.mark.parametrize("percent,window,latency", [
+    (50, None, 0.94),
+    (95, None, 0.99),
+    (99, None, 0.99),
+    (0, None, 0.90),
+    (50, 3, 0.97),
+])
+def test_percentile(history, percent, window, latency):
+    assert history.percentile(percent, window=window, now=99) == latency
+
+
+@pytest.mark.parametrize("window,uptime", [
+    (None, 0.8),
+    (3, 0.75),
+])
+def test_uptime(history, window, uptime):
+    assert history.uptime(window=window, now=99) == uptime
+
+
+def test_empty_history():
+    history = ResponseHistory(capacity=10)
+    history.append(timestamp=1, duration=None, code=None, success=False)
+
+    assert history.percentile(50) is None
+    assert history.uptime(window=10, now=100) is None
+    assert history.uptime() == 0.0
+
+
+def test_pickle(history):
+    restored = pickle.loads(pickle.dumps(history))
+    empty = pickle.loads(pickle.dumps(ResponseHistory(capacity=5)))
+
+    assert list(restored.timestamps) == list(history.timestamps)
+    assert (len(restored), restored.position) == (10, history.position)
+    assert (len(empty), empty.capacity, len(empty.codes)) == (0, 5, 5)
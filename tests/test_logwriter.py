@@ -0,0 +1,84 @@
+import json
+import logging
+
+from logwriter import BatchingHandler, JsonFormatter, TextFormatter
+
+
+def make_record(message, **extra):
+    record = logging.LogRecord('monitor', logging.INFO, __file__, 0, message, (), None)
+    for field in JsonFormatter.fields:
+        setattr(record, field, extra.get(field))
+    return record
+
+
+def make_handler(path, **kwargs):
+    # a long interval keeps the writer thread out of the way, the tests flush explicitly
+    handler = BatchingHandler(str(path), flush_interval=3600, **kwargs)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def test_batches_json_lines(tmpdir):
+    path = tmpdir.join('monitor.log')
+    handler = make_handler(path)
+    handler.emit(make_record('OK', url='http://www.onet.pl/', status='Success', response_code=200))
+    handler.emit(make_record('Connection error.', url='http://www.foobar.pl/', status='Fail'))
+
+    assert path.read() == ''
+    handler.flush()
+
+    lines = [json.loads(line) for line in path.read().splitlines()]
+    assert [line['url'] for line in lines] == ['http://www.onet.pl/', 'http://www.foobar.pl/']
+    assert lines[0]['response_code'] == 200
+    assert lines[1]['message'] == 'Connection error.'
+    handler.close()
+
+
+def test_drops_records_when_buffer_is_full(tmpdir):
+    path = tmpdir.join('monitor.log')
+    handler = make_handler(path, buffer_size=2)
+    for number in range(5):
+        handler.emit(make_record('check {}'.format(number)))
+
+    handler.close()
+
+    lines = [json.loads(line) for line in path.read().splitlines()]
+    assert handler.dropped == 3
+    assert [line['message'] for line in lines] == ['check 0', 'check 1', '3 log records have been dropped.']
+    assert lines[-1]['level'] == 'WARNING'
+
+
+def test_rotates_by_size(tmpdir):
+    path = tmpdir.join('monitor.log')
+    handler = make_handler(path, max_bytes=150, backup_count=2)
+    for number in range(4):
+        handler.emit(make_record('check {}'.format(number)))
+        handler.flush()
+    handler.close()
+
+    assert sorted(file.basename for file in tmpdir.listdir()) == ['monitor.log', 'monitor.log.1', 'monitor.log.2']
+    assert 'check 3' in path.read()
+    assert 'check 2' in tmpdir.join('monitor.log.1').read()
+    assert 'check 0' not in path.read() + tmpdir.join('monitor.log.1').read() + tmpdir.join('monitor.log.2').read()
+
+
+def test_rotates_by_time(tmpdir):
+    path = tmpdir.join('monitor.log')
+    handler = make_handler(path, rotate_interval=60)
+    handler.emit(make_record('check 0'))
+    handler.flush()
+    handler.next_rotation = 0
+    handler.emit(make_record('check 1'))
+    handler.close()
+
+    assert 'check 0' in tmpdir.join('monitor.log.1').read()
+    assert 'check 1' in path.read()
+
+
+def test_text_phases():
+    formatter = TextFormatter('%(url)s %(phases_text)s %(message)s')
+    phases = dict(dns=None, connect=None, tls=None, ttfb=0.0504, download=0.002)
+
+    assert formatter.format(make_record('OK', url='http://www.onet.pl/', phases=phases)) == \
+        'http://www.onet.pl/ ttfb=0.050,download=0.002 OK'
+    assert formatter.format(make_record('OK', url='http://www.onet.pl/')) == 'http://www.onet.pl/ - OK'
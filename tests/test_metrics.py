@@ -0,0 +1,55 @@
+from metrics import Histogram, Metrics
+from resource import MonitoredResource, ResourceResponse, ResourceStatus
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert list(histogram.samples('duration', 'name="a"')) == [
+        'duration_bucket{name="a",le="0.1"} 2',
+        'duration_bucket{name="a",le="1.0"} 3',
+        'duration_bucket{name="a",le="+Inf"} 4',
+        'duration_sum{name="a"} 2.65',
+        'duration_count{name="a"} 4',
+    ]
+
+
+def test_render():
+    resource = MonitoredResource(dict(url='http://www.onet.pl/"', schedule='* * * * *', conditions=dict(status=200)),
+                                 name='onet')
+    metrics = Metrics()
+    metrics.register(resource)
+    success = ResourceResponse(resource, ResourceStatus.SUCCESS, duration=0.2)
+    success.code = 200
+    metrics.observe(success)
+    metrics.observe(success)
+    metrics.observe(ResourceResponse(resource, ResourceStatus.FAIL, message='Connection error.'))
+    metrics.scheduler_lag = 0.5
+
+    lines = metrics.render([('monitor_work_queue_depth', 'Jobs waiting in the work queue.', 3)],
+                           [('monitor_requests_total', 'Requests sent through the connection pools.', 7)]).splitlines()
+
+    assert 'monitor_check_duration_seconds_bucket{name="onet",url="http://www.onet.pl/\\"",le="0.25"} 2' in lines
+    assert 'monitor_check_duration_seconds_count{name="onet",url="http://www.onet.pl/\\""} 2' in lines
+    assert 'monitor_checks_total{status="success",code="200"} 2' in lines
+    assert 'monitor_checks_total{status="fail",code=""} 1' in lines
+    assert 'monitor_scheduler_lag_seconds 0.5' in lines
+    assert lines[-6:] == [
+        '# HELP monitor_work_queue_depth Jobs waiting in the work queue.',
+        '# TYPE monitor_work_queue_depth gauge',
+        'monitor_work_queue_depth 3',
+        '# HELP monitor_requests_total Requests sent through the connection pools.',
+        '# TYPE monitor_requests_total counter',
+        'monitor_requests_total 7',
+    ]
+
+
+def test_numeric_name():
+    resource = MonitoredResource(dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status=200)),
+                                 name=0)
+    metrics = Metrics()
+    metrics.register(resource)
+
+    assert metrics.labels[resource.key] == 'name="0",url="http://www.onet.pl/"'
@@ -1,7 +1,9 @@
+import datetime
+
 import pytest
 
 from errors import InvalidConfigError
-from resource import MonitoredResource
+from resource import MonitoredResource, ResourceResponse, ResourceStatus, normalize_url
 
 
 @pytest.mark.parametrize("config,error", [
@@ -10,10 +12,30 @@ from resource import MonitoredResource
     (dict(url='http://www.onet.pl/'), 'Invalid config file. The "schedule" section is missing.'),
     (dict(url='http://www.onet.pl/', schedule='* * *'),
      'Invalid config file. "* * *" is an invalid expression for the "schedule" section'),
+    (dict(url='http://www.onet.pl/', schedule='a * * * *'),
+     'Invalid config file. "a * * * *" is an invalid expression for the "schedule" section'),
+    (dict(url='http://www.onet.pl/', schedule='*/0 * * * *'),
+     'Invalid config file. "*/0 * * * *" is an invalid expression for the "schedule" section'),
+    (dict(url='http://www.onet.pl:port/', schedule='* * * * *'),
+     'Invalid config file. "http://www.onet.pl:port/" is an invalid value for the "url" section'),
     (dict(url='http://www.onet.pl/', schedule='* * * * *'),
      'Invalid config file. The "conditions" section is missing.'),
+    (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(header='Server')),
+     'Invalid config file. "header" is not a supported condition'),
+    (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status='abc')),
+     'Invalid config file. "abc" is an invalid value for the "status" condition'),
     (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status='')),
-     'Invalid config file. The "conditions" section is invalid.')
+     'Invalid config file. The "conditions" section is invalid.'),
+    (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status=200), max_body_bytes='a'),
+     'Invalid config file. "a" is an invalid value for the "max_body_bytes" section'),
+    (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status=200), max_body_bytes=0),
+     'Invalid config file. "0" is an invalid value for the "max_body_bytes" section'),
+    (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status=200), history_size=-1),
+     'Invalid config file. "-1" is an invalid value for the "history_size" section'),
+    (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(content=['smog', ''])),
+     'Invalid config file. The "conditions" section is invalid.'),
+    (dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(regex=['smog', '(smog'])),
+     'Invalid config file. "(smog" is an invalid regex: missing ), unterminated subpattern at position 0'),
 ])
 def test_load_invalid_config(config, error):
     with pytest.raises(InvalidConfigError) as cm:
@@ -21,3 +43,59 @@ def test_load_invalid_config(config, error):
 
     assert str(cm.value) == error
 
+
+def test_response_dump_and_load():
+    resource = MonitoredResource(dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status=200)))
+    response = ResourceResponse(resource, ResourceStatus.FAIL, duration=0.5, message='Connection error.')
+
+    loaded = ResourceResponse.load(resource, response.dump())
+
+    assert loaded.resource is resource
+    assert [getattr(loaded, name) for name in ResourceResponse.__slots__] == \
+        [getattr(response, name) for name in ResourceResponse.__slots__]
+
+
+@pytest.mark.parametrize('url,normalized', [
+    ('http://www.onet.pl', 'http://www.onet.pl/'),
+    ('HTTP://WWW.Onet.PL:80/Path?q=1#top', 'http://www.onet.pl/Path?q=1'),
+    ('https://www.onet.pl:443/', 'https://www.onet.pl/'),
+    ('https://www.onet.pl:8443/', 'https://www.onet.pl:8443/'),
+    ('http://user:pass@[::1]:8000/', 'http://user:pass@[::1]:8000/'),
+])
+def test_normalize_url(url, normalized):
+    assert normalize_url(url) == normalized
+
+
+def test_resource_key():
+    config = dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status=200))
+
+    keys = [MonitoredResource(config, name=name).key for name in ('1', 1, 0, None, 'onet')]
+
+    # a site named by a number in the YAML config is keyed by its name like any other
+    assert keys[0] == keys[1]
+    assert len(set(keys[1:])) == 4
+
+
+def test_jitter_offset():
+    offsets = [MonitoredResource.jitter_offset('http://site{}/'.format(number)) for number in range(6000)]
+    seconds = [0] * 60
+    for offset in offsets:
+        assert datetime.timedelta(0) <= offset < datetime.timedelta(minutes=1)
+        seconds[int(offset.total_seconds())] += 1
+
+    assert min(seconds) > 50 and max(seconds) < 150
+    assert MonitoredResource.jitter_offset('http://site1/') == offsets[1]
+
+
+def test_next_run_with_jitter():
+    config = dict(url='http://www.onet.pl/', schedule='*/5 * * * *', conditions=dict(status=200))
+    resource = MonitoredResource(config, jitter=True)
+    offset = resource.offset
+
+    first = resource.next_run(datetime.datetime(2012, 1, 14, 12, 32))
+    second = resource.next_run(first)
+
+    assert first == datetime.datetime(2012, 1, 14, 12, 35) + offset
+    assert second - first == datetime.timedelta(minutes=5)
+    assert MonitoredResource(dict(config, url='HTTP://WWW.ONET.PL/#top'), jitter=True).offset == offset
+    assert MonitoredResource(config).next_run(first) == datetime.datetime(2012, 1, 14, 12, 40)
@@ -1,8 +1,11 @@
+import datetime
+
 import pytest
 from freezegun import freeze_time
 
 from errors import InvalidScheduleException
-from schedule import MinuteMatcher, MonthMatcher, DayOfWeekMatcher, DayMatcher, HourMatcher, Matcher, Schedule
+from schedule import MinuteMatcher, MonthMatcher, DayOfWeekMatcher, DayMatcher, HourMatcher, Matcher, Schedule, \
+    ScheduleIndex, SecondMatcher
 
 
 @pytest.mark.parametrize("expression,valid_range", [
@@ -16,6 +19,24 @@ def test_minute_matcher_valid_range(expression, valid_range):
     assert MinuteMatcher(expression).valid_range == valid_range
 
 
+@pytest.mark.parametrize("expression,mask", [
+    ('*', 2 ** 60 - 1),
+    ('45', 1 << 45),
+    ('*/15', 1 | 1 << 15 | 1 << 30 | 1 << 45),
+])
+def test_minute_matcher_mask(expression, mask):
+    assert MinuteMatcher(expression).mask == mask
+
+
+@pytest.mark.parametrize("expression,value,next_valid", [
+    ('*/15', 0, 0),
+    ('*/15', 16, 30),
+    ('*/15', 46, None),
+])
+def test_minute_matcher_next_valid(expression, value, next_valid):
+    assert MinuteMatcher(expression).next_valid(value) == next_valid
+
+
 @pytest.mark.parametrize("expression,datetime,is_valid", [
     ('45', '2012-01-14 12:45', True),
     ('*/15', '2012-01-14 12:32', False)
@@ -105,7 +126,7 @@ def test_day_of_week_matcher_is_valid(expression, datetime, is_valid):
         assert MonthMatcher(expression).is_valid() == is_valid
 
 
-@pytest.mark.parametrize("expression,", [
+@pytest.mark.parametrize("expression", [
     '16/4',
     '*/*',
     '16/*',
@@ -129,3 +150,72 @@ def test_invalid_expressions(expression):
 @freeze_time('2012-01-14 12:32')
 def test_schedule_is_ready(rules, is_ready):
     assert Schedule(rules).is_ready() == is_ready
+
+
+@pytest.mark.parametrize("rules,after,next_run", [
+    ('* * * * *', '2012-01-14 12:32', '2012-01-14 12:33'),
+    ('*/15 * * * *', '2012-01-14 12:45', '2012-01-14 13:00'),
+    ('30 8 * * *', '2012-01-14 12:32', '2012-01-15 08:30'),
+    ('0 0 1 * *', '2012-12-14 12:32', '2013-01-01 00:00'),
+    ('0 12 * * 1', '2012-01-14 12:32', '2012-01-16 12:00'),
+    ('0 0 29 2 *', '2012-03-01 00:00', '2016-02-29 00:00'),
+    ('0 0 31 4 *', '2012-01-14 12:32', None),
+])
+def test_schedule_next_run(rules, after, next_run):
+    after = datetime.datetime.strptime(after, '%Y-%m-%d %H:%M')
+    if next_run is not None:
+        next_run = datetime.datetime.strptime(next_run, '%Y-%m-%d %H:%M')
+
+    assert Schedule(rules).next_run(after) == next_run
+
+
+@pytest.mark.parametrize("rules,after,next_run", [
+    ('*/15 * * * * *', '2012-01-14 12:32:00', '2012-01-14 12:32:15'),
+    ('*/15 * * * * *', '2012-01-14 12:32:50', '2012-01-14 12:33:00'),
+    ('10,40 */2 * * * *', '2012-01-14 12:32:40', '2012-01-14 12:34:10'),
+    ('0 0 13 * * *', '2012-01-14 12:59:59', '2012-01-14 13:00:00'),
+    ('30 0 0 31 4 *', '2012-01-14 12:32:00', None),
+])
+def test_schedule_next_run_with_seconds(rules, after, next_run):
+    after = datetime.datetime.strptime(after, '%Y-%m-%d %H:%M:%S')
+    if next_run is not None:
+        next_run = datetime.datetime.strptime(next_run, '%Y-%m-%d %H:%M:%S')
+
+    assert Schedule(rules).next_run(after) == next_run
+
+
+def test_second_matcher():
+    assert SecondMatcher('*/20').valid_range == {0, 20, 40}
+    assert SecondMatcher('*/20').matches(datetime.datetime(2012, 1, 14, 12, 32, 40))
+    assert Schedule('*/20 * * * * *').is_ready(datetime.datetime(2012, 1, 14, 12, 32, 40))
+    assert not Schedule('*/20 * * * * *').is_ready(datetime.datetime(2012, 1, 14, 12, 32, 41))
+
+
+def test_schedule_is_ready_at():
+    schedule = Schedule('30-40 12 14 1 6')
+
+    assert schedule.is_ready(datetime.datetime(2012, 1, 14, 12, 32))
+    assert not schedule.is_ready(datetime.datetime(2012, 1, 14, 12, 41))
+
+
+def test_schedule_index_due():
+    rules = ['* * * * *', '32 13-17 * * *', '30-40 12 14 1 6', '* 12 13,14 1 1-5', '*/2 * * * *']
+    index = ScheduleIndex(Schedule(rule) for rule in rules)
+    now = datetime.datetime(2012, 1, 14, 12, 32)
+
+    assert index.due(now) == [i for i, rule in enumerate(rules) if Schedule(rule).is_ready(now)] == [0, 2, 4]
+
+    index.remove(2)
+
+    assert index.due(now) == [0, 4]
+    assert index.due(datetime.datetime(2012, 1, 14, 12, 33)) == [0]
+
+
+def test_schedule_index_seconds():
+    rules = ['30 * * * * *', '* * * * *', '*/5 * * * * *']
+    index = ScheduleIndex(Schedule(rule) for rule in rules)
+
+    for second in (0, 5, 30, 31):
+        now = datetime.datetime(2012, 1, 14, 12, 32, second)
+        assert index.due(now) == [i for i, rule in enumerate(rules) if Schedule(rule).is_ready(now)]
+    assert index.due(datetime.datetime(2012, 1, 14, 12, 32, 5)) == [1, 2]
@@ -0,0 +1,88 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from session import SessionPool, response_timings
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'OK'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server_url():
+    server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_per_host():
+    sessions = SessionPool()
+
+    assert sessions.session('https://twitter.com/') is sessions.session('https://Twitter.com/login')
+    assert sessions.session('https://twitter.com/') is not sessions.session('http://twitter.com/')
+    assert sessions.session('https://twitter.com/') is not sessions.session('https://www.onet.pl/')
+
+
+def test_idle_sessions_expire():
+    sessions = SessionPool(idle_timeout=60)
+    sessions.session('https://twitter.com/')
+    sessions.session('https://www.onet.pl/')
+    sessions.hosts['https://twitter.com'].last_used -= 120
+
+    sessions.expire()
+
+    assert list(sessions.hosts) == ['https://www.onet.pl']
+
+
+def test_connection_reuse_stats(server_url):
+    sessions = SessionPool()
+
+    for _ in range(3):
+        sessions.session(server_url).get(server_url, timeout=10).close()
+
+    stats = sessions.stats()
+    assert stats['requests'] == 3
+    assert stats['connections'] == 1
+    assert stats['reused'] == 2
+    assert stats['hosts'][0]['reused'] == 2
+
+    sessions.expire(now=sessions.hosts[stats['hosts'][0]['host']].last_used + 60)
+
+    assert sessions.hosts == {}
+    assert sessions.stats()['reused'] == 2
+
+
+def test_phase_timings(server_url):
+    sessions = SessionPool()
+    url = server_url.replace('127.0.0.1', 'localhost')
+
+    first = sessions.session(url).get(url, timeout=10)
+    first_timings = response_timings(first)
+    first.close()
+    second = sessions.session(url).get(url, timeout=10)
+    second_timings = response_timings(second)
+    second.close()
+    sessions.close()
+
+    assert first_timings['dns'] >= 0
+    assert first_timings['connect'] >= 0
+    assert first_timings['tls'] is None
+    assert first_timings['ttfb'] > 0
+    assert second_timings == dict(dns=None, connect=None, tls=None, ttfb=second_timings['ttfb'])
+    assert second_timings['ttfb'] > 0
@@ -0,0 +1,141 @@
+import datetime
+
+import pytest
+
+from errors import InvalidConfigError
+from resource import MonitoredResource, ResourceResponse, ResourceStatus
+from store import ResultStore
+
+
+def make_resource(name, history_size=5):
+    return MonitoredResource(dict(url='http://www.onet.pl/', schedule='* * * * *', conditions=dict(status=200),
+                                  history_size=history_size), name=name)
+
+
+def make_response(resource, minute, status=ResourceStatus.SUCCESS, message=None):
+    response = ResourceResponse(resource, status, duration=minute / 10.0, message=message)
+    response.code = 200 if status == ResourceStatus.SUCCESS else 500
+    response.last_check = datetime.datetime(2019, 1, 14, 12, minute)
+    return response
+
+
+class CountingRecord:
+
+    def __init__(self, record):
+        self.record = record
+        self.read = 0
+
+    def __getattr__(self, name):
+        return getattr(self.record, name)
+
+    def unpack_from(self, buffer, offset):
+        self.read += 1
+        return self.record.unpack_from(buffer, offset)
+
+
+def test_restore(tmpdir):
+    path = str(tmpdir.join('results.db'))
+    onet, other = make_resource('onet'), make_resource('other')
+    store = ResultStore(path)
+    for minute in range(10):
+        store.append(make_response(onet, minute))
+    store.append(make_response(other, 10, status=ResourceStatus.FAIL, message='Connection error.'))
+    store.close()
+
+    onet, other, new = make_resource('onet'), make_resource('other'), make_resource('new')
+    store = ResultStore(path)
+    restored = store.restore([onet, other, new])
+
+    assert store.count == 11
+    assert set(restored) == {onet, other}
+    assert restored[onet].status == ResourceStatus.SUCCESS
+    assert restored[onet].code == 200
+    assert restored[onet].duration == 0.9
+    assert restored[onet].last_check == datetime.datetime(2019, 1, 14, 12, 9)
+    assert restored[other].status == ResourceStatus.FAIL
+    assert restored[other].message == 'Connection error.'
+    assert [onet.history.timestamps[index] for index in onet.history.indices()] == \
+        [datetime.datetime(2019, 1, 14, 12, minute).timestamp() for minute in range(5, 10)]
+    assert len(new.history) == 0
+
+
+def test_compaction_bounds_the_file(tmpdir):
+    path = str(tmpdir.join('results.db'))
+    onet, other = make_resource('onet'), make_resource('other')
+    store = ResultStore(path, max_records=20, retention=float('inf'), keep_per_resource=3)
+    for minute in range(20):
+        store.append(make_response(onet if minute % 2 else other, minute))
+
+    assert store.needs_compaction
+    # the records appended while the kept ones are written to the new file are carried over
+    snapshot = store.start_compaction()
+    assert not store.needs_compaction
+    compaction = store.prepare_compaction(snapshot)
+    for minute in range(20, 30):
+        store.append(make_response(onet if minute % 2 else other, minute))
+    store.finish_compaction(compaction)
+
+    assert store.count == 16
+    assert not store.compacting
+    assert [record[1] for record in store.records()] == \
+        [datetime.datetime(2019, 1, 14, 12, minute).timestamp() for minute in range(14, 30)]
+    assert [record[1] for record in store.history(onet.key, 4)] == \
+        [datetime.datetime(2019, 1, 14, 12, minute).timestamp() for minute in (29, 27, 25, 23)]
+
+
+def test_retention(tmpdir):
+    onet = make_resource('onet')
+    store = ResultStore(str(tmpdir.join('results.db')), retention=60)
+    for minute in range(10):
+        store.append(make_response(onet, minute))
+
+    store.compact(now=datetime.datetime(2019, 1, 14, 12, 9).timestamp())
+
+    assert [record[1] for record in store.records()] == \
+        [datetime.datetime(2019, 1, 14, 12, minute).timestamp() for minute in (8, 9)]
+
+
+def test_index(tmpdir, monkeypatch):
+    path = str(tmpdir.join('results.db'))
+    onet, other = make_resource('onet'), make_resource('other')
+    monkeypatch.setattr(ResultStore, 'grow_records', 4)
+    store = ResultStore(path)
+    for minute in range(10):
+        store.append(make_response(onet, minute))
+    store.append(make_response(other, 10))
+    # a crash: the index has been saved when the file last grew, with 8 records
+    store._close()
+
+    store = ResultStore(path)
+    assert store.last == {onet.key: 9, other.key: 10}
+    store.close()
+
+    record = CountingRecord(ResultStore.record)
+    monkeypatch.setattr(ResultStore, 'record', record)
+    store = ResultStore(path)
+    onet = make_resource('onet')
+    store.restore([onet])
+    # only the records of the history are read
+    assert record.read == 5
+
+
+def test_upgrade_of_the_first_version(tmpdir):
+    path = tmpdir.join('results.db')
+    onet = make_resource('onet')
+    records = [ResultStore.legacy_record.pack(onet.key, datetime.datetime(2019, 1, 14, 12, minute).timestamp(),
+                                              0.1, 200, True, b'') for minute in range(3)]
+    path.write_binary(ResultStore.legacy_header.pack(b'WMRS', 1, ResultStore.legacy_record.size, 3) + b''.join(records))
+
+    store = ResultStore(str(path))
+
+    assert store.count == 3
+    assert [record[1] for record in store.history(onet.key, 5)] == \
+        [datetime.datetime(2019, 1, 14, 12, minute).timestamp() for minute in (2, 1, 0)]
+
+
+def test_invalid_file(tmpdir):
+    path = tmpdir.join('results.db')
+    path.write('not a results file')
+
+    with pytest.raises(InvalidConfigError):
+        ResultStore(str(path))
@@ -0,0 +1,51 @@
+import datetime
+import random
+
+from timerwheel import TimerWheel
+
+NOON = datetime.datetime(2012, 1, 14, 12, 0, 30)
+
+
+def test_empty_wheel():
+    wheel = TimerWheel(NOON)
+
+    assert len(wheel) == 0
+    assert wheel.peek() is None
+    assert wheel.pop() == (None, [])
+
+
+def test_timers_expire_in_order():
+    generator = random.Random(7)
+    wheel = TimerWheel(NOON)
+    moments = [NOON + datetime.timedelta(seconds=generator.choice([5, 59, 61, 3599, 3601, 86399, 86401, 200000]) +
+                                         generator.randrange(60)) for _ in range(500)]
+    for number, moment in enumerate(moments):
+        wheel.add(moment, number)
+
+    expired = []
+    while wheel:
+        tick, entries = wheel.pop()
+        for moment, number in entries:
+            assert moment == tick
+            expired.append(number)
+
+    assert expired == sorted(range(len(moments)), key=lambda number: (moments[number], number))
+
+
+def test_due_timers_expire_in_current_tick():
+    wheel = TimerWheel(NOON)
+    wheel.add(NOON - datetime.timedelta(minutes=5), 'late')
+    wheel.add(NOON + datetime.timedelta(seconds=10), 'next')
+
+    assert wheel.peek() == NOON
+    assert wheel.pop() == (NOON, [(NOON - datetime.timedelta(minutes=5), 'late')])
+    assert wheel.peek() == NOON + datetime.timedelta(seconds=10)
+
+
+def test_peek_stops_at_next_minute():
+    wheel = TimerWheel(NOON)
+    wheel.add(NOON + datetime.timedelta(hours=2), 'later')
+
+    assert wheel.peek() == datetime.datetime(2012, 1, 14, 12, 1)
+    assert wheel.pop() == (datetime.datetime(2012, 1, 14, 12, 1), [])
+    assert len(wheel) == 1
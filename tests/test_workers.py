@@ -0,0 +1,42 @@
+import multiprocessing
+
+from resource import ResourceResponse, ResourceStatus
+from workers import ShardedMonitor, ShardMonitor, shard_of
+
+
+def test_shard_of():
+    urls = ['http://www.example{}.com/'.format(number) for number in range(1000)]
+    shards = [shard_of(url, 4) for url in urls]
+
+    assert shards == [shard_of(url, 4) for url in urls]
+    assert set(shards) == {0, 1, 2, 3}
+    assert all(200 < shards.count(shard) < 300 for shard in range(4))
+
+
+def test_receive_results(make_resource):
+    monitor = ShardedMonitor(workers=2)
+    monitor.resources = [make_resource('onet'), make_resource('twitter')]
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    response = ResourceResponse(monitor.resources[1], ResourceStatus.SUCCESS, duration=0.5)
+    host = {'host': 'http://twitter', 'requests': 3, 'connections': 1, 'reused': 2}
+    writer.send(('result', monitor.resources[1].key, response.dump()))
+    writer.send(('connections', {'hosts': [host], 'requests': 3, 'connections': 1, 'reused': 2}))
+    writer.close()
+
+    monitor._receive(1, reader)
+
+    assert list(monitor.recent_responses) == [monitor.resources[1]]
+    assert monitor.recent_responses[monitor.resources[1]].duration == 0.5
+    assert len(monitor.resources[1].history) == 1
+    assert monitor._connection_stats() == {'hosts': [host], 'requests': 3, 'connections': 1, 'reused': 2}
+
+
+def test_shard_inherits_settings(make_resource):
+    parent = ShardedMonitor(workers=2)
+    parent.pool_size = 4
+    parent.concurrency = {'per_host': 2}
+
+    shard = ShardMonitor(parent, [make_resource('onet')], connection=None)
+
+    assert shard.pool_size == 4
+    assert shard.concurrency == {'per_host': 2}
@@ -0,0 +1,130 @@
+import datetime
+import threading
+
+import pytest
+
+from workqueue import Job, WorkQueue
+
+NOON = datetime.datetime(2012, 1, 14, 12, 0)
+
+
+def minutes(count):
+    return NOON + datetime.timedelta(minutes=count)
+
+
+@pytest.fixture()
+def workq():
+    return WorkQueue(threading.Event, size=3, workers=2)
+
+
+def test_jobs_in_scheduled_order(workq):
+    late, early = Job(['wp'], minutes(1)), Job(['onet'], minutes(0))
+    workq.put(late, now=NOON)
+    workq.put(early, now=NOON)
+
+    assert workq.ready.is_set()
+    assert workq.get(now=NOON) is early
+    assert workq.get(now=NOON) is late
+    assert workq.get(now=NOON) is None
+    assert not workq.ready.is_set()
+
+
+def test_workers_limit(workq):
+    jobs = [Job([name], NOON) for name in ('onet', 'wp', 'gazeta')]
+    for job in jobs:
+        workq.put(job, now=NOON)
+
+    assert workq.get(now=NOON) is jobs[0]
+    assert workq.get(now=NOON) is jobs[1]
+    assert workq.get(now=NOON) is None
+    assert not workq.ready.is_set()
+
+    workq.done(jobs[0])
+
+    assert workq.ready.is_set()
+    assert workq.get(now=NOON) is jobs[2]
+
+
+def test_full_queue(workq):
+    for name in ('onet', 'wp', 'gazeta'):
+        workq.put(Job([name], NOON), now=NOON)
+
+    assert not workq.not_full.is_set()
+
+    workq.get(now=NOON)
+
+    assert workq.not_full.is_set()
+
+
+def test_resources_in_flight_are_skipped(workq):
+    running = Job(['onet'], minutes(0), deadline=minutes(1))
+    waiting = Job(['wp'], minutes(0), deadline=minutes(1))
+    workq.put(running, now=minutes(0))
+    workq.put(waiting, now=minutes(0))
+    workq.get(now=minutes(0))
+
+    assert not workq.put(Job(['onet'], minutes(0)), now=minutes(0.5))
+    assert not workq.put(Job(['wp'], minutes(0)), now=minutes(0.5))
+    assert workq.skipped == 2
+
+    # a job that has missed its deadline gives its resources up to the next job
+    later = Job(['onet', 'wp'], minutes(1), deadline=minutes(2))
+    assert workq.put(later, now=minutes(1))
+
+    assert later.resources == ['wp']
+    assert workq.skipped == 3
+    assert workq.dropped == 1
+    assert workq.get(now=minutes(1)) is later
+
+
+def test_expired_jobs_are_dropped(workq):
+    workq.put(Job(['onet', 'wp'], minutes(0), deadline=minutes(1)), now=NOON)
+    fresh = Job(['gazeta'], minutes(0), deadline=minutes(5))
+    workq.put(fresh, now=NOON)
+
+    assert workq.get(now=minutes(2)) is fresh
+    assert workq.dropped == 2
+    assert len(workq) == 0
+
+    workq.done(fresh, dropped=True)
+
+    assert workq.dropped == 3
+    assert workq.running == set()
+
+
+def test_slow_host_doesnt_hold_every_worker():
+    workq = WorkQueue(threading.Event, size=100, workers=10, per_host=4)
+    slow = [Job(['slow{}'.format(number)], minutes(0), host='http://slow') for number in range(20)]
+    fast = [Job(['fast{}'.format(number)], minutes(1), host='http://fast{}'.format(number)) for number in range(5)]
+    for job in slow + fast:
+        workq.put(job, now=NOON)
+
+    started = [workq.get(now=NOON) for _ in range(10)]
+
+    assert started[:4] == slow[:4]
+    assert started[4:9] == fast
+    assert started[9] is None
+    assert not workq.ready.is_set()
+    assert len(workq) == 16
+
+    # a job of the slow host that is done lets the next one start
+    workq.done(slow[0])
+    assert workq.get(now=NOON) is slow[4]
+    assert workq.get(now=NOON) is None
+
+
+def test_held_back_jobs_expire():
+    workq = WorkQueue(threading.Event, size=100, workers=10, per_host=1)
+    running = Job(['onet'], minutes(0), deadline=minutes(1), host='http://onet')
+    stale = Job(['wp'], minutes(0), deadline=minutes(1), host='http://onet')
+    fresh = Job(['gazeta'], minutes(0), deadline=minutes(5), host='http://onet')
+    for job in (running, stale, fresh):
+        workq.put(job, now=NOON)
+    workq.get(now=NOON)
+    assert workq.get(now=NOON) is None
+
+    workq.done(running)
+
+    assert workq.get(now=minutes(2)) is fresh
+    assert workq.dropped == 1
+    assert len(workq) == 0